@@ -0,0 +1,77 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+## Files/s of the cache loaders on generated cache files: the previous two-pass text loader,
+## the single-pass text loader (utils.load_text) and the npz loader (utils.load_binary).
+## Run with `python benchmarks/bench_cache_load.py`
+
+import sys, time, shutil, tempfile
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import utils
+
+NUM_FILES = 300
+NUM_PROPS = 40
+SIZES     = [32, 64, 128, 192]
+
+def two_pass_load(fname):
+    ## previous loader, the props are parsed from all lines and the data is read again by np.loadtxt
+    props = {}
+    for line in open(fname):
+        m = utils.fit_float_pattern.search(line)
+        if m:
+            props[m.group(1).strip()] = float(m.group(2))
+            continue
+        m = utils.fit_string_pattern.search(line)
+        if m:
+            props[m.group(1).strip()] = m.group(2)
+            continue
+        m = utils.fit_array_pattern.search(line)
+        if m:
+            props[m.group(1).strip()] = np.array([float(v) for v in m.group(2).split(',')])
+    return np.loadtxt(fname), props
+
+def generate(directory):
+    rng = np.random.RandomState(0)
+    files = []
+    for i in range(NUM_FILES):
+        props = dict([('parm%d' % k, float(k)) for k in range(NUM_PROPS)])
+        props['observable'] = 'Pairfield Correlation'
+        props['bond_dims'] = np.arange(8.)
+        fname = path.join(directory, 'result%d.txt' % i)
+        utils.save_text(fname, rng.rand(SIZES[i % len(SIZES)], 2), props)
+        files.append(fname)
+    return files
+
+def files_per_second(loader, files):
+    t0 = time.time()
+    for fname in files:
+        loader(fname)
+    return len(files) / (time.time() - t0)
+
+def main():
+    directory = tempfile.mkdtemp()
+    try:
+        files = generate(directory)
+        for fname in files:
+            utils.save_binary(utils.binary_filename(fname), *utils.load_text(fname))
+        
+        d_old, p_old = two_pass_load(files[0])
+        d_new, p_new = utils.load_text(files[0])
+        if not np.allclose(d_old, d_new) or sorted(p_old) != sorted(p_new):
+            raise Exception('Single-pass loader differs from the two-pass loader')
+        
+        print '# {} cache files with {} props and {}-{} rows'.format(NUM_FILES, NUM_PROPS+2, min(SIZES), max(SIZES))
+        print 'two-pass text loader   {:6.0f} files/s'.format(files_per_second(two_pass_load, files))
+        print 'single-pass text loader {:5.0f} files/s'.format(files_per_second(utils.load_text, files))
+        print 'npz loader             {:6.0f} files/s'.format(files_per_second(lambda f: utils.load_binary(utils.binary_filename(f)), files))
+    finally:
+        shutil.rmtree(directory)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+## collectXY on generated energy datasets: the previous loop extending the x/y arrays of each
+## group one dataset at a time, and the grouped gather of pyalps_dset.collectXY.
+## The same datasets with CowProps props are then collected repeatedly, as for several plots of one scan.
+## Run with `python benchmarks/bench_collectxy.py`
+
+import sys, time
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+from pyalps_dset import DataSet, CowProps, collectXY, flatten, dict_intersect
+
+CASES = [ # (datasets, groups, values per dataset)
+    (1000,  64,  1),
+    (20000, 16,  1),
+    (10000,  1, 20),
+]
+REPEAT = 5
+
+def per_dataset_collect(sets, x, y, foreach=[]):
+    ## previous collectXY, each dataset is concatenated to the x/y arrays of its group
+    foreach_sets = {}
+    for iset in flatten(sets):
+        if iset.props['observable'] != y and not y in iset.props:
+            continue
+        foreach_sets.setdefault(tuple((iset.props[m] for m in foreach)), []).append(iset)
+    for k,v in foreach_sets.items():
+        res = DataSet()
+        res.props = dict_intersect([q.props for q in v])
+        for data in v:
+            if data.props['observable'] == y:
+                xvalue = np.array([data.props[x] for i in range(len(data.y))])
+                yvalue = data.y
+            else:
+                xvalue = np.array([ data.props[x] ])
+                yvalue = np.array([ data.props[y] ])
+            if len(res.x) > 0 and len(res.y) > 0:
+                res.x = np.concatenate((res.x, xvalue))
+                res.y = np.concatenate((res.y, yvalue))
+            else:
+                res.x = xvalue
+                res.y = yvalue
+        order = np.argsort(res.x, kind = 'mergesort')
+        res.x = res.x[order]
+        res.y = res.y[order]
+        foreach_sets[k] = res
+    return foreach_sets.values()
+
+def generate(n, ngroups, ylen):
+    rng = np.random.RandomState(0)
+    sets = []
+    for i in range(n):
+        g = rng.randint(ngroups)
+        d = DataSet()
+        d.props = {'observable': 'Energy', 'L': float(32+16*(g%8)), 'tp': g//8,
+                   'max_bond_dimension': float(rng.randint(1,50)*100), 'filename': 'run%d.h5' % i}
+        d.y = rng.rand(ylen)
+        d.x = np.arange(ylen)
+        sets.append(d)
+    return [sets[i:i+10] for i in range(0, n, 10)]
+
+def timed(f, *args, **kwargs):
+    t0 = time.time()
+    res = f(*args, **kwargs)
+    return res, time.time() - t0
+
+def main():
+    for n, ngroups, ylen in CASES:
+        sets = generate(n, ngroups, ylen)
+        old, t_old = timed(per_dataset_collect, sets, 'max_bond_dimension', 'Energy', ['L', 'tp'])
+        new, t_new = timed(collectXY, sets, 'max_bond_dimension', 'Energy', foreach=['L', 'tp'])
+        for r, q in zip(new, old):
+            if r.x.dtype != q.x.dtype or not np.array_equal(r.x, q.x) or not np.array_equal(r.y, q.y):
+                raise Exception('collectXY differs from the per-dataset loop')
+        print '{:6d} datasets, {:3d} groups, {:2d} values each: per-dataset loop {:7.3f} s, collectXY {:7.3f} s'.format(n, len(new), ylen, t_old, t_new)
+    
+    for n, ngroups, ylen in CASES:
+        sets = generate(n, ngroups, ylen)
+        for d in flatten(sets):
+            d.props = CowProps(d.props)
+        times = [timed(collectXY, sets, 'max_bond_dimension', 'Energy', foreach=['L', 'tp'])[1] for r in range(REPEAT)]
+        print '{:6d} CowProps datasets, {:3d} groups: first collectXY {:7.3f} s, repeated {:7.3f} s'.format(n, ngroups, times[0], min(times[1:]))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+## Micro-benchmark of the density correlator: fused rung reduction (density_correlations.rung_density_correlator)
+## against the previous sum of 16 np.ix_ blocks, runtime and peak memory of the temporaries.
+## Run with `python benchmarks/bench_density_correlator.py`
+
+import os, sys, time, ctypes
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+from corr_helpers import index_map
+from density_correlations import rung_density_correlator
+
+SIZES   = [32, 64, 96, 128, 192, 384]
+REPEATS = 20
+
+def blockwise_correlator(site_corrs, site_dens, idx):
+    ## previous implementation, one np.ix_ copy per leg pair and spin channel
+    L = idx.shape[0]
+    lower, upper = idx[:,0], idx[:,1]
+    dens_on_rungs = site_dens[lower] + site_dens[upper]
+    dcor = np.zeros((L,L))
+    for a in (lower, upper):
+        for b in (lower, upper):
+            for c in site_corrs:
+                dcor += c[np.ix_(a,b)]
+    dcor -= np.outer(dens_on_rungs, dens_on_rungs)
+    return dcor
+
+def timeit(func, *args):
+    t0 = time.time()
+    for _ in range(REPEATS):
+        res = func(*args)
+    return (time.time() - t0) / REPEATS, res
+
+def memory_status(key):
+    for line in open('/proc/self/status'):
+        if line.startswith(key + ':'):
+            return int(line.split()[1])
+
+def peak_memory(setup, func):
+    ## peak resident memory in kB added by func(*setup()), measured in a forked child
+    ## after resetting its high-water mark (Linux with glibc only, None elsewhere)
+    if not path.exists('/proc/self/clear_refs'):
+        return None
+    rfd, wfd = os.pipe()
+    pid = os.fork()
+    if pid == 0:
+        os.close(rfd)
+        try:
+            args = setup()
+            ## return the memory freed by earlier runs to the system, such that it is counted again
+            ctypes.CDLL('libc.so.6').malloc_trim(0)
+            with open('/proc/self/clear_refs', 'w') as ff:
+                ff.write('5')
+            before = memory_status('VmRSS')
+            func(*args)
+            os.write(wfd, str(memory_status('VmHWM') - before))
+        finally:
+            os._exit(0)
+    os.close(wfd)
+    res = os.read(rfd, 64)
+    os.close(rfd)
+    os.waitpid(pid, 0)
+    return int(res) if res else None
+
+def noop(*args):
+    pass
+
+def format_memory(kb):
+    return 'n/a' if kb is None else '{:.1f}'.format(kb / 1024.)
+
+def main():
+    print '# random (2L)x(2L) channels, mean of {} runs, the fused timing includes copying the inputs'.format(REPEATS)
+    print '# peak memory of one call on top of the inputs and of an empty call, the fused correlator sums the channels in place'
+    print '# {:>5} {:>14} {:>14} {:>8} {:>14} {:>14}'.format('L', 'ix_ blocks [s]', 'fused [s]', 'speedup', 'ix_ blocks [MB]', 'fused [MB]')
+    for L in SIZES:
+        idx = index_map(L, 2)
+        rng = np.random.RandomState(L)
+        corrs = [rng.rand(2*L, 2*L) for _ in range(4)]
+        dens = rng.rand(2*L)
+        t_old, ref = timeit(blockwise_correlator, corrs, dens, idx)
+        t_new, res = timeit(lambda: rung_density_correlator([c.copy() for c in corrs], dens, idx))
+        if not np.allclose(ref, res):
+            raise Exception('Fused correlator differs from the blockwise result for L=%s' % L)
+        base  = peak_memory(lambda: (corrs, dens, idx), noop)
+        m_old = peak_memory(lambda: (corrs, dens, idx), blockwise_correlator)
+        m_new = peak_memory(lambda: ([c.copy() for c in corrs], dens, idx), rung_density_correlator)
+        if base is not None:
+            m_old, m_new = m_old - base, m_new - base
+        print '  {:>5} {:>14.2e} {:>14.2e} {:>8.1f} {:>15} {:>14}'.format(L, t_old, t_new, t_old/t_new, format_memory(m_old), format_memory(m_new))
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+## Time of the density fits on synthetic Friedel profiles: one scipy.optimize.leastsq call
+## per density (previous implementation) and all densities in one density.fit_density_batch call.
+## Run with `python benchmarks/bench_density_fit.py`
+
+import sys, time
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+from scipy import optimize
+import density
+
+SIZES     = [48, 64, 96, 128, 192, 256]
+NUM_FITS  = [6, 24, 96, 384]
+REPEAT    = 3
+
+def profiles(nfits, seed=0):
+    ## windows of densities of the model with random parameters and noise
+    rng = np.random.RandomState(seed)
+    ffs, xs, ys = [], [], []
+    for i in range(nfits):
+        L = SIZES[i % len(SIZES)]
+        ff = density.fit_func(L, L/8)
+        x = np.arange(0.5, L, 1.)
+        p = [ff.nholes/ff.L, 0.02 + 0.02*rng.rand(), 0.3 + 0.4*rng.rand()]
+        y = density.fit_model(x, p, ff.constants()) + 1e-6 * rng.randn(len(x))
+        sel = (x > L/4.) & (x < 3*L/4.)
+        ffs.append(ff)
+        xs.append(x[sel])
+        ys.append(y[sel])
+    return ffs, xs, ys
+
+def leastsq_fits(ffs, xs, ys):
+    ## previous implementation, one MINPACK fit per density
+    ret = []
+    for ff, x, y in zip(ffs, xs, ys):
+        consts = ff.constants()
+        p, ier = optimize.leastsq(lambda p: y - density.fit_model(x, p, consts), ff.values(),
+                                  Dfun=lambda p: -density.fit_jacobian(x, p, consts), col_deriv=True)
+        ret.append(p)
+    return np.array(ret)
+
+def batched_fits(ffs, xs, ys):
+    return density.fit_density_batch(ffs, xs, ys, [ff.values() for ff in ffs])[0]
+
+def best_time(func, *args):
+    times = []
+    for r in range(REPEAT):
+        t0 = time.time()
+        func(*args)
+        times.append(time.time() - t0)
+    return min(times)
+
+def main():
+    print '# {:>5} {:>12} {:>12} {:>14}'.format('fits', 'leastsq [ms]', 'batched [ms]', 'max |dKrho|')
+    for nfits in NUM_FITS:
+        ffs, xs, ys = profiles(nfits)
+        ref = leastsq_fits(ffs, xs, ys)
+        res = batched_fits(ffs, xs, ys)
+        print '  {:>5} {:12.1f} {:12.1f} {:14.2e}'.format(nfits, 1e3*best_time(leastsq_fits, ffs, xs, ys),
+                                                        1e3*best_time(batched_fits, ffs, xs, ys),
+                                                        2*np.max(np.abs(res[:,2] - ref[:,2])))
+
+if __name__ == '__main__':
+    main()
@@ -1,4 +1,5 @@
-from scripts import load, utils
+import sys
+from scripts import load, utils, cache_builder, load_raw_data, density
 
 all_sizes = [32, 48, 64, 80, 96, 128, 160, 192]
 all_filling = [0.875, 0.9375, 0.96875]
@@ -12,33 +13,32 @@ all_extraps = []
 all_extraps.append(800)
 all_extraps.append(utils.Extrapolation('variance', deg=2, num_points=None))
 
+energy_extraps = filter(lambda bond_dim: isinstance(bond_dim, utils.Extrapolation), all_extraps)
+
+tasks = []
+
 if False:
     ## Cache pair correlations
     for filling in all_filling:
         for L in all_sizes:
             for corr_type in all_corr_types:
-                for bond_dim in all_extraps:
-                    load.result('pairfield', L=L, filling=filling, bond_dim=bond_dim, correlation_type=corr_type)
+                tasks += cache_builder.result_tasks('pairfield', all_extraps, L=L, filling=filling, correlation_type=corr_type)
 
     ## Cache density-density correlations
     for filling in all_filling:
         for L in all_sizes:
             for corr_type in all_corr_types:
-                for bond_dim in all_extraps:
-                    load.result('densdens', L=L, filling=filling, bond_dim=bond_dim, correlation_type=corr_type)
+                tasks += cache_builder.result_tasks('densdens', all_extraps, L=L, filling=filling, correlation_type=corr_type)
 
     ## Cache density and density fit
     for filling in all_filling:
         for L in all_sizes:
-            for bond_dim in all_extraps:
-                load.result('density', L=L, filling=filling, bond_dim=bond_dim)
+            tasks += cache_builder.result_tasks('density', all_extraps, L=L, filling=filling)
 
     ## Cache energy
     for filling in all_filling:
         for L in all_sizes:
-            for bond_dim in all_extraps:
-                if isinstance(bond_dim, utils.Extrapolation):
-                    load.extrapolation('energy', L=L, filling=filling, bond_dim=bond_dim)
+            tasks += cache_builder.extrapolation_tasks('energy', energy_extraps, L=L, filling=filling)
 
 
 ## Odd sizes
@@ -48,12 +48,18 @@ all_filling = [0.875]
 ## Cache density and density fit
 for filling in all_filling:
     for L in all_sizes:
-        for bond_dim in all_extraps:
-            load.result('density', L=L, filling=filling, bond_dim=bond_dim)
+        tasks += cache_builder.result_tasks('density', all_extraps, L=L, filling=filling)
 
 ## Cache energy
 for filling in all_filling:
     for L in all_sizes:
-        for bond_dim in all_extraps:
-            if isinstance(bond_dim, utils.Extrapolation):
-                load.extrapolation('energy', L=L, filling=filling, bond_dim=bond_dim)
+        tasks += cache_builder.extrapolation_tasks('energy', energy_extraps, L=L, filling=filling)
+
+
+if __name__ == '__main__':
+    if '--dry-run' in sys.argv:
+        cache_builder.run(tasks, dry_run=True)
+        sys.exit(0)
+    load_raw_data.build_metadata_index()
+    cache_builder.run(tasks)
+    density.fit_scan(all_filling, all_extraps, all_sizes)
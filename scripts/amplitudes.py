@@ -7,10 +7,9 @@
 import sys
 import numpy as np
 import scipy
-from copy import deepcopy
 import pyalps_dset
 
-import utils
+import utils, resampling
 from corr_helpers import *
 import density
 
@@ -28,20 +27,19 @@ def rsquared(x, y, coeffs):
 
 def compute_amplitude(d):
     ret = pyalps_dset.DataSet()
-    ret.props = deepcopy(d.props)
+    ret.props = pyalps_dset.CowProps(d.props)
     ret.props['observable'] = 'Amplitude'
     ret.y = np.array([ abs(d.props['density_fitted_at_middle'] - d.props['density_fitted_n0']) ])
     return ret
 
 
-def compute(filling, bond_dim, odd_sizes=False, amplitude_points=None):
-    ## Load all system sizes
+def compute(filling, bond_dim, odd_sizes=False, amplitude_points=None, error_mode=None):
+    ## Load all system sizes, missing fits are warm-started from the previous size
     if odd_sizes:
-        densities = map(lambda parms: to_dataset(*utils.load_or_evaluate('density_fit', density.evaluate_fit, **parms)),
-                   utils.iter_odd_system_size(bond_dim=bond_dim, filling=filling))
+        sizes = [parms['L'] for parms in utils.iter_odd_system_size()]
     else:
-        densities = map(lambda parms: to_dataset(*utils.load_or_evaluate('density_fit', density.evaluate_fit, **parms)),
-                   utils.iter_system_size(bond_dim=bond_dim, filling=filling))
+        sizes = [parms['L'] for parms in utils.iter_system_size()]
+    densities = map(lambda res: to_dataset(*res), density.fit_sizes(sizes, filling, bond_dim))
     densities = filter(lambda d: d.props is not None, densities)
     if len(densities) < 3:
         print 'WARNING:', 'Only got {} valid densities, you need at least 3.'.format(len(densities))
@@ -89,7 +87,10 @@ def compute(filling, bond_dim, odd_sizes=False, amplitude_points=None):
     if amplitude_points is not None and amplitude_points < len(d.x): fit_range[0] = d.x[-amplitude_points]
     ## compute new Krho
     slope = coeff[0]
-    errslope = np.sqrt(cov[0,0])
+    if error_mode is not None:
+        errslope = resampling.polyfit_error(np.log(d.x), np.log(d.y), 1, sel, mode=error_mode)[0,0]
+    else:
+        errslope = np.sqrt(cov[0,0])
     Krho = -2. * slope
     errKrho = 2. * errslope
     print 'M={} t_perp={} filling={:4.4f}  ->  Krho={:.3f} +/- {:.3f} :  R^2 {:.4f}'.format(common_props['max_bond_dimension'], common_props['t\''], common_props['filling'], Krho, errKrho, r2)
@@ -99,6 +100,8 @@ def compute(filling, bond_dim, odd_sizes=False, amplitude_points=None):
     d.props['fitted_coeff']      = coeff
     d.props['fitted_Krho']       = Krho
     d.props['fitted_Krho_error'] = errKrho
+    if error_mode is not None:
+        d.props['error_mode']    = error_mode
     d.props['fitted_r2']         = r2
     
     return d
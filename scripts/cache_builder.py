@@ -0,0 +1,189 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import time
+import itertools
+import traceback
+import multiprocessing
+from os import path
+
+import utils, load, load_raw_data
+
+## results extracted directly from the raw data
+RAW_RESULTS = ['pairfield', 'densdens', 'density', 'energy']
+
+
+class Task(object):
+    def __init__(self, kind, what, deps=[], **kwargs):
+        self.kind = kind ## 'result' or 'extrapolation'
+        self.what = what
+        self.deps = list(deps)
+        self.kwargs = kwargs
+    
+    @property
+    def fname(self):
+        prefix = 'extrap_' if self.kind == 'extrapolation' else ''
+        return utils.filename(prefix+self.what, **self.kwargs)
+    
+    @property
+    def name(self):
+        return path.splitext(path.basename(self.fname))[0]
+    
+    @property
+    def raw_file(self):
+        ## tasks reading the same raw file run in one worker and share one read of it
+        if self.kind == 'result' and self.what in RAW_RESULTS and not isinstance(self.kwargs['bond_dim'], utils.Extrapolation):
+            return (self.kwargs['L'], self.kwargs['filling'], self.kwargs['bond_dim'])
+        return None
+
+
+def single_tasks(what, **kwargs):
+    return [Task('result', what, **parms) for parms in utils.iter_bond_dim(**kwargs)]
+
+def result_tasks(what, bond_dims, **kwargs):
+    ## extrapolated results depend on the results for all bond dimensions
+    tasks = []
+    for bond_dim in bond_dims:
+        if isinstance(bond_dim, utils.Extrapolation):
+            deps = single_tasks(what, **kwargs)
+            tasks += deps
+            tasks.append( Task('result', what, deps=[t.name for t in deps], bond_dim=bond_dim, **kwargs) )
+        else:
+            tasks.append( Task('result', what, bond_dim=bond_dim, **kwargs) )
+    return tasks
+
+def extrapolation_tasks(what, bond_dims, **kwargs):
+    tasks = []
+    for bond_dim in bond_dims:
+        deps = single_tasks(what, **kwargs)
+        tasks += deps
+        tasks.append( Task('extrapolation', what, deps=[t.name for t in deps], bond_dim=bond_dim, **kwargs) )
+    return tasks
+
+
+def run_task(task):
+    t0 = time.time()
+    try:
+        getattr(load, task.kind)(task.what, **task.kwargs)
+        error = None
+    except Exception:
+        error = traceback.format_exc()
+    return task.name, time.time() - t0, error
+
+def batch_observables(tasks):
+    what = set()
+    for t in tasks:
+        what.update(load_raw_data.EVALUATOR_OBSERVABLES.get(t.what, []))
+    return what
+
+def run_tasks(tasks):
+    ## a batch of tasks of the same raw file reads only the observables they need, once,
+    ## and releases them at the end of the batch
+    raw_file = tasks[0].raw_file
+    fname = utils.lookup_resfile(*raw_file) if raw_file is not None else None
+    if fname is None:
+        return [run_task(t) for t in tasks]
+    with load_raw_data.raw_session(fname, batch_observables(tasks)):
+        return [run_task(t) for t in tasks]
+
+def plan(tasks):
+    ## tasks which would be (re)computed with the reason, a task is also rebuilt when one of its deps is
+    unique = {}
+    for t in tasks:
+        unique.setdefault(t.name, t)
+    reasons = {}
+    for name, t in unique.items():
+        if not utils.cache_exists(t.fname):
+            reasons[name] = 'missing'
+        else:
+            reason = utils.stale_reason(t.fname)
+            if reason is not None:
+                reasons[name] = reason
+    changed = True
+    while changed:
+        changed = False
+        for name, t in unique.items():
+            if name in reasons:
+                continue
+            rebuilt = [d for d in t.deps if d in reasons]
+            if len(rebuilt) > 0:
+                reasons[name] = 'depends on {}'.format(rebuilt[0])
+                changed = True
+    return [(t, reasons[t.name]) for t in tasks if t.name in reasons and unique[t.name] is t]
+
+def run(tasks, processes=None, summary=10, dry_run=False):
+    ## raw files added since the index was last checked are found once per run,
+    ## the workers inherit the refreshed index
+    utils.raw_index(refresh=True)
+    if dry_run:
+        rebuild = plan(tasks)
+        for t, reason in rebuild:
+            print '#', t.name, ':', reason
+        print '## {} of {} results would be rebuilt'.format(len(rebuild), len(set(t.name for t in tasks)))
+        return rebuild
+    
+    ## remove duplicates, dependencies which are not in the task list are considered done
+    unique = {}
+    for t in tasks:
+        unique.setdefault(t.name, t)
+    pending = unique.values()
+    done = set()
+    timings = {}
+    failed = []
+    skipped = []
+    
+    pool = multiprocessing.Pool(processes)
+    running = {}
+    batch_ids = itertools.count()
+    t0 = time.time()
+    while len(pending) > 0 or len(running) > 0:
+        ready = [t for t in pending if all(d in done or d not in unique for d in t.deps)]
+        batches = {}
+        for t in ready:
+            key = t.raw_file if t.raw_file is not None else t.name
+            batches.setdefault(key, []).append(t)
+            pending.remove(t)
+        for batch in batches.values():
+            running[next(batch_ids)] = pool.apply_async(run_tasks, (batch,))
+        
+        finished = [key for key, r in running.items() if r.ready()]
+        if len(finished) == 0:
+            if len(running) == 0:
+                raise Exception('Tasks with unresolvable dependencies: %s' % [t.name for t in pending])
+            time.sleep(0.1)
+            continue
+        for key in finished:
+            for name, elapsed, error in running.pop(key).get():
+                timings[name] = elapsed
+                if error is None:
+                    done.add(name)
+                else:
+                    failed.append(name)
+                    print 'ERROR:', name
+                    print error
+                print '[{}/{}] {} ({:.1f} s)'.format(len(timings)+len(skipped), len(unique), name, elapsed)
+        
+        ## tasks depending on a failed task are skipped, and so are their dependents
+        broken = set(failed + skipped)
+        changed = True
+        while changed:
+            changed = False
+            for t in list(pending):
+                missing = [d for d in t.deps if d in broken]
+                if len(missing) > 0:
+                    pending.remove(t)
+                    skipped.append(t.name)
+                    broken.add(t.name)
+                    changed = True
+                    print 'SKIPPED:', t.name, ': depends on', missing[0]
+    pool.close()
+    pool.join()
+    
+    wall = time.time() - t0
+    print '## Cache built in {:.1f} s, total task time {:.1f} s, {} failed, {} skipped'.format(wall, sum(timings.values()), len(failed), len(skipped))
+    for name, elapsed in sorted(timings.items(), key=lambda kv: kv[1], reverse=True)[:summary]:
+        print '#', '{:8.1f} s'.format(elapsed), name
+    return timings, failed, skipped
@@ -6,15 +6,29 @@
 
 import numpy as np
 import pyalps_dset
+from os import path
+
+import utils
 
 class ObservableNotFound(Exception):
     pass
 
+## datasets of the loaded data keyed by observable name, the first dataset of each observable is kept.
+## All select functions accept the loaded data or this index.
+def observable_index(sets):
+    if isinstance(sets, dict):
+        return sets
+    index = {}
+    for d in pyalps_dset.flatten(sets):
+        if isinstance(d, pyalps_dset.DataSet):
+            index.setdefault(d.props['observable'], d)
+    return index
+
 def select_obs(sets, obs):
-    sel = pyalps_dset.select(pyalps_dset.flatten(sets), lambda d: d.props['observable'] == obs)
-    if len(sel) == 0:
+    index = observable_index(sets)
+    if obs not in index:
         raise ObservableNotFound()
-    return sel[0]
+    return index[obs]
 
 def index_map(L, W):
     a = np.arange(L*W, dtype=int)
@@ -23,39 +37,129 @@ def index_map(L, W):
 def select_to_1d(sets, obs, idx):
     d = select_obs(sets, obs)
     a = np.zeros((idx.size,))
-    for i, x in enumerate(d.x):
-        a[idx[x]] = d.y[0][i]
+    a[coords_to_index(d.x, idx, 1)[:,0]] = d.y[0]
     return a
 
 def select_to_2d(sets, obs, idx):
+    ## symmetric matrix, (i,j) and (j,i) of each measurement are written in the order of the measurements
     d = select_obs(sets, obs)
+    sites = coords_to_index(d.x, idx, 2)
+    y = np.asarray(d.y[0])
     a = np.zeros((idx.size,idx.size))
-    for i, x in enumerate(d.x):
-        a[idx[tuple(x[0])], idx[tuple(x[1])]] = d.y[0][i]
-        a[idx[tuple(x[1])], idx[tuple(x[0])]] = d.y[0][i]
+    a[np.column_stack([sites[:,0], sites[:,1]]).ravel(), np.column_stack([sites[:,1], sites[:,0]]).ravel()] = np.repeat(y, 2)
     return a
 
-def select_to_nd(sets, obs, idx, dims):
+## convert the (i, leg) coordinates of all measurements to flat site indices, shape (len(x), dims)
+def coords_to_index(x, idx, dims):
+    coords = np.asarray(x, dtype=int).reshape(len(x), dims, 2)
+    return idx[coords[:,:,0], coords[:,:,1]]
+
+## rungs (i, j) of four-point site indices, mask selects the (lower(i), upper(i), lower(j), upper(j)) terms
+def rung_pair_index(sites, idx):
+    rung = np.empty(idx.size, dtype=int)
+    leg  = np.empty(idx.size, dtype=int)
+    rung[idx] = np.arange(idx.shape[0]).reshape(idx.shape[0],1)
+    leg[idx]  = np.arange(idx.shape[1]).reshape(1,idx.shape[1])
+    
+    mask  = (leg[sites[:,0]] == 0) & (leg[sites[:,1]] == 1)
+    mask &= (leg[sites[:,2]] == 0) & (leg[sites[:,3]] == 1)
+    mask &= (rung[sites[:,0]] == rung[sites[:,1]]) & (rung[sites[:,2]] == rung[sites[:,3]])
+    return rung[sites[:,0]], rung[sites[:,2]], mask
+
+## with rung_pairs=True only the (L,L) slice [ix_lower, ix_upper, jx_lower, jx_upper]
+## of the 4-point function is returned, without allocating the full tensor
+def select_to_nd(sets, obs, idx, dims, rung_pairs=False):
+    if rung_pairs:
+        if dims != 4:
+            raise ValueError('`rung_pairs` requires dims=4.')
+        return accumulate_rung_pairs(sets, [(obs, +1.)], idx)
     print '...','loading ',obs,'...'
     d = select_obs(sets, obs)
+    sites = coords_to_index(d.x, idx, dims)
     a = np.zeros([idx.size]*dims)
-    for i, x in enumerate(d.x):
-        key = tuple([ idx[tuple(xi)] for xi in x.reshape(x.size/2,2) ])
-        a[key] = d.y[0][i]
+    a[tuple(sites.T)] = d.y[0]
     return a
 
-def average_around_middle(corr, L, shifts):
-    l = range(1, int(L-1-2*max(shifts)-2), 1)
-    res = np.zeros_like(l, dtype=float)
-    for ii,li in enumerate(l):
-        tmp = []
-        for ss in shifts:
-            i1 = int(L/2. - li/2. + ss)
-            i2 = int(i1 + li)
-            tmp.append( corr[i1,i2] )
-        res[ii] = np.mean(tmp)
+## signed sum of four-point measurements accumulated directly on the (L,L) rung pairs,
+## `channels` is a list of (obs, sign). Memory is O(L^2) plus the raw measurements.
+def accumulate_rung_pairs(sets, channels, idx):
+    L = idx.shape[0]
+    corr = np.zeros((L,L))
+    for obs, sign in channels:
+        print '...','loading ',obs,'...'
+        d = select_obs(sets, obs)
+        sites = coords_to_index(d.x, idx, 4)
+        i, j, mask = rung_pair_index(sites, idx)
+        corr[i[mask], j[mask]] += sign * np.asarray(d.y[0])[mask]
+    return corr
+
+def stored_correlation(what, compute, resfile, L, filling, bond_dim):
+    ## correlation matrix of the raw file `resfile`, computed once with `compute` and then
+    ## memory mapped from the matrix store. The matrix is recomputed when the raw file or the
+    ## version of the evaluator changes. The matrix and props are always returned as stored,
+    ## without the bookkeeping props, such that they do not depend on the state of the store.
+    mname = utils.matrix_filename(what, L, filling, bond_dim)
+    stamp = {
+        'matrix_source'       : path.relpath(resfile, utils.PROJECT_ROOT),
+        'matrix_source_mtime' : path.getmtime(resfile),
+        'matrix_version'      : utils.EVALUATOR_VERSIONS.get(what, 1),
+    }
+    y, props = utils.load_matrix(mname)
+    if y is None or any(props.get(k) != v for k, v in stamp.items()):
+        d = compute(resfile)
+        if d is None:
+            return None
+        props = dict(d.props)
+        props.update(stamp)
+        utils.save_matrix(mname, d.y, props)
+        y, props = utils.load_matrix(mname)
+    
+    d = pyalps_dset.DataSet()
+    d.props = dict([(k, v) for k, v in props.items() if k not in stamp])
+    d.y = y
+    return d
+
+def middle_pair_index(L, shifts):
+    ## distances l and the rung pairs (i1, i2) with shape (len(l), len(shifts)) centered around the middle
+    shifts = np.asarray(shifts)
+    l = np.arange(1, int(L-1-2*max(shifts)-2))
+    i1 = np.trunc(L/2. - l[:,np.newaxis]/2. + shifts[np.newaxis,:]).astype(int)
+    return l, i1, i1 + l[:,np.newaxis]
+
+def average_around_middle_batch(corrs, L, shift_sets):
+    ## average of all matrices `corrs` (..., L, L) for several sets of shifts at once,
+    ## returns the distances of the widest range and an array (len(shift_sets), ..., len(l)),
+    ## distances not covered by a set of shifts are nan
+    corrs = np.asarray(corrs)
+    pairs = [middle_pair_index(L, shifts) for shifts in shift_sets]
+    l = max([p[0] for p in pairs], key=len)
+    res = np.empty((len(shift_sets),) + corrs.shape[:-2] + (len(l),))
+    res.fill(np.nan)
+    for k, (lk, i1, i2) in enumerate(pairs):
+        res[k, ..., :len(lk)] = corrs[..., i1, i2].mean(axis=-1)
     return l, res
 
+def average_around_middle(corr, L, shifts):
+    l, res = average_around_middle_batch(corr, L, [shifts])
+    return l, res[0]
+
+def stored_window_averages(what, compute, L, filling, shift_sets):
+    ## averages of the stored correlation matrices of all bond dimensions of one system size
+    ## for several sets of shifts in one call, e.g. to study the sensitivity to the averaging window.
+    ## Returns the bond dimensions, the distances and an array (len(shift_sets), len(bond_dims), len(l))
+    bond_dims = []
+    corrs = []
+    for parms in utils.iter_bond_dim(L=L, filling=filling):
+        fname = utils.find_resfile(**parms)
+        corr = stored_correlation(what, compute, fname, **parms) if fname is not None else None
+        if corr is not None:
+            bond_dims.append(parms['bond_dim'])
+            corrs.append(corr.y)
+    if len(corrs) == 0:
+        return np.array([]), np.array([]), np.empty((len(shift_sets), 0, 0))
+    l, res = average_around_middle_batch(corrs, L, shift_sets)
+    return np.array(bond_dims), l, res
+
 def to_dataset(d, props):
     dd = pyalps_dset.DataSet()
     dd.props = props
@@ -4,14 +4,15 @@
 #      (See accompanying file LICENSE_1_0.txt or copy at
 #          http://www.boost.org/LICENSE_1_0.txt)
 
+import time
+from os import path
 import numpy as np
 import scipy
-from copy import deepcopy
 import pyalps_dset
 
 import pyalps_dset.fit_wrapper as fw
 
-import utils, load_raw_data
+import utils, load, load_raw_data
 from corr_helpers import *
 import extrapolate_local
 
@@ -53,7 +54,115 @@ def get_density(data):
     return ret
     
 
+## convergence of the batched density fit, the tolerances of scipy.optimize.leastsq
+FIT_FTOL     = 1.49012e-8
+FIT_XTOL     = 1.49012e-8
+FIT_MAX_ITER = 400
+
+def fit_window(d, delta_sel):
+    L = d.props['L']
+    return (d.x > L/2. - delta_sel) & (d.x < L/2. + delta_sel)
+
+def fit_density_batch(ffs, xs, ys, p0s):
+    ## Levenberg-Marquardt fit of `fit_model` for several densities at once with the analytic jacobian.
+    ## The fit windows are padded to a common length with masked points in the middle of the system,
+    ## every iteration solves the damped 3x3 normal equations of all unconverged fits in one call.
+    ## Returns the parameters and the number of function evaluations of each fit.
+    nfits   = len(ffs)
+    npoints = max([len(x) for x in xs])
+    x    = np.empty((nfits, npoints))
+    y    = np.zeros((nfits, npoints))
+    mask = np.zeros((nfits, npoints), dtype=bool)
+    for g, (ff, xx, yy) in enumerate(zip(ffs, xs, ys)):
+        x[g] = ff.L / 2.
+        x[g,:len(xx)]    = xx
+        y[g,:len(xx)]    = yy
+        mask[g,:len(xx)] = True
+    cos, logd = fit_terms(x, np.array([ff.constants() for ff in ffs]).T[:,:,np.newaxis])
+    
+    def oscillation(p, sel):
+        return mask[sel] * cos[sel] * np.exp(-p[:,2:3] * logd[sel])
+    def residuals(p, sel):
+        return mask[sel] * (y[sel] - p[:,0:1]) - p[:,1:2] * oscillation(p, sel)
+    
+    p    = np.array(p0s, dtype=float)
+    r    = residuals(p, slice(None))
+    cost = np.sum(r**2, axis=1)
+    nfev = np.ones(nfits, dtype=int)
+    lam  = np.ones(nfits) * 1e-3
+    active = cost > 0
+    for _ in xrange(FIT_MAX_ITER):
+        if not active.any():
+            break
+        a = np.flatnonzero(active)
+        osc = oscillation(p[a], a)
+        jac = np.array([mask[a], osc, -p[a,1:2] * osc * logd[a]]).transpose(1, 0, 2)
+        jtj = np.einsum('bpn,bqn->bpq', jac, jac)
+        jtr = np.einsum('bpn,bn->bp', jac, r[a])
+        diag = jtj.diagonal(axis1=1, axis2=2) + 1e-300
+        with np.errstate(all='ignore'):
+            step  = np.linalg.solve(jtj + (lam[a,np.newaxis] * diag)[:,:,np.newaxis] * np.eye(3), jtr[:,:,np.newaxis])[:,:,0]
+            trial = p[a] + step
+            r_trial    = residuals(trial, a)
+            cost_trial = np.sum(r_trial**2, axis=1)
+            ## ratio of the actual and the predicted reduction of the cost
+            gain = (cost[a] - cost_trial) / np.sum(step * (lam[a,np.newaxis] * diag * step + jtr), axis=1)
+        nfev[a] += 1
+        
+        better = cost_trial < cost[a]
+        small_step = np.sqrt(np.sum(step**2, axis=1)) <= FIT_XTOL * (np.sqrt(np.sum(p[a]**2, axis=1)) + FIT_XTOL)
+        small_gain = np.abs(cost[a] - cost_trial) <= FIT_FTOL * cost[a]
+        acc = a[better]
+        p[acc]    = trial[better]
+        r[acc]    = r_trial[better]
+        cost[acc] = cost_trial[better]
+        lam[a] *= np.where(better, np.maximum(0.1, 1. - (2.*gain - 1.)**3), 4.)
+        active[a[small_step | small_gain | (lam[a] > 1e16)]] = False
+    return p, nfev
+
+def dens_fit_batch(datas, ffs):
+    ## fit several densities (e.g. all bond dimensions and system sizes) in one call to fit_density_batch,
+    ## fits with a vanishing amplitude are repeated with a reduced window from the default guess
+    delta_sel = np.array([d.props['L']/4. for d in datas])
+    nfev      = np.zeros(len(datas), dtype=int)
+    retries   = np.zeros(len(datas), dtype=int)
+    pending = range(len(datas))
+    while len(pending) > 0:
+        sels = [fit_window(datas[g], delta_sel[g]) for g in pending]
+        p, n = fit_density_batch([ffs[g] for g in pending],
+                                 [datas[g].x[sel] for g, sel in zip(pending, sels)],
+                                 [datas[g].y[sel] for g, sel in zip(pending, sels)],
+                                 [ffs[g].values() for g in pending])
+        retry = []
+        for i, g in enumerate(pending):
+            ff = ffs[g]
+            ff.set_values(p[i])
+            nfev[g] += n[i]
+            L = datas[g].props['L']
+            amp = abs(ff.func(L/2., ff.pars) - ff.n0())
+            if amp < 1e-8:
+                delta_sel[g] /= 1.5
+                ff.reset()
+                print 'WARNING:', 'Reducing fit range.', 'Amplitude too small:', amp, 'Very likely the fitting routine has problems converging the result.'
+                if delta_sel[g] < L/12.:
+                    print 'PROBLEM:', 'Failed to fit.'
+                else:
+                    retries[g] += 1
+                    retry.append(g)
+        pending = retry
+    
+    ret = []
+    for g, (d, ff) in enumerate(zip(datas, ffs)):
+        dd = fit_result(d, ff, delta_sel[g])
+        dd.props['density_fit_nfev']    = nfev[g]
+        dd.props['density_fit_retries'] = retries[g]
+        ret.append(dd)
+    return ret
+
 def dens_fit(d, ff):
+    return dens_fit_batch([d], [ff])[0]
+
+def fit_result(d, ff, delta_sel):
     L = d.props['L']
     bond_dim = d.props['max_bond_dimension']
     filling = d.props['filling']
@@ -61,24 +170,7 @@ def dens_fit(d, ff):
     
     xgrid=np.linspace(0.5,L-0.5,1000)
     
-    doloop = True
-    delta_sel = L/4.
-    while doloop:
-        sel = np.array([ x > L/2. - delta_sel and x < L/2. + delta_sel for x in d.x])
-        fw.fit(None, lambda self, x, args: ff.func(x, args), ff.pars, d.y[sel], d.x[sel])
-        
-        amp = abs(ff.func(L/2., ff.pars) - ff.n0())
-        if amp < 1e-8:
-            delta_sel /= 1.5
-            ff.reset()
-            print 'WARNING:', 'Reducing fit range.', 'Amplitude too small:', amp, 'Very likely the fitting routine has problems converging the result.'
-            if delta_sel < L/12.:
-                doloop=False
-                print 'PROBLEM:', 'Failed to fit.'
-        else:
-            doloop = False
-    
-    sel = np.array([ x > L/2. - delta_sel and x < L/2. + delta_sel for x in d.x])
+    sel = fit_window(d, delta_sel)
     chi2 = sum( (d.y[sel] - ff.func(d.x[sel], ff.pars))**2 )
     error_per_point = np.sqrt(chi2 / sum(sel))
     
@@ -97,7 +189,7 @@ def dens_fit(d, ff):
         print '--', '{} : {}'.format(n, p())
 
     dd = pyalps_dset.DataSet()
-    dd.props = deepcopy(d.props)
+    dd.props = pyalps_dset.CowProps(d.props)
     dd.x = xgrid
     dd.y = ff.func(xgrid, ff.pars)
     
@@ -106,11 +198,32 @@ def dens_fit(d, ff):
     dd.props['density_fit_chi2']     = chi2
     dd.props['density_fit_error']    = error_per_point
     dd.props['density_fitted_n0']    = n0
+    dd.props['density_fitted_A']     = ff.pars[1]()
     dd.props['density_fitted_Krho']  = K_rho
     dd.props['density_fitted_at_middle'] = ff.func(L/2., ff.pars)
     
     return dd
 
+def fit_terms(x, consts):
+    ## parts of fit_model which do not depend on the parameters:
+    ## cos(2 pi kk x + shift) and the log of the denominator (2 L_eff/pi) sin(pi x/L_eff + shift2)
+    L_eff, kk, shift, shift2 = consts
+    return np.cos(2*np.pi*kk*x + shift), np.log((2*L_eff/np.pi) * np.sin(np.pi*x/L_eff + shift2))
+
+def fit_model(x, p, consts):
+    ## A cos(2 pi kk x + shift) / ((2 L_eff/pi) sin(pi x/L_eff + shift2))**alpha + n0
+    ## with parameters p=[n0, A, alpha] and consts=[L_eff, kk, shift, shift2]
+    n0, A, alpha = p
+    cos, logd = fit_terms(x, consts)
+    return A * cos * np.exp(-alpha * logd) + n0
+
+def fit_jacobian(x, p, consts):
+    ## derivatives of fit_model with respect to [n0, A, alpha], shape (3, len(x))
+    n0, A, alpha = p
+    cos, logd = fit_terms(x, consts)
+    osc = cos * np.exp(-alpha * logd)
+    return np.array([np.ones_like(osc), osc, -A * osc * logd])
+
 class fit_func:
     name = 'fit_func'
     def __init__(self, L, nholes):
@@ -121,22 +234,28 @@ class fit_func:
         self.pars = [fw.Parameter(self.nholes/self.L),fw.Parameter(1.),fw.Parameter(0.5)]
         self.parname = ['n0', 'A', 'alpha']
     
+    def values(self):
+        return np.array([p() for p in self.pars])
+    def set_values(self, values):
+        for p, v in zip(self.pars, values):
+            p.set(v)
+    
     def n0(self):
         return self.pars[0]()
     def alpha(self):
         return self.pars[2]()
     
-    def func(self, x, args):
-        n0 = args[0]()
-        A = args[1]()
-        alpha = args[2]()
+    def constants(self):
         L_eff = self.L - 2.
         kk = self.nholes / L_eff
         shift = - np.pi*self.nholes * self.L / L_eff
         if self.L % 2 != 0:
             shift += np.pi
         shift2 = np.pi/2 * (1. - self.L / L_eff)
-        return A * np.cos(2*np.pi*kk*x + shift) / ((2*L_eff/np.pi) * np.sin(np.pi*x/L_eff + shift2))**alpha + n0
+        return L_eff, kk, shift, shift2
+    
+    def func(self, x, args):
+        return fit_model(x, np.array([a() for a in args]), self.constants())
 
 
 def compute(fname, nup_name='Local density up', ndown_name='Local density down'):
@@ -144,17 +263,99 @@ def compute(fname, nup_name='Local density up', ndown_name='Local density down')
     d = get_density(data)
     return d
 
-def compute_fit(L, filling, bond_dim):
-    ## Get data
+def prepare_fit(L, filling, bond_dim, p0=None):
+    ## density and fit function of one fit, optionally starting from the parameters `p0` = [n0, A, alpha].
+    ## The fit function is None if there is no data.
     data = to_dataset(*utils.load_or_evaluate('density', evaluate, L=L, filling=filling, bond_dim=bond_dim))
     if data.props is None:
         print 'Data not found for L={}, n={}, M={}'.format(L, filling, bond_dim)
+        return data, None
+    ff = fit_func(data.props['L'], data.props['nholes'])
+    if p0 is not None:
+        ff.set_values(p0)
+    return data, ff
+
+def compute_fit(L, filling, bond_dim, p0=None):
+    data, ff = prepare_fit(L, filling, bond_dim, p0)
+    if ff is None:
         return data
-    ## Compute fit
-    d = dens_fit(data, fit_func(data.props['L'], data.props['nholes']))
-    return d
+    return dens_fit(data, ff)
+
+def fitted_values(props):
+    ## [n0, A, alpha] of a density fit, None for older fits without the amplitude
+    if props is None or 'density_fitted_A' not in props:
+        return None
+    return np.array([props['density_fitted_n0'], props['density_fitted_A'], props['density_fitted_Krho']/2.])
 
+def warm_start(L, filling, bond_dim):
+    ## parameters of the cached fit of the largest smaller system size of the same series (even or odd L)
+    ## and its file name, the fit is recorded as an input such that this fit is redone when it changes.
+    ## Returns (None, 'default') without such a fit.
+    series = utils.iter_odd_system_size() if L % 2 != 0 else utils.iter_system_size()
+    for Lp in sorted([parms['L'] for parms in series if parms['L'] < L], reverse=True):
+        fname = utils.filename('density_fit', L=Lp, filling=filling, bond_dim=bond_dim)
+        if utils.is_cached(fname):
+            p0 = fitted_values(utils.load_cached(fname)[1])
+            if p0 is not None:
+                return p0, path.relpath(fname, utils.PROJECT_ROOT)
+    return None, 'default'
 
+def fit_batch(params):
+    ## warm-started density fits of several parameter sets in one dens_fit_batch call.
+    ## Returns the (d, props) of each fit and the inputs recorded while loading its density and start.
+    prepared = []
+    starts   = []
+    inputs   = []
+    for kwargs in params:
+        with utils.recording_inputs() as recorded:
+            p0, start = warm_start(**kwargs)
+            prepared.append(prepare_fit(p0=p0, **kwargs))
+        starts.append(start)
+        inputs.append(recorded)
+    valid = [i for i, (_, ff) in enumerate(prepared) if ff is not None]
+    fits = dens_fit_batch([prepared[i][0] for i in valid], [prepared[i][1] for i in valid]) if len(valid) > 0 else []
+    results = [(None, None)] * len(params)
+    for i, data in zip(valid, fits):
+        data.props['density_fit_start'] = starts[i]
+        results[i] = (np.column_stack([data.x,data.y]), data.props)
+    return results, inputs
+
+def saved_fit(inputs, result):
+    ## records the inputs of a fit done by fit_batch in the current evaluation and returns its result
+    for kind, key, stamp in inputs:
+        utils.record_input(kind, key, stamp)
+    return result
+
+def fit_sizes(sizes, filling, bond_dim):
+    ## density fits for increasing system sizes, such that each missing fit starts from the previous size
+    return [load.result('density_fit', L=L, filling=filling, bond_dim=bond_dim) for L in sorted(sizes)]
+
+def fit_scan(fillings, bond_dims, sizes):
+    ## warm-started density fits for all fillings and bond dimensions. For each system size
+    ## the missing fits of all (filling, bond_dim) chains are done together in one fit_batch call.
+    chains  = [(filling, bond_dim) for filling in fillings for bond_dim in bond_dims]
+    results = dict((chain, []) for chain in chains)
+    t0 = time.time()
+    nfits = 0
+    for L in sorted(sizes):
+        fnames = dict((chain, utils.filename('density_fit', L=L, filling=chain[0], bond_dim=chain[1])) for chain in chains)
+        todo = [chain for chain in chains if not utils.is_cached(fnames[chain])]
+        fits, inputs = fit_batch([dict(L=L, filling=filling, bond_dim=bond_dim) for filling, bond_dim in todo])
+        fits = dict(zip(todo, zip(inputs, fits)))
+        for chain in chains:
+            if chain in fits:
+                d, props = utils.evaluate_and_save(fnames[chain], saved_fit, inputs=fits[chain][0], result=fits[chain][1])
+                nfits += props is not None
+            else:
+                d, props = utils.load_cached(fnames[chain])
+            results[chain].append((d, props))
+    
+    print '## {} density fits in {:.1f} s'.format(nfits, time.time() - t0)
+    for filling, bond_dim in chains:
+        for _, props in results[(filling, bond_dim)]:
+            if props is not None and 'density_fit_nfev' in props:
+                print '#', 'L={:.0f} n={} M={} : {:.0f} evaluations, {:.0f} retries'.format(props['L'], filling, bond_dim, props['density_fit_nfev'], props['density_fit_retries'])
+    return [results[chain] for chain in chains]
 
 
 def compute_extrap(L, filling, bond_dim, at_x=None):
@@ -168,7 +369,7 @@ def compute_extrap(L, filling, bond_dim, at_x=None):
     def symm_middle_filter(d):
         x = int(d.props['L'] / 2)
         delta = abs(d.y[x] - d.y[x-1]) if d.props['L']%2==0 else abs(d.y[x+1] - d.y[x-1])
-        if delta > 5e-5:
+        if delta > utils.SYMM_MIDDLE_THRESHOLD:
             print '# Discard L={L:.0f}, n={filling}, tperp={t\'}, M={max_bond_dimension:.0f} : middle density not symmetry, delta={delta}'.format(delta=delta, **d.props)
             return False
         return True
@@ -176,7 +377,7 @@ def compute_extrap(L, filling, bond_dim, at_x=None):
     
     
     ## Extrapolate
-    return extrapolate_local.extrapolate(sets, 'Rung density', foreach=['L', 't\'', 'Nup_total', 'Ndown_total'], extrap_type=bond_dim.type, deg=bond_dim.deg, num_points=bond_dim.num_points, full_output_at=[at_x])
+    return extrapolate_local.extrapolate(sets, 'Rung density', foreach=['L', 't\'', 'Nup_total', 'Ndown_total'], extrap_type=bond_dim.type, deg=bond_dim.deg, num_points=bond_dim.num_points, full_output_at=[at_x], error_mode=bond_dim.error_mode)
 
 
 def evaluate_single(L, filling, bond_dim):
@@ -216,10 +417,6 @@ def evaluate(**kwargs):
     return evaluate_single(**kwargs)
 
 def evaluate_fit(**kwargs):
-    data = compute_fit(**kwargs)
-    if data.props is None:
-        return None, None
-    d = np.column_stack([data.x,data.y])
-    props = data.props
-    return d, props
+    results, inputs = fit_batch([kwargs])
+    return saved_fit(inputs[0], results[0])
 
@@ -5,7 +5,6 @@
 #          http://www.boost.org/LICENSE_1_0.txt)
 
 import numpy as np
-from copy import deepcopy
 
 import pyalps_dset
 
@@ -13,6 +12,22 @@ import utils, load_raw_data
 from corr_helpers import *
 import extrapolate_local
 
+def rung_density_correlator(site_corrs, site_dens, idx):
+    ## sum the spin channels in place and fold lower/upper chain onto the rungs
+    ## in a single reduction, <N(i)*N(j)> - <N(i)><N(j)>
+    L = idx.shape[0]
+    total = site_corrs[0]
+    for c in site_corrs[1:]:
+        total += c
+    legs = idx[:,:2].ravel()
+    if not np.array_equal(legs, np.arange(total.shape[0])):
+        total = total[np.ix_(legs, legs)]
+    dcor = total.reshape(L,2,L,2).sum(axis=(1,3))
+    
+    dens_on_rungs = site_dens[idx[:,0]] + site_dens[idx[:,1]]
+    dcor -= np.outer(dens_on_rungs, dens_on_rungs)
+    return dcor
+
 def compute(fname):
     data = load_raw_data.loadEigenstateMeasurements([fname],
                     what=[
@@ -34,6 +49,7 @@ def compute(fname):
     L = int(common_props['L'])
     W = int(common_props['W']) if 'W' in common_props else 2
     idx = index_map(L, W)
+    data = observable_index(data)
     
     try:
         dcor_up_up     = select_to_2d(data, 'dens corr up-up'    , idx)
@@ -46,41 +62,12 @@ def compute(fname):
         print 'WARNING:', 'Measurement not found in', fname
         return None
     
-    ix_lower_chain = idx[:,0]
-    ix_upper_chain = idx[:,1]
-    
-    total_dens = dens_up + dens_down
-    dens_on_rungs = total_dens[ix_lower_chain] + total_dens[ix_upper_chain]
-    
-    
-    dcor = np.zeros((L,L))
-    ## combine density correlators for <N(i)*N(j)> between rungs
-    dcor += dcor_up_up    [np.ix_(ix_lower_chain, ix_lower_chain)]
-    dcor += dcor_up_down  [np.ix_(ix_lower_chain, ix_lower_chain)]
-    dcor += dcor_down_up  [np.ix_(ix_lower_chain, ix_lower_chain)]
-    dcor += dcor_down_down[np.ix_(ix_lower_chain, ix_lower_chain)]
-    
-    dcor += dcor_up_up    [np.ix_(ix_lower_chain, ix_upper_chain)]
-    dcor += dcor_up_down  [np.ix_(ix_lower_chain, ix_upper_chain)]
-    dcor += dcor_down_up  [np.ix_(ix_lower_chain, ix_upper_chain)]
-    dcor += dcor_down_down[np.ix_(ix_lower_chain, ix_upper_chain)]
-    
-    dcor += dcor_up_up    [np.ix_(ix_upper_chain, ix_lower_chain)]
-    dcor += dcor_up_down  [np.ix_(ix_upper_chain, ix_lower_chain)]
-    dcor += dcor_down_up  [np.ix_(ix_upper_chain, ix_lower_chain)]
-    dcor += dcor_down_down[np.ix_(ix_upper_chain, ix_lower_chain)]
-    
-    dcor += dcor_up_up    [np.ix_(ix_upper_chain, ix_upper_chain)]
-    dcor += dcor_up_down  [np.ix_(ix_upper_chain, ix_upper_chain)]
-    dcor += dcor_down_up  [np.ix_(ix_upper_chain, ix_upper_chain)]
-    dcor += dcor_down_down[np.ix_(ix_upper_chain, ix_upper_chain)]
-    
-    ## connected correlator
-    dcor += -np.outer(dens_on_rungs, dens_on_rungs)
+    dcor = rung_density_correlator([dcor_up_up, dcor_up_down, dcor_down_up, dcor_down_down],
+                                   dens_up + dens_down, idx)
     
     
     d = pyalps_dset.DataSet()
-    d.props = deepcopy(common_props)
+    d.props = pyalps_dset.CowProps(common_props)
     d.props['observable'] = 'Density Correlation'
     d.y = dcor
     d.idx = idx
@@ -96,7 +83,7 @@ def compute_extrap(L, filling, bond_dim, correlation_type, at_x=None):
     sets = filter(lambda d: d.props is not None, sets)
     
     ## Extrapolate
-    return extrapolate_local.extrapolate(sets, 'Density Correlation', foreach=['L', 't\'', 'Nup_total', 'Ndown_total'], extrap_type=bond_dim.type, deg=bond_dim.deg, num_points=bond_dim.num_points, full_output_at=[at_x])
+    return extrapolate_local.extrapolate(sets, 'Density Correlation', foreach=['L', 't\'', 'Nup_total', 'Ndown_total'], extrap_type=bond_dim.type, deg=bond_dim.deg, num_points=bond_dim.num_points, full_output_at=[at_x], error_mode=bond_dim.error_mode)
 
 
 def evaluate_single(L, filling, bond_dim, correlation_type):
@@ -106,8 +93,8 @@ def evaluate_single(L, filling, bond_dim, correlation_type):
         print 'No data available for L={}, n={}, M={}, {}'.format(L, filling, bond_dim, correlation_type)
         return None, None
     
-    ## Get correlation matrix
-    corr = compute(fname)
+    ## Get correlation matrix, all correlation types are slices of the stored matrix
+    corr = stored_correlation('densdens', compute, fname, L, filling, bond_dim)
     if corr is None:
         print 'No data available for L={}, n={}, M={}, {}'.format(L, filling, bond_dim, correlation_type)
         return None, None
@@ -117,17 +104,21 @@ def evaluate_single(L, filling, bond_dim, correlation_type):
         y = corr.y[start_site, start_site+1:]
         x = np.arange(1, len(y)+1, dtype=float)
         d = np.column_stack([x, y])
-        props = deepcopy(corr.props)
+        props = pyalps_dset.CowProps(corr.props)
     elif isinstance(correlation_type, utils.Averaged):
-        shifts = range(-5, 6)
-        x,y = average_around_middle(corr.y, corr.props['L'], shifts)
+        x,y = average_around_middle(corr.y, corr.props['L'], correlation_type.shifts)
         d = np.column_stack([x, y])
-        props = deepcopy(corr.props)
+        props = pyalps_dset.CowProps(corr.props)
     
     props['correlation_type'] = correlation_type
     return d, props
 
 
+def window_averages(L, filling, shift_sets):
+    ## `Averaged` correlations of all bond dimensions for several averaging windows at once
+    return stored_window_averages('densdens', compute, L, filling, shift_sets)
+
+
 def evaluate_extrap_at(L, filling, bond_dim, correlation_type, at_x):
     extrap, obs_vs_extrap, fits = compute_extrap(L, filling, bond_dim, correlation_type, at_x)
     if len(obs_vs_extrap) == 0: return None, None
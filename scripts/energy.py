@@ -29,7 +29,7 @@ def compute_extrap(L, filling, bond_dim):
     sets = filter(lambda d: d.props is not None, sets)
     
     ## Extrapolate
-    return extrapolate.extrapolate(sets, foreach=['L', 't\'', 'Nup_total', 'Ndown_total'], extrap_type=bond_dim.type, deg=bond_dim.deg, num_points=bond_dim.num_points)
+    return extrapolate.extrapolate(sets, foreach=['L', 't\'', 'Nup_total', 'Ndown_total'], extrap_type=bond_dim.type, deg=bond_dim.deg, num_points=bond_dim.num_points, error_mode=bond_dim.error_mode)
 
 
 def evaluate_single(L, filling, bond_dim):
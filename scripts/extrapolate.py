@@ -6,7 +6,8 @@
 
 import pyalps_dset
 import numpy as np
-from copy import deepcopy
+
+import resampling
 
 def rsquared(x, y, coeffs):
     # r-squared
@@ -18,141 +19,153 @@ def rsquared(x, y, coeffs):
     sstot = np.sum((y - ybar)**2)    # or sum([ (yi - ybar)**2 for yi in y])
     return ssreg / sstot
 
-def bond_dimension(data, foreach=[], deg=1, num_points=None):
-    en_vs_bond = pyalps_dset.collectXY(pyalps_dset.flatten(data), 'max_bond_dimension', 'Energy', foreach=foreach)
-    extrap = []
-    fits   = []
-    for d in en_vs_bond:
-        bond_dims = deepcopy(d.x)
-        d.x = 1./d.x
-        d.x = d.x[::-1]
-        d.y = d.y[::-1]
-        
-        sel = np.ones(len(d.x), dtype=bool)
-        if num_points is not None and num_points < len(d.x): sel[num_points:] = False
-        coeff = np.polyfit(d.x[sel], d.y[sel], deg=deg)
-        r2 = rsquared(d.x[sel], d.y[sel], coeff)
-        fit_cut = d.x[num_points-1] if num_points is not None and num_points < len(d.x) else d.x[-1]
-        
-        d.props['fitted_r2'] = r2
-        d.props['fit_deg'] = deg
-        d.props['fit_numpoints'] = num_points
-        d.props['fit_cut']       = fit_cut
-        d.props['fitted_coeff']  = coeff
-        d.props['fitted_energy'] = coeff[-1]
-        
-        dd = pyalps_dset.DataSet()
-        dd.props = deepcopy(d.props)
-        dd.props['fitted_r2'] = r2
-        dd.props['fit_deg'] = deg
-        dd.props['fitted_coeff'] = coeff
-        dd.x = np.linspace(0, max(d.x))
-        dd.y = np.polyval(coeff, dd.x)
-        fits.append(dd)
-        
-        dd = pyalps_dset.DataSet()
-        dd.props = deepcopy(d.props)
-        dd.props['max_bond_dimension'] = 'inf'
-        dd.x = np.array([])
-        dd.y = np.array([ coeff[-1] ])
-        extrap.append(dd)
-        
-        d.props['line'] = 'scatter'
-        d.props['bond_dims'] = bond_dims
-        
-    
-    return extrap, en_vs_bond, fits
 
+## Extrapolation types: property used as x value, transform of the x values, props of the extrapolated point
+EXTRAPOLATION_TYPES = {
+    'bonddim'    : ('max_bond_dimension', lambda x: 1./x, {'max_bond_dimension' : 'inf'}),
+    'variance'   : ('EnergyVariance'    , None          , {'max_bond_dimension' : 'inf', 'EnergyVariance' : 0.}),
+    'truncation' : ('TruncatedWeight'   , None          , {'max_bond_dimension' : 'inf'}),
+}
 
-def variance(data, foreach=[], deg=1, num_points=None):
-    en_vs_variance = pyalps_dset.collectXY(data, 'EnergyVariance', 'Energy', foreach=foreach)
-    extrap = []
-    fits   = []
-    for d in en_vs_variance:
-        sel = np.ones(len(d.x), dtype=bool)
-        if num_points is not None and num_points < len(d.x): sel[num_points:] = False
-        coeff = np.polyfit(d.x[sel], d.y[sel], deg=deg)
-        r2 = rsquared(d.x[sel], d.y[sel], coeff)
-        fit_cut = d.x[num_points-1] if num_points is not None and num_points < len(d.x) else d.x[-1]
-        
-        d.props['fitted_r2'] = r2
-        d.props['fit_deg'] = deg
-        d.props['fit_numpoints'] = num_points
-        d.props['fit_cut']       = fit_cut
-        d.props['fitted_coeff']  = coeff
-        d.props['fitted_energy'] = coeff[-1]
-        
-        dd = pyalps_dset.DataSet()
-        dd.props = deepcopy(d.props)
-        dd.props['fitted_r2'] = r2
-        dd.props['fit_deg'] = deg
-        dd.props['fitted_coeff'] = coeff
-        dd.x = np.linspace(0, max(d.x))
-        dd.y = np.polyval(coeff, dd.x)
-        fits.append(dd)
-        
-        dd = pyalps_dset.DataSet()
-        dd.props = deepcopy(d.props)
-        dd.props['max_bond_dimension'] = 'inf'
-        dd.props['EnergyVariance'] = 0.
-        dd.x = np.array([])
-        dd.y = np.array([ coeff[-1] ])
-        extrap.append(dd)
-        
-        d.props['line'] = 'scatter'
-    
-    return extrap, en_vs_variance, fits
+def collect_groups(data, foreach, extrap_type):
+    ## Energy vs. transformed x for each group, sorted with the best data (smallest x) first
+    if extrap_type not in EXTRAPOLATION_TYPES:
+        raise Exception('Wrong extrapolation type `%s`' % extrap_type)
+    xname, transform, res_props = EXTRAPOLATION_TYPES[extrap_type]
+
+    groups = pyalps_dset.collectXY(data, xname, 'Energy', foreach=foreach)
+    raw_x = []
+    for d in groups:
+        raw_x.append(d.x)
+        if transform is not None:
+            d.x = transform(d.x)
+        order = np.argsort(d.x, kind='mergesort')
+        raw_x[-1] = raw_x[-1][order]
+        d.x = d.x[order]
+        d.y = d.y[order]
+    return groups, raw_x, res_props
+
+def batched_polyfit(groups, deg, num_points):
+    ## polynomial fit of the first `num_points` points of all groups in one batched solve,
+    ## groups are padded with zero rows which do not change the least-squares solution.
+    ## Returns the coefficients, r2 and the leave-one-out prediction error of each group.
+    ngroups = len(groups)
+    npoints = max([len(d.x) for d in groups])
+    lhs  = np.zeros((ngroups, npoints, deg+1))
+    rhs  = np.zeros((ngroups, npoints))
+    mask = np.zeros((ngroups, npoints), dtype=bool)
+    for g, d in enumerate(groups):
+        nsel = len(d.x) if num_points is None else min(num_points, len(d.x))
+        lhs[g,:nsel]  = np.vander(d.x[:nsel], deg+1)
+        rhs[g,:nsel]  = d.y[:nsel]
+        mask[g,:nsel] = True
+
+    scale = np.sqrt((lhs*lhs).sum(axis=1))
+    scale[scale == 0] = 1.
+    lhs /= scale[:,np.newaxis,:]
+    pinv = np.linalg.pinv(lhs)
+    coeff = np.einsum('gpn,gn->gp', pinv, rhs)
+
+    yhat = np.einsum('gnp,gp->gn', lhs, coeff)
+    nsel = mask.sum(axis=1)
+    ybar = rhs.sum(axis=1) / nsel
+    ssreg = np.sum(mask * (yhat - ybar[:,np.newaxis])**2, axis=1)
+    sstot = np.sum(mask * (rhs  - ybar[:,np.newaxis])**2, axis=1)
+
+    hat = np.einsum('gnp,gpn->gn', lhs, pinv)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        r2 = ssreg / sstot
+        loo = np.where(mask, (rhs - yhat) / (1. - hat), 0.)
+        cv_error = np.sqrt(np.sum(loo**2, axis=1) / nsel)
 
+    return coeff / scale, r2, cv_error
 
-def truncation(data, foreach=[], deg=1, num_points=None):
-    en_vs_truncation = pyalps_dset.collectXY(pyalps_dset.flatten(data), 'TruncatedWeight', 'Energy', foreach=foreach)
+def do_extrapolate(data, extrap_type, foreach=[], deg=1, num_points=None, error_mode=None):
+    groups, raw_x, res_props = collect_groups(data, foreach, extrap_type)
     extrap = []
     fits   = []
-    for d in en_vs_truncation:
-        sel = np.ones(len(d.x), dtype=bool)
-        if num_points is not None and num_points < len(d.x): sel[num_points:] = False
-        coeff = np.polyfit(d.x[sel], d.y[sel], deg=deg)
-        r2 = rsquared(d.x[sel], d.y[sel], coeff)
+    if len(groups) == 0:
+        return extrap, groups, fits
+
+    coeffs, r2s, _ = batched_polyfit(groups, deg, num_points)
+    for d, bond_dims, coeff, r2 in zip(groups, raw_x, coeffs, r2s):
         fit_cut = d.x[num_points-1] if num_points is not None and num_points < len(d.x) else d.x[-1]
-        
+
         d.props['fitted_r2'] = r2
         d.props['fit_deg'] = deg
         d.props['fit_numpoints'] = num_points
         d.props['fit_cut']       = fit_cut
         d.props['fitted_coeff']  = coeff
         d.props['fitted_energy'] = coeff[-1]
-        
+        if error_mode is not None:
+            sel = np.ones(len(d.x), dtype=bool)
+            if num_points is not None and num_points < len(d.x): sel[num_points:] = False
+            d.props['error_mode'] = error_mode
+            d.props['fitted_energy_error'] = resampling.polyfit_error(d.x, d.y, deg, sel, mode=error_mode)[-1,0]
+
         dd = pyalps_dset.DataSet()
-        dd.props = deepcopy(d.props)
-        dd.props['fitted_r2'] = r2
-        dd.props['fit_deg'] = deg
-        dd.props['fit_numpoints'] = num_points
-        dd.props['fit_cut']       = fit_cut
-        dd.props['fitted_coeff']  = coeff
+        dd.props = dict(d.props)
         dd.x = np.linspace(0, max(d.x))
         dd.y = np.polyval(coeff, dd.x)
         fits.append(dd)
-        
+
         dd = pyalps_dset.DataSet()
-        dd.props = deepcopy(d.props)
-        dd.props['max_bond_dimension'] = 'inf'
+        dd.props = dict(d.props)
+        dd.props.update(res_props)
         dd.x = np.array([])
         dd.y = np.array([ coeff[-1] ])
         extrap.append(dd)
-        
+
         d.props['line'] = 'scatter'
-    
-    return extrap, en_vs_truncation, fits
+        if extrap_type == 'bonddim':
+            d.props['bond_dims'] = bond_dims
+
+    return extrap, groups, fits
+
 
+def cross_validate(data, foreach=[], extrap_type='variance', degs=[1,2], num_points=[None]):
+    ## scan several (deg, num_points) settings for all groups at once,
+    ## returns one DataSet per group and setting with the extrapolated energy,
+    ## r2 and the leave-one-out prediction error `fit_cv_error`
+    groups, _, res_props = collect_groups(data, foreach, extrap_type)
+    ret = []
+    if len(groups) == 0:
+        return ret
+    for deg in degs:
+        for nump in num_points:
+            coeffs, r2s, cv_errors = batched_polyfit(groups, deg, nump)
+            for d, coeff, r2, cv in zip(groups, coeffs, r2s, cv_errors):
+                dd = pyalps_dset.DataSet()
+                dd.props = dict(d.props)
+                dd.props.update(res_props)
+                dd.props['fit_deg']       = deg
+                dd.props['fit_numpoints'] = nump
+                dd.props['fitted_coeff']  = coeff
+                dd.props['fitted_r2']     = r2
+                dd.props['fit_cv_error']  = cv
+                dd.x = np.array([])
+                dd.y = np.array([ coeff[-1] ])
+                ret.append(dd)
+    return ret
+
+
+def bond_dimension(data, foreach=[], deg=1, num_points=None, error_mode=None):
+    return do_extrapolate(data, 'bonddim', foreach, deg=deg, num_points=num_points, error_mode=error_mode)
+
+def variance(data, foreach=[], deg=1, num_points=None, error_mode=None):
+    return do_extrapolate(data, 'variance', foreach, deg=deg, num_points=num_points, error_mode=error_mode)
+
+def truncation(data, foreach=[], deg=1, num_points=None, error_mode=None):
+    return do_extrapolate(data, 'truncation', foreach, deg=deg, num_points=num_points, error_mode=error_mode)
+
+
+def extrapolate(data, foreach=[], extrap_type='variance', deg=2, num_points=None, error_mode=None):
 
-def extrapolate(data, foreach=[], extrap_type='variance', deg=2, num_points=None):
-    
     if extrap_type == 'variance':
-        return variance(data, foreach, deg=deg, num_points=num_points)
+        return variance(data, foreach, deg=deg, num_points=num_points, error_mode=error_mode)
     elif extrap_type == 'bonddim':
-        return bond_dimension(data, foreach, deg=deg, num_points=num_points)
+        return bond_dimension(data, foreach, deg=deg, num_points=num_points, error_mode=error_mode)
     elif extrap_type == 'truncation':
-        return truncation(data, foreach, deg=deg, num_points=num_points)
+        return truncation(data, foreach, deg=deg, num_points=num_points, error_mode=error_mode)
     else:
         raise Exception('Wrong extrapolation type `%s`' % extrap_type)
-
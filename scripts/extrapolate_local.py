@@ -6,9 +6,10 @@
 
 import pyalps_dset
 import numpy as np
-from copy import deepcopy
 import warnings
 
+import resampling
+
 
 def rsquared(x, y, coeffs):
     # r-squared
@@ -33,18 +34,42 @@ def extrapolate_with_error(x, y, deg, num_points):
     
     return val, err, r2, coeff, xfit, yfit
 
-
-def do_extrapolate(data, obs, xgetter, res_props, foreach, deg, num_points, full_output_at=[]):
-    extrap = []
-    fits   = []
-    obs_vs_extrap = []
+def extrapolate_batch(x, y, deg, num_points):
+    ## same as extrapolate_with_error for all columns of `y` in a single least-squares solve,
+    ## returns arrays of values, errors, r2 and coefficients (one row per column)
+    sel = np.ones(len(x), dtype=bool)
+    if num_points is not None and num_points < len(x): sel[num_points:] = False
+    lhs = np.vander(x[sel], deg+1)
+    scale = np.sqrt((lhs*lhs).sum(axis=0))
+    scale[scale == 0] = 1.
+    coeff = np.linalg.lstsq(lhs / scale, y[sel], rcond=sel.sum()*np.finfo(float).eps)[0]
+    coeff = (coeff.T / scale)
     
-    groups = pyalps_dset.groupSets(data, for_each=foreach)
-    for gg in groups:
-        if (num_points is not None and num_points < len(gg) and num_points < deg+1) or len(gg) < deg+1:
-            print 'WARNING:', 'Extrapolation not possible.', 'len() < deg+1, len={}, deg={}'.format(len(gg), deg)
-            continue
-        
+    vals = coeff[:,-1]
+    errs = abs(vals - y[0]) * .5 # error defined as 50% of the distance from the last point
+    
+    yhat = np.dot(np.vander(x, deg+1), coeff.T)
+    ybar = np.sum(y, axis=0)/len(y)
+    ssreg = np.sum((yhat-ybar)**2, axis=0)
+    sstot = np.sum((y - ybar)**2, axis=0)
+    r2 = ssreg / sstot
+    
+    return vals, errs, r2, coeff
+
+
+def group_arrays(gg, xname, transform):
+    ## x values, extrapolation variable, bond dimensions and observables (one row per dataset) of a group
+    if isinstance(gg, pyalps_dset.DataSetTable):
+        common_props = gg.common_props()
+        if np.any(gg.xlen != gg.xlen[0]) or np.any(gg.ylen != gg.ylen[0]):
+            raise Exception('`x` values do not match between the extrapolation group.')
+        xs = gg.x[:,:gg.xlen[0]]
+        xval = xs[0]
+        if np.any(np.all(abs(xs[1:] - xval) > 1e-10, axis=1)):  raise Exception('`x` values do not match between the extrapolation group.')
+        observables = gg.y[:,:gg.ylen[0]]
+        extrap_x    = np.array(gg.values(xname))
+        bond_dims   = np.array(gg.values('max_bond_dimension'))
+    else:
         common_props = pyalps_dset.dict_intersect([d.props for d in gg])
         
         extrap_x    = []
@@ -58,11 +83,28 @@ def do_extrapolate(data, obs, xgetter, res_props, foreach, deg, num_points, full
             # get y values
             observables.append( d.y )
             # get variance
-            extrap_x.append( xgetter(d) )
+            extrap_x.append( d.props[xname] )
             bond_dims.append(d.props['max_bond_dimension'])
         extrap_x    = np.array(extrap_x)
         bond_dims   = np.array(bond_dims)
         observables = np.array(observables)
+    if transform is not None:
+        extrap_x = transform(extrap_x)
+    return common_props, xval, extrap_x, bond_dims, observables
+
+
+def do_extrapolate(data, obs, xname, transform, res_props, foreach, deg, num_points, full_output_at=[], error_mode=None):
+    extrap = []
+    fits   = []
+    obs_vs_extrap = []
+    
+    groups = pyalps_dset.groupSets(data, for_each=foreach)
+    for gg in groups:
+        if (num_points is not None and num_points < len(gg) and num_points < deg+1) or len(gg) < deg+1:
+            print 'WARNING:', 'Extrapolation not possible.', 'len() < deg+1, len={}, deg={}'.format(len(gg), deg)
+            continue
+        
+        common_props, xval, extrap_x, bond_dims, observables = group_arrays(gg, xname, transform)
         
         order = np.argsort(extrap_x)
         extrap_x    = extrap_x[order]
@@ -70,50 +112,56 @@ def do_extrapolate(data, obs, xgetter, res_props, foreach, deg, num_points, full
         observables = observables[order]
         
         dd = pyalps_dset.DataSet()
-        dd.props = deepcopy(common_props)
+        dd.props = pyalps_dset.CowProps(common_props)
         dd.props['fit_deg'] = deg
         dd.props['fit_numpoints'] = num_points
-        dd.x = deepcopy(xval)
-        dd.y = [0.]*len(xval)
-        for i, xi in enumerate(xval):
-            # warnings.filterwarnings('error', category=np.RankWarning)
-                # extrapolate x_i
-            val, err, r2, coeff, xfit, yfit = extrapolate_with_error(extrap_x, observables[:,i], deg, num_points)
-            dd.y[i] = val
-            # except np.RankWarning:
-            #     print 'RankWarning: num_points={}, deg={}, xi={}'.format(num_points, deg, xi)
-            #     print '  ', ' '.join(['{}={}'.format(k,common_props[k]) for k in foreach])
-            #     dd.y[i] = np.nan
-            #     continue
-            
-            if xi in full_output_at:
-                fit_cut = extrap_x[num_points-1] if num_points is not None and num_points < len(extrap_x) else extrap_x[-1]
-                
-                dfit = pyalps_dset.DataSet()
-                dfit.props = deepcopy(common_props)
-                dfit.props['fitted_x']  = xi
-                dfit.props['fitted_r2'] = r2
-                dfit.props['fit_deg'] = deg
-                dfit.props['fit_numpoints'] = num_points
-                dfit.props['fit_cut']       = fit_cut
-                dfit.props['fitted_coeff'] = coeff
-                dfit.x     = xfit
-                dfit.y     = yfit
-                fits.append(dfit)
+        dd.x = np.array(xval)
+        vals, errs, r2s, coeffs = extrapolate_batch(extrap_x, observables, deg, num_points)
+        dd.y = vals
+        if error_mode is not None:
+            sel = np.ones(len(extrap_x), dtype=bool)
+            if num_points is not None and num_points < len(extrap_x): sel[num_points:] = False
+            errs = resampling.polyfit_error(extrap_x, observables, deg, sel, mode=error_mode)[-1]
+            dd.props['error_mode']   = error_mode
+            dd.props['extrap_error'] = errs
+        
+        ## fit curves only where requested
+        output_at = [xi for xi in full_output_at if xi is not None]
+        for i in np.flatnonzero(np.in1d(xval, output_at)):
+            xi = xval[i]
+            r2 = r2s[i]
+            coeff = coeffs[i]
+            xfit = np.linspace(0, max(extrap_x))
+            yfit = np.polyval(coeff, xfit)
+            fit_cut = extrap_x[num_points-1] if num_points is not None and num_points < len(extrap_x) else extrap_x[-1]
             
-                dvals = pyalps_dset.DataSet()
-                dvals.props = deepcopy(common_props)
-                dvals.props['fitted_x'] = xi
-                dvals.props['line'] = 'scatter'
-                dvals.props['bond_dims'] = deepcopy(bond_dims)
-                dvals.props['fit_deg'] = deg
-                dvals.props['fit_numpoints'] = num_points
-                dvals.props['fit_cut']       = fit_cut
-                dvals.props['fitted_coeff'] = coeff
-                dvals.props['fitted_r2'] = r2
-                dvals.x     = deepcopy(extrap_x)
-                dvals.y     = observables[:,i]
-                obs_vs_extrap.append(dvals)
+            dfit = pyalps_dset.DataSet()
+            dfit.props = pyalps_dset.CowProps(common_props)
+            dfit.props['fitted_x']  = xi
+            dfit.props['fitted_r2'] = r2
+            dfit.props['fit_deg'] = deg
+            dfit.props['fit_numpoints'] = num_points
+            dfit.props['fit_cut']       = fit_cut
+            dfit.props['fitted_coeff'] = coeff
+            dfit.x     = xfit
+            dfit.y     = yfit
+            fits.append(dfit)
+        
+            dvals = pyalps_dset.DataSet()
+            dvals.props = pyalps_dset.CowProps(common_props)
+            dvals.props['fitted_x'] = xi
+            dvals.props['line'] = 'scatter'
+            dvals.props['bond_dims'] = bond_dims
+            dvals.props['fit_deg'] = deg
+            dvals.props['fit_numpoints'] = num_points
+            dvals.props['fit_cut']       = fit_cut
+            dvals.props['fitted_coeff'] = coeff
+            dvals.props['fitted_r2'] = r2
+            if error_mode is not None:
+                dvals.props['fitted_error'] = errs[i]
+            dvals.x     = np.array(extrap_x)
+            dvals.y     = observables[:,i]
+            obs_vs_extrap.append(dvals)
         
         dd.props.update(res_props)
         extrap.append(dd)
@@ -122,37 +170,36 @@ def do_extrapolate(data, obs, xgetter, res_props, foreach, deg, num_points, full
 
 
 
-def bond_dimension(data, obs, foreach=[], deg=2, num_points=None, full_output_at=[]):
-    get_inv_bond_dim = lambda ss: 1./ss.props['max_bond_dimension']
+def bond_dimension(data, obs, foreach=[], deg=2, num_points=None, full_output_at=[], error_mode=None):
     props = {
         'max_bond_dimension' : 'inf',
     }
-    return do_extrapolate(data=data, obs=obs, xgetter=get_inv_bond_dim, res_props=props, foreach=foreach, deg=deg, num_points=num_points, full_output_at=full_output_at)
+    return do_extrapolate(data=data, obs=obs, xname='max_bond_dimension', transform=lambda x: 1./x, res_props=props, foreach=foreach, deg=deg, num_points=num_points, full_output_at=full_output_at, error_mode=error_mode)
 
 
-def variance(data, obs, foreach=[], deg=2, num_points=None, full_output_at=[]):
+def variance(data, obs, foreach=[], deg=2, num_points=None, full_output_at=[], error_mode=None):
     props = {
         'max_bond_dimension' : 'inf',
         'EnergyVariance'     : 0.,
     }
-    return do_extrapolate(data=data, obs=obs, xgetter=lambda ss: ss.props['EnergyVariance'], res_props=props, foreach=foreach, deg=deg, num_points=num_points, full_output_at=full_output_at)
+    return do_extrapolate(data=data, obs=obs, xname='EnergyVariance', transform=None, res_props=props, foreach=foreach, deg=deg, num_points=num_points, full_output_at=full_output_at, error_mode=error_mode)
 
 
-def truncation(data, obs, foreach=[], deg=2, num_points=None, full_output_at=[]):
+def truncation(data, obs, foreach=[], deg=2, num_points=None, full_output_at=[], error_mode=None):
     props = {
         'max_bond_dimension' : 'inf',
         'TruncatedWeight'    : 0.,
     }
-    return do_extrapolate(data=data, obs=obs, xgetter=lambda ss: ss.props['TruncatedWeight'], res_props=props, foreach=foreach, deg=deg, num_points=num_points, full_output_at=full_output_at)
+    return do_extrapolate(data=data, obs=obs, xname='TruncatedWeight', transform=None, res_props=props, foreach=foreach, deg=deg, num_points=num_points, full_output_at=full_output_at, error_mode=error_mode)
 
 
-def extrapolate(data, obs, foreach=[], extrap_type='variance', deg=2, num_points=None, full_output_at=[]):
+def extrapolate(data, obs, foreach=[], extrap_type='variance', deg=2, num_points=None, full_output_at=[], error_mode=None):
     
     if extrap_type == 'variance':
-        return variance(data, obs, foreach, deg=deg, num_points=num_points, full_output_at=full_output_at)
+        return variance(data, obs, foreach, deg=deg, num_points=num_points, full_output_at=full_output_at, error_mode=error_mode)
     elif extrap_type == 'bonddim':
-        return bond_dimension(data, obs, foreach, deg=deg, num_points=num_points, full_output_at=full_output_at)
+        return bond_dimension(data, obs, foreach, deg=deg, num_points=num_points, full_output_at=full_output_at, error_mode=error_mode)
     elif extrap_type == 'truncation':
-        return truncation(data, obs, foreach, deg=deg, num_points=num_points, full_output_at=full_output_at)
+        return truncation(data, obs, foreach, deg=deg, num_points=num_points, full_output_at=full_output_at, error_mode=error_mode)
     else:
         raise Exception('Wrong extrapolation type `%s`' % extrap_type)
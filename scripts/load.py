@@ -4,18 +4,20 @@
 #      (See accompanying file LICENSE_1_0.txt or copy at
 #          http://www.boost.org/LICENSE_1_0.txt)
 
-from os import path
 import utils
 
 
 def result(what, **kwargs):
     fname = utils.filename(what, **kwargs)
-    if path.exists(fname):
-        return utils.load(fname)
+    return utils.memory_cache.lookup(fname, lambda: load_result(fname, what, **kwargs))
+
+def load_result(fname, what, **kwargs):
+    if utils.is_cached(fname):
+        return utils.load_cached(fname)
     else:
         try:
             import pyalps_dset
-            import pairfield_correlations, density_correlations, density, amplitudes
+            import pairfield_correlations, density_correlations, density, amplitudes, energy
             if   what == 'pairfield':
                 return utils.load_or_evaluate(what, pairfield_correlations.evaluate, **kwargs)
             elif what == 'densdens':
@@ -26,6 +28,8 @@ def result(what, **kwargs):
                 return utils.load_or_evaluate(what, density.evaluate_fit, **kwargs)
             elif what == 'density_amplitudes':
                 return utils.load_or_evaluate(what, amplitudes.evaluate, **kwargs)
+            elif what == 'energy':
+                return utils.load_or_evaluate(what, energy.evaluate, **kwargs)
             else:
                 raise Exception('`%s` is not a valid measurement.' % what)
             
@@ -36,8 +40,11 @@ def result(what, **kwargs):
 def extrapolation(what, **kwargs):
     what = 'extrap_'+what
     fname = utils.filename(what, **kwargs)
-    if path.exists(fname):
-        return utils.load(fname)
+    return utils.memory_cache.lookup(fname, lambda: load_extrapolation(fname, what, **kwargs))
+
+def load_extrapolation(fname, what, **kwargs):
+    if utils.is_cached(fname):
+        return utils.load_cached(fname)
     else:
         import pairfield_correlations, density_correlations, density, energy
         if   what == 'extrap_pairfield':
@@ -5,27 +5,41 @@
 #          http://www.boost.org/LICENSE_1_0.txt)
 
 import numpy as np
+import copy
+from glob import glob
+from contextlib import contextmanager
+from os import path
 
-def load_variance_for_dset(ss):
+import utils
+
+## observables read from the raw data by each evaluator, cache_builder reads the union
+## needed by a batch of tasks once per result file
+EVALUATOR_OBSERVABLES = {
+    'energy'    : ['Energy'],
+    'density'   : ['Local density up', 'Local density down'],
+    'densdens'  : ['dens corr up-up', 'dens corr up-down', 'dens corr down-up', 'dens corr down-down',
+                   'Local density up', 'Local density down'],
+    'pairfield' : ['pair field 1', 'pair field 2', 'pair field 3', 'pair field 4'],
+}
+
+def import_pyalps():
     try:
         import pyalps
     except ImportError, e:
         print 'ERROR: To extract new observbales from the raw data you need the ALPS.Python library.'
         raise e
+    return pyalps
 
-    variance = pyalps.loadEigenstateMeasurements([ss.props['filename']], what=['EnergyVariance'])
+def load_variance(fname):
+    pyalps = import_pyalps()
+    variance = pyalps.loadEigenstateMeasurements([fname], what=['EnergyVariance'])
     if len(variance) < 1 or len(variance[0]) < 1:
-        raise Exception('EnergyVariance not found in', ss.props['filename'])
+        raise Exception('EnergyVariance not found in', fname)
     return variance[0][0].y[0]
 
-def load_truncated_weight_for_dset(ss):
-    try:
-        import pyalps
-    except ImportError, e:
-        print 'ERROR: To extract new observbales from the raw data you need the ALPS.Python library.'
-        raise e
-
-    ar = pyalps.hdf5.archive(ss.props['filename'])
+def load_truncated_weight(fname):
+    pyalps = import_pyalps()
+    ar = pyalps.hdf5.archive(fname)
     try:
         if 'simulation' in ar.list_children('/'):
             iteration_path = '/simulation/iteration'
@@ -34,25 +48,172 @@ def load_truncated_weight_for_dset(ss):
         sweeps = ar.list_children(iteration_path)
         sweeps = [int(s) for s in sweeps]
         max_sweep = max(sweeps)
-        
+
         truncated_weight = ar[iteration_path+'/'+str(max_sweep)+'/results/TruncatedWeight/mean/value']
-        ss.props['TruncatedWeight'] = max(truncated_weight)
-        return ss.props['TruncatedWeight']
+        return max(truncated_weight)
     except Exception as e:
-        print 'Warning:', 'no TruncatedWeight found in', ss.props['filename']
+        print 'Warning:', 'no TruncatedWeight found in', fname
         print e
 
-def loadEigenstateMeasurements(*args, **kwargs):
+def read_last_sweep(fname):
+    ## number of the last sweep in the iteration list of the archive
     try:
         import pyalps
-    except ImportError, e:
-        print 'ERROR: To extract new observbales from the raw data you need the ALPS.Python library.'
-        raise e
+    except ImportError:
+        import h5py
+        with h5py.File(fname, 'r') as ff:
+            iteration_path = '/simulation/iteration' if 'simulation' in ff else '/spectrum/iteration'
+            return max([int(s) for s in ff[iteration_path].keys()])
+    ar = pyalps.hdf5.archive(fname)
+    iteration_path = '/simulation/iteration' if 'simulation' in ar.list_children('/') else '/spectrum/iteration'
+    return max([int(s) for s in ar.list_children(iteration_path)])
+
+## Metadata index: TruncatedWeight and EnergyVariance of all raw files,
+## stored in a small table such that they are read only once from the HDF5 files
+RAW_ROOT = path.join(utils.PROJECT_ROOT, 'data_raw')
+METADATA_INDEX = path.join(utils.PROJECT_ROOT, 'data_extracted', 'raw_metadata.txt')
+
+def read_metadata_h5py(fname):
+    import h5py
+    with h5py.File(fname, 'r') as ff:
+        if 'simulation' in ff:
+            iteration_path = '/simulation/iteration'
+        else:
+            iteration_path = '/spectrum/iteration'
+        max_sweep = max([int(s) for s in ff[iteration_path].keys()])
+        truncated_weight = max(ff[iteration_path+'/'+str(max_sweep)+'/results/TruncatedWeight/mean/value'][()])
+        variance = np.atleast_1d(ff['/spectrum/results/EnergyVariance/mean/value'][()])[0]
+    return truncated_weight, variance
+
+def read_metadata(fname):
+    try:
+        import pyalps
+    except ImportError:
+        return read_metadata_h5py(fname)
+    return load_truncated_weight(fname), load_variance(fname)
+
+_metadata_index = None
+def load_metadata_index():
+    global _metadata_index
+    if _metadata_index is None:
+        _metadata_index = {}
+        if path.exists(METADATA_INDEX):
+            for line in open(METADATA_INDEX):
+                if line.startswith('#'):
+                    continue
+                fname, mtime, truncated_weight, variance = line.split()
+                _metadata_index[fname] = (float(mtime), float(truncated_weight), float(variance))
+    return _metadata_index
+
+def build_metadata_index():
+    ## scan data_raw/ and read the metadata of new or modified files
+    global _metadata_index
+    old_index = load_metadata_index()
+    index = {}
+    for fname in sorted(glob(path.join(RAW_ROOT, '*', '*', '*.out.res.h5'))):
+        key = path.relpath(fname, RAW_ROOT)
+        mtime = path.getmtime(fname)
+        if key in old_index and old_index[key][0] == mtime:
+            index[key] = old_index[key]
+            continue
+        try:
+            truncated_weight, variance = read_metadata(fname)
+        except Exception as e:
+            print 'Warning:', 'could not read metadata of', fname
+            print e
+            continue
+        if truncated_weight is None:
+            continue
+        index[key] = (mtime, float(truncated_weight), float(variance))
     
-    data = pyalps.loadEigenstateMeasurements(*args, **kwargs)
-    for d in pyalps.flatten(data):
-        if isinstance(d, pyalps.DataSet):
-            d.props['TruncatedWeight'] = load_truncated_weight_for_dset(d)
-            d.props['EnergyVariance']  = load_variance_for_dset(d)
+    with utils.atomic_write(METADATA_INDEX) as ff:
+        ff.write('# filename mtime TruncatedWeight EnergyVariance\n')
+        for key, (mtime, truncated_weight, variance) in sorted(index.items()):
+            ff.write('{} {!r} {!r} {!r}\n'.format(key, mtime, truncated_weight, variance))
+    _metadata_index = index
+    return index
+
+def lookup_metadata(fname):
+    ## (TruncatedWeight, EnergyVariance) from the index, None if missing or outdated
+    key = path.relpath(fname, RAW_ROOT)
+    index = load_metadata_index()
+    if key in index and path.exists(fname) and index[key][0] == path.getmtime(fname):
+        return index[key][1:]
+    return None
+
+def load_variance_for_dset(ss):
+    return load_variance(ss.props['filename'])
+
+def load_truncated_weight_for_dset(ss):
+    ss.props['TruncatedWeight'] = load_truncated_weight(ss.props['filename'])
+    return ss.props['TruncatedWeight']
+
+
+class RawSession(object):
+    ## measurements `what` of one result file, read in a single pass together with
+    ## TruncatedWeight and EnergyVariance on first use and shared by all evaluators
+    def __init__(self, fname, what):
+        self.fname = fname
+        self.what = set(what)
+        self.sets = None
+    
+    def load(self):
+        pyalps = import_pyalps()
+        meta = lookup_metadata(self.fname)
+        extra = ['EnergyVariance'] if meta is None else []
+        data = pyalps.loadEigenstateMeasurements([self.fname], what=list(self.what) + extra)
+        
+        self.sets = []
+        variance = None
+        for d in pyalps.flatten(data):
+            if not isinstance(d, pyalps.DataSet):
+                continue
+            if d.props['observable'] == 'EnergyVariance':
+                variance = d.y[0]
+            else:
+                self.sets.append(d)
+        if meta is not None:
+            truncated_weight, variance = meta
+        elif variance is None:
+            raise Exception('EnergyVariance not found in', self.fname)
+        else:
+            truncated_weight = load_truncated_weight(self.fname)
+        for d in self.sets:
+            d.props['TruncatedWeight'] = truncated_weight
+            d.props['EnergyVariance']  = variance
     
-    return data
+    def select(self, what):
+        ## shallow copies, such that evaluators can modify the props
+        if self.sets is None:
+            self.load()
+        ret = []
+        for d in self.sets:
+            if d.props['observable'] in what:
+                dd = copy.copy(d)
+                dd.props = dict(d.props)
+                ret.append(dd)
+        return ret
+
+_session = None
+@contextmanager
+def raw_session(fname, what):
+    ## inside the block the observables `what` of `fname` are read once and shared,
+    ## the data is released when the block ends
+    global _session
+    previous = _session
+    _session = RawSession(fname, what)
+    try:
+        yield _session
+    finally:
+        _session = previous
+
+def loadEigenstateMeasurements(files, what):
+    if isinstance(what, str):
+        what = [what]
+    ret = []
+    for fname in files:
+        if _session is not None and _session.fname == fname and set(what) <= _session.what:
+            ret.append(_session.select(what))
+        else:
+            ret.append(RawSession(fname, what).select(what))
+    return ret
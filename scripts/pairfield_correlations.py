@@ -5,7 +5,6 @@
 #          http://www.boost.org/LICENSE_1_0.txt)
 
 import numpy as np
-from copy import deepcopy
 
 import pyalps_dset
 
@@ -33,31 +32,22 @@ def compute(fname):
     L = int(common_props['L'])
     W = int(common_props['W']) if 'W' in common_props else 2
     idx = index_map(L, W)
+    data = observable_index(data)
     
+    ## combine the pair fields on the [ix_lower, ix_upper, jx_lower, jx_upper] rung pairs
     try:
-        pairfield_1 = select_to_nd(data, 'pair field 1', idx, dims=4)
-        pairfield_2 = select_to_nd(data, 'pair field 2', idx, dims=4)
-        pairfield_3 = select_to_nd(data, 'pair field 3', idx, dims=4)
-        pairfield_4 = select_to_nd(data, 'pair field 4', idx, dims=4)
+        corr = accumulate_rung_pairs(data, [('pair field 1', +1.),
+                                            ('pair field 2', -1.),
+                                            ('pair field 3', -1.),
+                                            ('pair field 4', +1.),
+                                            ], idx)
     except ObservableNotFound:
         print 'WARNING:', 'Measurement not found in', fname
         return None
-    
-    ix_lower = idx[:,0].reshape(L,1)
-    ix_upper = idx[:,1].reshape(L,1)
-    jx_lower = idx[:,0].reshape(1,L)
-    jx_upper = idx[:,1].reshape(1,L)
-    
-    corr = np.zeros((L,L))
-    
-    corr += +pairfield_1[ ix_lower, ix_upper, jx_lower, jx_upper ]
-    corr += -pairfield_2[ ix_lower, ix_upper, jx_lower, jx_upper ]
-    corr += -pairfield_3[ ix_lower, ix_upper, jx_lower, jx_upper ]
-    corr += +pairfield_4[ ix_lower, ix_upper, jx_lower, jx_upper ]
 
 
     d = pyalps_dset.DataSet()
-    d.props = deepcopy(common_props)
+    d.props = pyalps_dset.CowProps(common_props)
     d.props['observable'] = 'Pairfield Correlation'
     d.y = corr
     d.idx = idx
@@ -71,7 +61,7 @@ def compute_extrap(L, filling, bond_dim, correlation_type, at_x=None):
     sets = filter(lambda d: d.props is not None, sets)
     
     ## Extrapolate
-    return extrapolate_local.extrapolate(sets, 'Pairfield Correlation', foreach=['L', 't\'', 'Nup_total', 'Ndown_total'], extrap_type=bond_dim.type, deg=bond_dim.deg, num_points=bond_dim.num_points, full_output_at=[at_x])
+    return extrapolate_local.extrapolate(sets, 'Pairfield Correlation', foreach=['L', 't\'', 'Nup_total', 'Ndown_total'], extrap_type=bond_dim.type, deg=bond_dim.deg, num_points=bond_dim.num_points, full_output_at=[at_x], error_mode=bond_dim.error_mode)
 
 
 def evaluate_single(L, filling, bond_dim, correlation_type):
@@ -81,8 +71,8 @@ def evaluate_single(L, filling, bond_dim, correlation_type):
         print 'No data available for L={}, n={}, M={}, {}'.format(L, filling, bond_dim, correlation_type)
         return None, None
     
-    ## Get correlation matrix
-    corr = compute(fname)
+    ## Get correlation matrix, all correlation types are slices of the stored matrix
+    corr = stored_correlation('pairfield', compute, fname, L, filling, bond_dim)
     if corr is None:
         print 'No data available for L={}, n={}, M={}, {}'.format(L, filling, bond_dim, correlation_type)
         return None, None
@@ -92,17 +82,21 @@ def evaluate_single(L, filling, bond_dim, correlation_type):
         y = corr.y[start_site, start_site+1:]
         x = np.arange(1, len(y)+1, dtype=float)
         d = np.column_stack([x, y])
-        props = deepcopy(corr.props)
+        props = pyalps_dset.CowProps(corr.props)
     elif isinstance(correlation_type, utils.Averaged):
-        shifts = range(-5, 6)
-        x,y = average_around_middle(corr.y, corr.props['L'], shifts)
+        x,y = average_around_middle(corr.y, corr.props['L'], correlation_type.shifts)
         d = np.column_stack([x, y])
-        props = deepcopy(corr.props)
+        props = pyalps_dset.CowProps(corr.props)
     
     props['correlation_type'] = str(correlation_type)
     return d, props
 
 
+def window_averages(L, filling, shift_sets):
+    ## `Averaged` correlations of all bond dimensions for several averaging windows at once
+    return stored_window_averages('pairfield', compute, L, filling, shift_sets)
+
+
 def evaluate_extrap_at(L, filling, bond_dim, correlation_type, at_x):
     extrap, obs_vs_extrap, fits = compute_extrap(L, filling, bond_dim, correlation_type, at_x)
     if len(obs_vs_extrap) == 0: return None, None
@@ -5,8 +5,12 @@
 #          http://www.boost.org/LICENSE_1_0.txt)
 
 import copy
+import collections
 import numpy as np
 
+from hlist import flatten
+from dict_intersect import values_agree, values_identical, fingerprint
+
 class ResultProperties:
     def __init__(self):
         self.props = {}
@@ -33,6 +37,104 @@ class DataSet(ResultProperties):
     def __repr__(self):
         return "x=%s\ny=%s\nprops=%s" % (self.x, self.y, self.props)
         
+class CowProps(collections.MutableMapping):
+    """
+    Copy-on-write dictionary of properties, to be used instead of deepcopy(props).
+    
+    It shares the dictionary of its parent until a key is written or deleted, then it
+    continues on a shallow copy. The values are never copied and must not be modified in place.
+    A CowProps parent copies its own storage on its next write as well, a plain dict parent
+    must not be modified while it is shared.
+    The dict_intersect fingerprint of the storage is kept in a cell shared by all CowProps
+    of the same storage, until the storage is written.
+    """
+    __slots__ = ('_data', '_owner', '_fingerprint')
+    
+    def __init__(self, parent=None):
+        if parent is None:
+            self._data, self._owner, self._fingerprint = {}, True, [None]
+        elif isinstance(parent, CowProps):
+            self._data, self._owner, self._fingerprint = parent._data, False, parent._fingerprint
+            parent._owner = False
+        else:
+            self._data, self._owner, self._fingerprint = parent, False, [None]
+    
+    def _own(self):
+        ## called before each write, the owner is the only user of its storage
+        if self._owner:
+            self._fingerprint[0] = None
+        else:
+            self._data = dict(self._data)
+            self._owner = True
+            self._fingerprint = [None]
+    
+    def __getitem__(self, key):
+        return self._data[key]
+    
+    def __setitem__(self, key, value):
+        self._own()
+        self._data[key] = value
+    
+    def __delitem__(self, key):
+        self._own()
+        del self._data[key]
+    
+    def update(self, *args, **kwargs):
+        self._own()
+        self._data.update(*args, **kwargs)
+    
+    def __iter__(self):
+        return iter(self._data)
+    
+    def __len__(self):
+        return len(self._data)
+    
+    def __contains__(self, key):
+        return key in self._data
+    
+    def get(self, key, default=None):
+        return self._data.get(key, default)
+    
+    def keys(self):
+        return self._data.keys()
+    
+    def values(self):
+        return self._data.values()
+    
+    def items(self):
+        return self._data.items()
+    
+    def iterkeys(self):
+        return self._data.iterkeys()
+    
+    def itervalues(self):
+        return self._data.itervalues()
+    
+    def iteritems(self):
+        return self._data.iteritems()
+    
+    def copy(self):
+        return CowProps(self)
+    
+    def cached_fingerprint(self):
+        if self._fingerprint[0] is None:
+            self._fingerprint[0] = fingerprint(self._data)
+        return self._fingerprint[0]
+    
+    def __eq__(self, other):
+        if isinstance(other, CowProps):
+            other = other._data
+        return self._data == other
+    
+    def __ne__(self, other):
+        return not self == other
+    
+    def __repr__(self):
+        return repr(self._data)
+    
+    def __reduce__(self):
+        return (CowProps, (dict(self._data),))
+
 class ResultFile(ResultProperties):
     def __init__(self,fn=None):
         ResultProperties.__init__(self)
@@ -40,3 +142,148 @@ class ResultFile(ResultProperties):
             self.props['filename'] = fn
 
 
+_missing = object()
+
+def pack_rows(rows):
+    ## rows of different length stacked into one 2-D array, padded with NaN (zero for non-float data)
+    rows = [np.asarray(r) for r in rows]
+    lengths = np.array([len(r) if r.ndim > 0 else 1 for r in rows], dtype=int)
+    rows = [r.reshape(1) if r.ndim == 0 else r for r in rows]
+    trailing = set([r.shape[1:] for r in rows if len(r) > 0])
+    if len(trailing) > 1:
+        raise Exception('Rows of a DataSetTable must have the same trailing shape, got %s' % list(trailing))
+    trailing = trailing.pop() if len(trailing) > 0 else ()
+    filled = [r for r in rows if len(r) > 0]
+    dtype = np.result_type(*filled) if len(filled) > 0 else np.dtype(float)
+    width = lengths.max() if len(lengths) > 0 else 0
+    ret = np.zeros((len(rows), width) + trailing, dtype=dtype)
+    if dtype.kind in 'fc':
+        ret.fill(np.nan)
+    for i, r in enumerate(rows):
+        ret[i,:len(r)] = r
+    return ret, lengths
+
+class DataSetTable(object):
+    """
+    The DataSetTable class stores many DataSets by columns, for bulk analysis of parameter scans.
+    
+    Members are:
+     * shared - The properties with the same type and value in all rows, stored once.
+     * columns - A dictionary property -> list with the value of each row, for all other properties.
+     * x, y - 2-D arrays with one row per dataset. Shorter rows are padded, their lengths are
+              stored in xlen and ylen.
+    
+    Rows are converted back to DataSet objects with to_datasets() or by indexing, the collection
+    and grouping functions work on the columns directly.
+    """
+    __slots__ = ('shared', 'columns', 'x', 'xlen', 'y', 'ylen')
+    
+    def __init__(self, shared=None, columns=None, x=None, xlen=None, y=None, ylen=None):
+        self.shared  = shared if shared is not None else {}
+        self.columns = columns if columns is not None else {}
+        self.x, self.xlen = (x, xlen) if x is not None else (np.zeros((0,0)), np.zeros(0, dtype=int))
+        self.y, self.ylen = (y, ylen) if y is not None else (np.zeros((0,0)), np.zeros(0, dtype=int))
+    
+    @classmethod
+    def from_datasets(cls, sets):
+        sets = list(flatten(sets))
+        props = [d.props for d in sets]
+        keys = set()
+        for p in props:
+            keys.update(p)
+        ## only exactly equal values are shared, such that to_datasets() returns the same props
+        shared = {}
+        columns = {}
+        for k in keys:
+            col = [p.get(k, _missing) for p in props]
+            if not any(v is _missing for v in col) and values_identical(col):
+                shared[k] = col[0]
+            else:
+                columns[k] = col
+        x, xlen = pack_rows([d.x for d in sets])
+        y, ylen = pack_rows([d.y for d in sets])
+        return cls(shared, columns, x, xlen, y, ylen)
+    
+    def __len__(self):
+        return len(self.ylen)
+    
+    def __getitem__(self, i):
+        ret = DataSet()
+        ret.x = self.x[i,:self.xlen[i]]
+        ret.y = self.y[i,:self.ylen[i]]
+        ret.props = self.row_props(i)
+        return ret
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    
+    def __repr__(self):
+        return "DataSetTable(%d rows)\nshared=%s\ncolumns=%s" % (len(self), self.shared, sorted(self.columns.keys()))
+    
+    def to_datasets(self):
+        """ list of DataSet objects, x and y are views of the rows of the table """
+        return list(self)
+    
+    def row_props(self, i):
+        ret = dict(self.shared)
+        for k, col in self.columns.iteritems():
+            if col[i] is not _missing:
+                ret[k] = col[i]
+        return ret
+    
+    def positions(self, rows=None):
+        return range(len(self)) if rows is None else rows
+    
+    def values(self, key, rows=None):
+        """ list with the value of the property `key` for each row, raises KeyError if a row does not have it """
+        n = len(self) if rows is None else len(rows)
+        if key in self.shared:
+            return [self.shared[key]] * n
+        col = self.columns[key]
+        ret = col if rows is None else [col[i] for i in rows]
+        if any(v is _missing for v in ret):
+            raise KeyError(key)
+        return list(ret)
+    
+    def has(self, key, rows=None):
+        """ boolean array, True for the rows which have the property `key` """
+        n = len(self) if rows is None else len(rows)
+        if key in self.shared:
+            return np.ones(n, dtype=bool)
+        if key not in self.columns:
+            return np.zeros(n, dtype=bool)
+        col = self.columns[key]
+        return np.array([col[i] is not _missing for i in self.positions(rows)], dtype=bool)
+    
+    def group_rows(self, keys, rows=None):
+        """ dict key tuple -> array with the positions of the rows with these values of the properties in keys """
+        rows = self.positions(rows)
+        if len(keys) == 0:
+            return {(): np.asarray(rows, dtype=int)} if len(rows) > 0 else {}
+        keycols = zip(*[self.values(k, rows) for k in keys])
+        codes = {}
+        members = []
+        for i, k in zip(rows, keycols):
+            code = codes.get(k)
+            if code is None:
+                code = codes[k] = len(members)
+                members.append([])
+            members[code].append(i)
+        return dict([(k, np.array(members[code], dtype=int)) for k, code in codes.iteritems()])
+    
+    def common_props(self, rows=None):
+        """ the properties with identical values in the given rows, same as dict_intersect of their props """
+        rows = self.positions(rows)
+        ret = dict(self.shared)
+        for k, col in self.columns.iteritems():
+            vals = [col[i] for i in rows]
+            if len(vals) > 0 and not any(v is _missing for v in vals) and values_agree(vals):
+                ret[k] = vals[0]
+        return ret
+    
+    def take(self, rows):
+        """ new table with the given rows, shared props are not copied """
+        rows = np.asarray(rows, dtype=int)
+        columns = dict([(k, [col[i] for i in rows]) for k, col in self.columns.iteritems()])
+        return DataSetTable(self.shared, columns, self.x[rows], self.xlen[rows], self.y[rows], self.ylen[rows])
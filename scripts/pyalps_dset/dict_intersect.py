@@ -4,30 +4,115 @@
 #      (See accompanying file LICENSE_1_0.txt or copy at
 #          http://www.boost.org/LICENSE_1_0.txt)
 
+import hashlib
 import numpy as np
 
+SIMPLE_TYPES = frozenset([bool, int, long, float, str, unicode, type(None),
+                          np.bool_, np.int32, np.int64, np.float32, np.float64, np.str_])
+_pending = object()
+
+def value_fingerprint(v):
+    """ hashable fingerprint of an array or other non-scalar property value, arrays are fingerprinted
+        by dtype, shape and a hash of their bytes. Returns None for values which have to be compared explicitly.
+    """
+    if isinstance(v, np.ndarray) and v.dtype.kind != 'O':
+        return (v.dtype.str, v.shape, hashlib.sha1(v.tobytes()).digest())
+    return None
+
+def fingerprint(d):
+    """ fingerprint of a props dict: the frozenset of all (key, value) items with scalar values
+        and a dict for the fingerprints of all other values, which are computed on first use.
+        
+        Props which keep their fingerprint until they are written, e.g. CowProps, provide it
+        by a cached_fingerprint() method.
+    """
+    if type(d) is not dict:
+        cached = getattr(d, 'cached_fingerprint', None)
+        if cached is not None:
+            return cached()
+    ## scalar items are collected in one pass over a copy without the other values, NaN is never equal and left out
+    simple = SIMPLE_TYPES
+    other = [k for k, v in d.iteritems() if type(v) not in simple or v != v]
+    scalars = dict(d)
+    for k in other:
+        del scalars[k]
+    special = dict.fromkeys([k for k in other if type(d[k]) not in simple], _pending)
+    return frozenset(scalars.iteritems()), special
+
+def special_fingerprint(special, key, v):
+    """ fingerprint of a non-scalar value, stored in the fingerprint dict unless it is a writeable array,
+        which may be changed in place until the next call
+    """
+    fv = special.get(key)
+    if fv is _pending:
+        fv = value_fingerprint(v)
+        if not (isinstance(v, np.ndarray) and v.flags.writeable):
+            special[key] = fv
+    return fv
+
+def values_agree(values):
+    val0 = values[0]
+    for v in values:
+        try:
+            if val0 != v:
+                return False
+        except:
+            if np.all(val0 != v):
+                return False
+    return True
+
+def values_identical(values):
+    """ True if all values have the same type and value, arrays also need the same dtype and shape.
+        Unlike values_agree, 1, 1.0 and True differ and arrays differ if any element differs.
+    """
+    val0 = values[0]
+    for v in values:
+        if v is val0:
+            continue
+        if type(v) is not type(val0):
+            return False
+        if isinstance(val0, np.ndarray):
+            if v.dtype != val0.dtype or v.shape != val0.shape or not np.array_equal(v, val0):
+                return False
+        else:
+            try:
+                if not (v == val0):
+                    return False
+            except Exception:
+                return False
+    return True
+
 def dict_intersect(dicts):
     """ computes the intersection of a list of dicts
     
         this function takes a list of dicts as input and returns a dict containing all those key-value pairs that appear with identical values in all dicts 
+        
+        Scalar items are intersected as sets, arrays are compared by their fingerprints.
+        Only the remaining keys are compared value by value.
     """
-    sets = [set(q.keys()) for q in dicts]
-    intersection = sets[0]
-    for iset in sets:
-        intersection &= iset
+    fps = [fingerprint(q) for q in dicts]
+    common = fps[0][0].intersection(*[fp[0] for fp in fps[1:]])
     ret = {}
-    for key in intersection:
-        take = True
+    for key, val in dicts[0].iteritems():
+        if type(val) in SIMPLE_TYPES and val == val and (key, val) in common:
+            ret[key] = val
+    
+    special = set()
+    for fp in fps:
+        special.update(fp[1])
+    for key in special:
+        if key in ret or not all(key in q for q in dicts):
+            continue
         val0 = dicts[0][key]
-        for idict in dicts:
-            try:
-                if val0 != idict[key]:
-                    take = False
-            except:
-                if np.all(val0 != idict[key]):
-                    take = False
-        if take:
-            ret[key] = dicts[0][key]
+        if isinstance(val0, np.ndarray) and val0.dtype.kind in 'fc' and val0.size > 0 and np.isnan(val0).all():
+            continue
+        if all(q[key] is val0 for q in dicts):
+            same = not isinstance(val0, np.ndarray) or val0.dtype.kind != 'O'
+        else:
+            fvals = [special_fingerprint(fp[1], key, q[key]) for q, fp in zip(dicts, fps)]
+            same = fvals[0] is not None and fvals.count(fvals[0]) == len(fvals)
+        if same or values_agree([q[key] for q in dicts]):
+            ret[key] = val0
     return ret
 
 def dict_difference(dicts):
@@ -8,33 +8,38 @@ import copy
 
 def depth(hl):
     ret = 0
-    if len(hl) == 0:
-        return 0
-    elif type(hl[0]) == list:
-        return 1+depth(hl[0])
-    else:
-        return 1
+    while len(hl) > 0:
+        ret += 1
+        if type(hl[0]) != list:
+            break
+        hl = hl[0]
+    return ret
 
-def index__(hl,indices,idx,level,max_level):
-    for ie in range(len(hl)):
-        idx[level] = ie
-        e = hl[ie]
-        if level < max_level-1:
-            index__(e,indices,idx,level+1,max_level)
+def index__(hl,max_level):
+    """ walks the hierarchical list down to `max_level` without recursion
+    
+        returns the index prefix and the innermost list of all elements, in depth-first order
+    """
+    blocks = []
+    stack = [(hl, ())]
+    while stack:
+        e, idx = stack.pop()
+        if len(idx) >= max_level-1:
+            blocks.append((idx, e))
         else:
-            indices.append(tuple(idx))
+            for ie in reversed(range(len(e))):
+                stack.append((e[ie], idx + (ie,)))
+    return blocks
 
 def hset__(hl,idx,level,value):
-    if level == len(idx)-1:
-        hl[idx[level]] = value
-    else:
-        hset__(hl[idx[level]],idx,level+1,value)
+    for i in idx[level:-1]:
+        hl = hl[i]
+    hl[idx[-1]] = value
 
 def hget__(hl,idx,level):
-    if level == len(idx)-1:
-        return hl[idx[level]]
-    else:
-        return hget__(hl[idx[level]],idx,level+1)
+    for i in idx[level:]:
+        hl = hl[i]
+    return hl
 
 def flatten(sl, fdepth = None):
     """ turns a hierarchical list of lists into a flat list 
@@ -70,65 +75,106 @@ def hmap(functor, sl, fdepth = None, params = None):
     return hl.map(functor, params)
 
 class HList:
-    def __init__(self):
-        self.data_ = []
-        self.indices_ = []
+    """ flat view of a hierarchical list
     
+        The leaves are collected once when the view is created and are then accessed
+        directly by their position. Assignments through the view are written back to the
+        hierarchical list.
+    """
     def __init__(self,init,fdepth = None):
         self.data_ = init
-        self.indices_ = []
         
         if fdepth == None:
             fdepth = depth(self.data_)
         if fdepth < 0:
             fdepth = depth(self.data_) + fdepth
         
-        index__(self.data_, self.indices_, [0 for q in range(depth(self.data_))], 0, fdepth)
-        self.indices_ = [idx[0:fdepth] for idx in self.indices_]
+        self.fdepth_ = fdepth
+        self.blocks_ = index__(self.data_, fdepth)
+        self.leaves_ = []
+        for idx, e in self.blocks_:
+            if isinstance(e, (list, HList)):
+                self.leaves_.extend(e)
+            else:
+                self.leaves_.extend([e[ie] for ie in range(len(e))])
+        self.indices_ = None
+        self.slots_ = None
+        self.positions_ = None
+    
+    def position(self, idx):
+        ## position of the index tuple in the flat list, None if it is not a leaf of this view
+        if self.positions_ is None:
+            indices = self.indices()
+            self.positions_ = dict(zip(indices, range(len(indices))))
+        return self.positions_.get(idx)
+    
+    def slot(self, pos):
+        ## innermost list and index of the element at position `pos`
+        if self.slots_ is None:
+            self.slots_ = []
+            for idx, e in self.blocks_:
+                self.slots_.extend(zip([e]*len(e), range(len(e))))
+        return self.slots_[pos]
     
     def __len__(self):
-        return len(self.indices_)
+        return len(self.leaves_)
+    
+    def __iter__(self):
+        return iter(self.leaves_)
     
     def __getitem__(self, key):
         if type(key) == tuple:
-            return hget__(self.data_,key,0)
+            pos = self.position(key)
+            if pos is None:
+                return hget__(self.data_,key,0)
+            return self.leaves_[pos]
         elif type(key) == list:
             return [self[k] for k in key]
         else:
-            return self[self.indices_[key]]
+            return self.leaves_[key]
     
     def __repr__(self):
-        return str([self[k] for k in self.indices_])
+        return str(self.leaves_)
     
     def __setitem__(self, key, value):
         if type(key) == tuple:
-            hset__(self.data_,key,0,value)
+            pos = self.position(key)
+            if pos is None:
+                hset__(self.data_,key,0,value)
+                return
         elif type(key) == list:
             raise TypeError("Assigning to slices is not supported")
         else:
-            self[self.indices_[key]] = value
+            pos = key
+        e, ie = self.slot(pos)
+        e[ie] = value
+        self.leaves_[pos] = value
     
     def indices(self):
+        if self.indices_ is None:
+            self.indices_ = [idx + (ie,) for idx, e in self.blocks_ for ie in range(len(e))]
+            if self.fdepth_ < 1:
+                self.indices_ = [idx[0:self.fdepth_] for idx in self.indices_]
         return self.indices_
     
     def data(self):
         return self.data_
     
     def apply(self, functor, params = None):
-        for idx in self.indices_:
+        for pos in range(len(self.leaves_)):
             if params == None:
-                self[idx] = functor(self[idx])
+                self[pos] = functor(self.leaves_[pos])
             else:
-                self[idx] = functor(self[idx], params)
+                self[pos] = functor(self.leaves_[pos], params)
     
     def map(self, functor, params = None):
         ret = copy_structure(self.data_)
         rethl = HList(ret)
-        for idx in self.indices_:
+        for idx, e in zip(self.indices(), self.leaves_):
             if params == None:
-                rethl[idx] = functor(self[idx])
+                rethl[idx] = functor(e)
             else:
-                rethl[idx] = functor(self[idx], params)
+                rethl[idx] = functor(e, params)
         return ret
 
 def hlist_to_dict(hl, key = 'Observable'):
@@ -13,7 +13,7 @@ import numpy as np
 
 from hlist import deep_flatten, flatten, depth
 from dict_intersect import dict_intersect
-from dataset import DataSet
+from dataset import DataSet, DataSetTable
 
 def make_list(infiles):
     if type(infiles) == list:
@@ -35,12 +35,104 @@ def recursiveGlob(dirname,pattern):
             ret += recursiveGlob(d, pattern)
     return ret
 
+def group_by(sets, keys):
+    """ groups a flat list of DataSet objects by the values of the properties in keys
+
+        the key tuples are coded once into integer group ids and the members of each group
+        are gathered by their positions. Returns a dict key tuple -> list of datasets, the keys
+        are inserted in the order of their first appearance and each list keeps the input order.
+    """
+    codes = {}
+    firsts = []
+    members = []
+    for i, iset in enumerate(sets):
+        k = tuple([iset.props[m] for m in keys])
+        code = codes.get(k)
+        if code is None:
+            code = codes[k] = len(firsts)
+            firsts.append(k)
+            members.append([])
+        members[code].append(i)
+    groups = {}
+    for k, pos in zip(firsts, members):
+        groups[k] = [sets[i] for i in pos]
+    return groups
+
+def concatenate_pieces(pieces, default):
+    ## same result as appending the pieces one by one to an initially empty array,
+    ## leading empty pieces are replaced instead of concatenated
+    for i, p in enumerate(pieces):
+        if len(p) > 0:
+            if i == len(pieces)-1:
+                return p
+            return np.concatenate(pieces[i:])
+    if len(pieces) > 0:
+        return pieces[-1]
+    return default
+
+def gather_xy(v, x, y, ignoreProperties):
+    ## x values repeated for all y values of each dataset, gathered as columns of the whole group
+    xvalues = []
+    lengths = []
+    ypieces = []
+    line = False
+    for data in v:
+        if data.props['observable'] == y:
+            n = len(data.y)
+            if n > 1:
+                line = True
+            xvalues.append(data.props[x])
+            lengths.append(n)
+            ypieces.append(data.y)
+        elif not ignoreProperties:
+            line = True
+            xvalues.append(data.props[x])
+            lengths.append(1)
+            ypieces.append(np.array([ data.props[y] ]))
+    if len(lengths) > 0 and min(lengths) == 0:
+        ## empty measurements change the dtype of the concatenation, use the exact piecewise result
+        xpieces = [np.array([xv] * n) for xv, n in zip(xvalues, lengths)]
+        return concatenate_pieces(xpieces, np.array([])), concatenate_pieces(ypieces, np.array([])), line
+    if len(lengths) == 0:
+        return np.array([]), np.array([]), line
+    if len(ypieces) == 1:
+        return np.repeat(np.array(xvalues), lengths), ypieces[0], line
+    return np.repeat(np.array(xvalues), lengths), np.concatenate(ypieces), line
+
+def collect_rows(table, y):
+    ## rows of a DataSetTable which contribute to collectXY(..., y)
+    observable = table.has('observable')
+    is_y = np.zeros(len(table), dtype=bool)
+    is_y[observable] = [v == y for v in table.values('observable', np.flatnonzero(observable))]
+    return np.flatnonzero(is_y | table.has(y))
+
+def gather_table_xy(table, rows, x, y, ignoreProperties):
+    ## same as gather_xy for the rows of a DataSetTable, y values are taken from the 2-D array without building DataSets
+    observable = table.has('observable', rows)
+    is_obs = np.zeros(len(rows), dtype=bool)
+    is_obs[observable] = [v == y for v in table.values('observable', rows[observable])]
+    if ignoreProperties:
+        rows = rows[is_obs]
+        is_obs = is_obs[is_obs]
+    if len(rows) == 0:
+        return np.array([]), np.array([]), False
+    
+    lengths = np.where(is_obs, table.ylen[rows], 1)
+    yvalues = table.y[rows]
+    if not is_obs.all():
+        if yvalues.shape[1] == 0:
+            yvalues = np.zeros((len(rows), 1) + yvalues.shape[2:], dtype=yvalues.dtype)
+        yvalues[~is_obs,0] = table.values(y, rows[~is_obs])
+    mask = np.arange(yvalues.shape[1]) < lengths[:,np.newaxis]
+    line = not is_obs.all() or np.any(lengths > 1)
+    return np.repeat(np.array(table.values(x, rows)), lengths), yvalues[mask], line
+
 def collectXY(sets,x,y,foreach=[],ignoreProperties=False):
       """ collects specified data from a list of DataSet objects
          
           this function is used to collect data from a list of DataSet objects, to prepare plots or evaluation. The parameters are:
     
-            sets:    the list of datasets
+            sets:    the list of datasets, or a DataSetTable
             x:       the name of the property or measurement to be used as x-value of the collected results 
             y:       the name of the property or measurement to be used as y-value of the collected results 
             foreach: an optional list of properties used for grouping the results. A separate DataSet object is created for each unique set of values of the specified parameers.
@@ -48,18 +140,17 @@ def collectXY(sets,x,y,foreach=[],ignoreProperties=False):
             
           The function returns a list of DataSet objects.
       """
-      foreach_sets = {}
-      for iset in flatten(sets):
-          if iset.props['observable'] != y and not y in iset.props:
-              continue
-          
-          fe_par_set = tuple((iset.props[m] for m in foreach))
-          if fe_par_set in foreach_sets:
-              foreach_sets[fe_par_set].append(iset)
-          else:
-              foreach_sets[fe_par_set] = [iset]
-      for k,v in foreach_sets.items():
-          common_props = dict_intersect([q.props for q in v])
+      if isinstance(sets, DataSetTable):
+          groups = sets.group_rows(foreach, collect_rows(sets, y))
+          collected = [(k, sets.common_props(rows), gather_table_xy(sets, rows, x, y, ignoreProperties)) for k, rows in groups.items()]
+      else:
+          flat = [iset for iset in flatten(sets) if iset.props['observable'] == y or y in iset.props]
+          foreach_sets = group_by(flat, foreach)
+          ## x/y of all datasets are gathered and concatenated once per group
+          collected = [(k, dict_intersect([q.props for q in v]), gather_xy(v, x, y, ignoreProperties)) for k, v in foreach_sets.items()]
+      
+      ret = []
+      for k, common_props, (xvalues, yvalues, line) in collected:
           res = DataSet()
           res.props = common_props
           for im in range(0,len(foreach)):
@@ -68,26 +159,9 @@ def collectXY(sets,x,y,foreach=[],ignoreProperties=False):
           res.props['xlabel'] = x
           res.props['ylabel'] = y
           
-          for data in v:
-              if data.props['observable'] == y:
-                  if len(data.y)>1:
-                      res.props['line'] = '.'
-                  xvalue = np.array([data.props[x] for i in range(len(data.y))])
-                  if len(res.x) > 0 and len(res.y) > 0:
-                      res.x = np.concatenate((res.x, xvalue ))
-                      res.y = np.concatenate((res.y, data.y))
-                  else:
-                      res.x = xvalue
-                      res.y = data.y
-              elif not ignoreProperties:
-                  res.props['line'] = '.'
-                  xvalue = np.array([ data.props[x] ])
-                  if len(res.x) > 0 and len(res.y) > 0:
-                      res.x = np.concatenate((res.x, xvalue ))
-                      res.y = np.concatenate((res.y, np.array([ data.props[y] ])))
-                  else:
-                      res.x = xvalue
-                      res.y = np.array([ data.props[y] ])
+          res.x, res.y = xvalues, yvalues
+          if line:
+              res.props['line'] = '.'
           
           order = np.argsort(res.x, kind = 'mergesort')
           res.x = res.x[order]
@@ -96,8 +170,8 @@ def collectXY(sets,x,y,foreach=[],ignoreProperties=False):
           for im in range(0,len(foreach)):
               res.props['label'] += '%s = %s ' % (foreach[im], k[im])
           
-          foreach_sets[k] = res
-      return foreach_sets.values()
+          ret.append(res)
+      return ret
 
 def ResultsToXY(sets,x,y,foreach=[]):
     """ combines observable x and y to build a list of DataSet with y vs x
@@ -166,7 +240,11 @@ def groupSets(groups, for_each = []):
         The parameters are:
           data: the data to be grouped
           for_each: the properties according to which the data is grouped
+        A DataSetTable is split into one DataSetTable per group.
     """
+    if isinstance(groups, DataSetTable):
+        return [groups.take(rows) for rows in groups.group_rows(for_each).values()]
+
     dd = depth(groups)
 
     if dd > 1:
@@ -177,18 +255,7 @@ def groupSets(groups, for_each = []):
         hgroups_idcs = [0]
 
     for idx in hgroups_idcs:
-        sets = hgroups[idx]
-
-        for_each_sets = {}
-        for iset in sets:
-            fe_par_set = tuple((iset.props[m] for m in for_each))
-
-            if fe_par_set in for_each_sets:
-                for_each_sets[fe_par_set].append(iset)
-            else:
-                for_each_sets[fe_par_set] = [iset]
-
-        hgroups[idx] = for_each_sets.values()
+        hgroups[idx] = group_by(hgroups[idx], for_each).values()
 
     if dd > 1:
         return groups
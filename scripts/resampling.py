@@ -0,0 +1,79 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+## Resampling errors of polynomial fits, vectorized over all columns of `y` and all resamples
+
+import numpy as np
+import multiprocessing
+
+NUM_RESAMPLES = 1000
+SEED = 42
+PROCESSES = None # number of processes for the bootstrap, None runs serially
+
+
+def fit_stack(lhs, rhs):
+    ## least-squares coefficients of the stacked systems lhs (B,n,p) and rhs (B,n,m), returns (B,p,m)
+    scale = np.sqrt((lhs*lhs).sum(axis=1))
+    scale[scale == 0] = 1.
+    pinv = np.linalg.pinv(lhs / scale[:,np.newaxis,:])
+    return np.einsum('bpn,bnm->bpm', pinv, rhs) / scale[:,:,np.newaxis]
+
+def prepare(x, y, sel):
+    x = np.asarray(x, dtype=float)
+    y = np.asarray(y, dtype=float).reshape(len(x), -1)
+    if sel is not None:
+        x = x[sel]
+        y = y[sel]
+    return x, y
+
+def jackknife_polyfit(x, y, deg, sel=None):
+    ## jackknife over the fitted points (e.g. bond dimensions),
+    ## returns the error of all coefficients with shape (deg+1, y.shape[1])
+    x, y = prepare(x, y, sel)
+    n = len(x)
+    if n <= deg+1:
+        return np.ones((deg+1, y.shape[1])) * np.nan
+    idx = np.array([ np.delete(np.arange(n), k) for k in range(n) ])
+    coeff = fit_stack(np.vander(x, deg+1)[idx], y[idx])
+    return np.sqrt( (n-1.)/n * np.sum((coeff - coeff.mean(axis=0))**2, axis=0) )
+
+def bootstrap_chunk(args):
+    lhs, y, idx = args
+    return fit_stack(lhs[idx], y[idx])
+
+def bootstrap_polyfit(x, y, deg, sel=None, num_resamples=None, seed=None, processes=None):
+    ## bootstrap over the fitted points with a fixed seed, resamples with less than deg+1
+    ## distinct points are discarded. Returns the error of all coefficients with shape (deg+1, y.shape[1])
+    num_resamples = num_resamples or NUM_RESAMPLES
+    seed          = SEED if seed is None else seed
+    processes     = processes or PROCESSES
+
+    x, y = prepare(x, y, sel)
+    n = len(x)
+    idx = np.random.RandomState(seed).randint(0, n, size=(num_resamples, n))
+    distinct = np.sum(np.diff(np.sort(idx, axis=1), axis=1) != 0, axis=1) + 1
+    idx = idx[distinct >= deg+1]
+    if len(idx) < 2:
+        return np.ones((deg+1, y.shape[1])) * np.nan
+
+    lhs = np.vander(x, deg+1)
+    if processes is not None and processes > 1:
+        pool = multiprocessing.Pool(processes)
+        chunks = np.array_split(idx, processes)
+        coeff = np.concatenate( pool.map(bootstrap_chunk, [(lhs, y, c) for c in chunks]) )
+        pool.close()
+        pool.join()
+    else:
+        coeff = bootstrap_chunk((lhs, y, idx))
+    return np.std(coeff, axis=0, ddof=1)
+
+def polyfit_error(x, y, deg, sel=None, mode='jackknife'):
+    if mode == 'jackknife':
+        return jackknife_polyfit(x, y, deg, sel)
+    elif mode == 'bootstrap':
+        return bootstrap_polyfit(x, y, deg, sel)
+    else:
+        raise Exception('Wrong error mode `%s`' % mode)
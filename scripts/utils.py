@@ -5,14 +5,105 @@
 #          http://www.boost.org/LICENSE_1_0.txt)
 
 import numpy as np
+import os, json, tempfile, hashlib
+from contextlib import contextmanager
+from collections import OrderedDict
 from copy import deepcopy
 from os import path
 
+import resampling
 
 PROJECT_ROOT = path.dirname(path.dirname(path.abspath(__file__)))
-ENABLE_EXTRAPOLATION_CACHE = False
+ENABLE_EXTRAPOLATION_CACHE = True
 VERBOSE_LOADING = False
 VERBOSE_EMPTY_DATASET = False
+CACHE_FORMAT = 'npz' # format for new cache files: 'npz' (binary) or 'txt'
+MEMORY_CACHE_BYTES = 256 * 1024**2 # size of the in-memory cache of load.result and load.extrapolation, 0 disables it
+
+## Evaluation settings, they are part of the cache key of the results which use them
+SYMM_MIDDLE_THRESHOLD = 5e-5 # max. asymmetry of the density in the middle for bond dimension extrapolations
+
+## Version of each evaluator, increase it when a change modifies the results
+EVALUATOR_VERSIONS = {
+    'pairfield'          : 1,
+    'densdens'           : 2, # 2: local densities at the (i, leg) site of each measurement
+    'density'            : 1,
+    'density_fit'        : 1,
+    'density_amplitudes' : 1,
+    'energy'             : 1,
+}
+
+## Evaluators which read the results of other evaluators, the versions of these are part of their cache key
+EVALUATOR_INPUTS = {
+    'density_fit'        : ['density'],
+    'density_amplitudes' : ['density_fit'],
+}
+
+def evaluation_settings():
+    return {
+        'SYMM_MIDDLE_THRESHOLD' : SYMM_MIDDLE_THRESHOLD,
+        'NUM_RESAMPLES'         : resampling.NUM_RESAMPLES,
+        'SEED'                  : resampling.SEED,
+    }
+DEFAULT_SETTINGS = evaluation_settings()
+
+def used_settings(what, **kwargs):
+    ## the evaluation settings which enter a result: the symmetry threshold of the density
+    ## bond dimension extrapolations and the resampling of bootstrap errors
+    base = what[len('extrap_'):] if what.startswith('extrap_') else what
+    bond_dim = kwargs.get('bond_dim')
+    extrapolated = what.startswith('extrap_') or isinstance(bond_dim, Extrapolation)
+    error_modes = [kwargs.get('error_mode'), bond_dim.error_mode if isinstance(bond_dim, Extrapolation) else None]
+    settings = evaluation_settings()
+    used = []
+    if extrapolated and base == 'density':
+        used.append('SYMM_MIDDLE_THRESHOLD')
+    if 'bootstrap' in error_modes:
+        used += ['NUM_RESAMPLES', 'SEED']
+    return dict((k, settings[k]) for k in used)
+
+def canonical(v):
+    ## json-serializable representation of a parameter, objects are described by all their attributes
+    if isinstance(v, (list, tuple)):
+        return [canonical(vi) for vi in v]
+    if isinstance(v, dict):
+        return dict((str(k), canonical(vi)) for k,vi in v.items())
+    if isinstance(v, np.generic):
+        return v.item()
+    if hasattr(v, '__dict__'):
+        return dict([('class', type(v).__name__)] + [(k, canonical(vi)) for k,vi in vars(v).items()])
+    return v
+
+def evaluator_versions(what, **kwargs):
+    ## version and used settings of the evaluator of `what` and of all evaluators it reads from
+    base = what[len('extrap_'):] if what.startswith('extrap_') else what
+    ret = {what: [EVALUATOR_VERSIONS.get(base, 1), used_settings(what, **kwargs)]}
+    for inp in EVALUATOR_INPUTS.get(base, []):
+        ret.update(evaluator_versions(inp, bond_dim=kwargs.get('bond_dim')))
+    return ret
+
+def cache_key(what, **kwargs):
+    ## hash of the result name, its parameters and the versions and used settings of its evaluators
+    key = [what, canonical(kwargs), canonical(evaluator_versions(what, **kwargs))]
+    return hashlib.sha1(json.dumps(key, sort_keys=True)).hexdigest()[:12]
+
+def uses_default_settings(what, **kwargs):
+    ## all evaluators of the result use the default settings
+    for version, settings in evaluator_versions(what, **kwargs).values():
+        if any(DEFAULT_SETTINGS[k] != v for k, v in settings.items()):
+            return False
+    return True
+
+def is_default_key(what, **kwargs):
+    ## all evaluators of the result are at their first version and use the default settings
+    return (uses_default_settings(what, **kwargs)
+            and all(version == 1 for version, settings in evaluator_versions(what, **kwargs).values()))
+
+def is_legacy_key(what, **kwargs):
+    ## single results with the default settings are fully described by the readable name,
+    ## they keep the names of the published data
+    return (not what.startswith('extrap_') and not isinstance(kwargs.get('bond_dim'), Extrapolation)
+            and is_default_key(what, **kwargs))
 
 def filename(what, **kwargs):
     fname = what
@@ -31,18 +122,34 @@ def filename(what, **kwargs):
     if 'amplitude_points' in kwargs:
         fitnum = 'All' if kwargs['amplitude_points'] is None else kwargs['amplitude_points']
         fname += '_ampl_fit{fitnum}'.format(fitnum=fitnum)
+    if kwargs.get('error_mode') is not None:
+        fname += '_err{error_mode}'
+    fname = path.join(path.join(PROJECT_ROOT,'data_extracted'),fname.format(**kwargs))
+    if is_legacy_key(what, **kwargs):
+        return fname + '.txt'
     
-    fname += '.txt'
-    return path.join(path.join(PROJECT_ROOT,'data_extracted'),fname.format(**kwargs))
+    ## the published data are still found under their readable name, also after a version change
+    ## of their evaluators: they have no recorded inputs and are never recomputed
+    hashed = fname + '_k' + cache_key(what, **kwargs) + '.txt'
+    readable = fname + '.txt'
+    if not cache_exists(hashed) and cache_exists(readable) and uses_default_settings(what, **kwargs):
+        if is_default_key(what, **kwargs) or load_inputs(readable) is None:
+            return readable
+    return hashed
 
 import re
 reFloat = r'([+-]?\d+(?:\.\d+)?(?:[eE][+-]\d+)?)'
 fit_float_pattern = re.compile(r'# ([^=]+)\s+= %s' % reFloat)
 fit_string_pattern = re.compile(r'# ([^=]+)\s+= "([^"]+)"')
 fit_array_pattern = re.compile(r'# ([^=]+)\s+= \[([^\]]+)\]')
-def load_props(fname):
+def parse_header(lines):
+    ## props are only read from the leading comment lines
     res = {}
-    for line in open(fname):
+    nheader = 0
+    for line in lines:
+        if not line.startswith('#'):
+            break
+        nheader += 1
         match = fit_float_pattern.search(line)
         if match:
             name = match.group(1).strip()
@@ -62,49 +169,464 @@ def load_props(fname):
             res[name] = val
             continue
     if len(res) == 0:
-        return None
-    return res
+        return None, nheader
+    return res, nheader
 
-def load(fname):
-    props = load_props(fname)
+def load_props(fname):
+    with open(fname) as ff:
+        props, _ = parse_header(ff)
+    return props
+
+@contextmanager
+def atomic_write(fname, mode='w'):
+    ## write to a temporary file in the same directory and rename it in place,
+    ## concurrent readers never see a partially written file
+    fd, tmpname = tempfile.mkstemp(dir=path.dirname(fname), prefix='.'+path.basename(fname), suffix='.tmp')
+    try:
+        with os.fdopen(fd, mode) as ff:
+            yield ff
+        umask = os.umask(0)
+        os.umask(umask)
+        os.chmod(tmpname, 0666 & ~umask)
+        os.rename(tmpname, fname)
+    except:
+        if path.exists(tmpname):
+            os.remove(tmpname)
+        raise
+
+## Binary cache, stored next to the text file with the same name and `.npz` extension
+def binary_filename(fname):
+    return path.splitext(fname)[0] + '.npz'
+
+def cache_exists(fname):
+    return path.exists(binary_filename(fname)) or path.exists(fname)
+
+BINARY_FORMAT_VERSION = 2
+
+def format_prop(k, v):
+    ## header line of a prop in the text format
+    if isinstance(v,str):
+        return '# {} = "{}"\n'.format(k,v)
+    elif isinstance(v, np.ndarray):
+        return '# {} = [{}]\n'.format( k, ', '.join([str(vi) for vi in v]) )
+    else:
+        return '# {} = {}\n'.format(k,v)
+
+def text_props(props):
+    ## props as they are read back from the text format: strings, floats and float arrays,
+    ## values which cannot be parsed are left out. Numbers keep their full precision.
+    ret = {}
+    for k, v in props.items():
+        try:
+            parsed, _ = parse_header([format_prop(k, v)])
+        except ValueError:
+            continue
+        if parsed is None:
+            continue
+        name, pv = parsed.items()[0]
+        if isinstance(pv, float) and isinstance(v, (int, long, float, np.number)):
+            pv = float(v)
+        elif isinstance(pv, np.ndarray) and isinstance(v, (np.ndarray, list)):
+            pv = np.asarray(v, dtype=float)
+        ret[name] = pv
+    return ret
+
+def load_binary(fname):
+    with np.load(fname) as ff:
+        if 'data' not in ff.files:
+            return None, None
+        version = int(ff['format']) if 'format' in ff.files else 1
+        d = ff['data']
+        props = {}
+        for k,v in json.loads(ff['props'].item()).items():
+            props[str(k)] = v.encode('utf-8') if isinstance(v, unicode) else v
+        for k in ff.files:
+            if k.startswith('prop:'):
+                props[k[len('prop:'):]] = ff[k]
+    if version < BINARY_FORMAT_VERSION:
+        ## files of the first format kept the json types of the props
+        props = text_props(props)
+    return d, props
+
+def save_binary(fname, d, props):
+    ## the props are stored with the same values as in the text format,
+    ## strings and floats as one json string, float arrays as separate arrays
+    arrays = {'format': np.array(BINARY_FORMAT_VERSION)}
+    if d is not None:
+        arrays['data'] = np.asarray(d)
+        scalars = {}
+        for k,v in text_props(props).items():
+            if isinstance(v, np.ndarray):
+                arrays['prop:'+k] = v
+            else:
+                scalars[k] = v
+        arrays['props'] = np.array(json.dumps(scalars))
+    with atomic_write(fname, 'wb') as ff:
+        np.savez(ff, **arrays)
+    return d, props
+
+def load_text(fname):
+    with open(fname) as ff:
+        lines = ff.readlines()
+    props, nheader = parse_header(lines)
     d = None
     if props is not None:
-        d = np.loadtxt(fname)
-    elif VERBOSE_EMPTY_DATASET:
+        d = np.loadtxt(lines[nheader:])
+    return d, props
+
+def load(fname):
+    bname = binary_filename(fname)
+    if path.exists(bname) and (not path.exists(fname) or path.getmtime(bname) >= path.getmtime(fname)):
+        d, props = load_binary(bname)
+    else:
+        d, props = load_text(fname)
+        if CACHE_FORMAT == 'npz':
+            ## migrate on first access, best effort such that read-only caches can still be read
+            try:
+                save_binary(bname, d, props)
+            except (OSError, IOError) as e:
+                print 'Warning: could not write the binary cache {}: {}'.format(bname, e)
+    if props is None and VERBOSE_EMPTY_DATASET:
         print 'Warning: file {} does not contain any dataset.'.format(fname)
     return d, props
 
 def save(fname, d, props):
+    if CACHE_FORMAT == 'npz':
+        return save_binary(binary_filename(fname), d, props)
+    return save_text(fname, d, props)
+
+def save_text(fname, d, props):
     import sys, datetime
-    with open(fname, 'w') as ff:
+    with atomic_write(fname, 'w') as ff:
         ff.write('# Generated on {}\n'.format(datetime.datetime.now()))
         ff.write('# Command line : {}\n'.format(sys.argv))
         if d is not None:
             for k,v in sorted(props.items()):
-                if isinstance(v,str):
-                    ff.write('# {} = "{}"\n'.format(k,v))
-                elif isinstance(v, np.ndarray):
-                    ff.write('# {} = [{}]\n'.format( k, ', '.join([str(vi) for vi in v]) ))
-                else:
-                    ff.write('# {} = {}\n'.format(k,v))
+                ff.write(format_prop(k, v))
         if d is not None:
             np.savetxt(ff, d)
     return d, props
 
+## Store of full L x L correlation matrices in `.npy` format, they are memory mapped when loaded
+## and their props are stored in a `.npz` file with the same name
+MATRIX_DIR = path.join(PROJECT_ROOT, 'data_extracted', 'matrices')
+
+def matrix_filename(what, L, filling, bond_dim):
+    version = EVALUATOR_VERSIONS.get(what, 1)
+    return path.join(MATRIX_DIR, '{}_v{}_L{}_n{}_M{}.npy'.format(what, version, L, filling, bond_dim))
+
+def save_matrix(fname, corr, props):
+    if not path.exists(path.dirname(fname)):
+        try:
+            os.makedirs(path.dirname(fname))
+        except OSError:
+            if not path.isdir(path.dirname(fname)):
+                raise
+    with atomic_write(fname, 'wb') as ff:
+        np.save(ff, np.ascontiguousarray(corr))
+    save_binary(binary_filename(fname), np.empty(0), props)
+
+def load_matrix(fname):
+    if not path.exists(fname) or not path.exists(binary_filename(fname)):
+        return None, None
+    _, props = load_binary(binary_filename(fname))
+    return np.load(fname, mmap_mode='r'), props
+
+## Dependency tracking: each cached result stores the cache files and raw data files
+## it was computed from in `<name>.deps`, results with a changed input are recomputed
+_recording = []
+
+def record_input(kind, key, stamp):
+    if len(_recording) > 0:
+        _recording[-1].append([kind, key, stamp])
+
+@contextmanager
+def recording_inputs():
+    _recording.append([])
+    try:
+        yield _recording[-1]
+    finally:
+        _recording.pop()
+
+def inputs_filename(fname):
+    return path.splitext(fname)[0] + '.deps'
+
+def save_inputs(fname, inputs):
+    with atomic_write(inputs_filename(fname)) as ff:
+        json.dump(inputs, ff)
+
+def load_inputs(fname):
+    ## None for results without recorded inputs, e.g. the published data
+    if not path.exists(inputs_filename(fname)):
+        return None
+    with open(inputs_filename(fname)) as ff:
+        return json.load(ff)
+
+def raw_stamp(fname):
+    if fname is None:
+        return None
+    return [path.relpath(fname, PROJECT_ROOT), path.getmtime(fname)]
+
+def stale_reason(fname):
+    ## why the cached result is outdated, None if all its inputs (recursively) are unchanged.
+    ## Raw inputs are looked up in the raw file index as it was checked by the last raw_index(refresh=True),
+    ## e.g. at the start of cache_builder.run, or on first use in this process.
+    def reason(fname):
+        inputs = load_inputs(fname)
+        if inputs is None:
+            return None
+        for kind, key, stamp in inputs:
+            if kind == 'file':
+                input_name = path.join(PROJECT_ROOT, key)
+                if cache_mtime(input_name) != stamp:
+                    return '{} changed'.format(key)
+                input_reason = reason(input_name)
+                if input_reason is not None:
+                    return input_reason
+            elif kind == 'raw':
+                if raw_stamp(lookup_resfile(*key)) != stamp:
+                    return 'raw data for L={}, n={}, M={} changed'.format(*key[:3])
+        return None
+    return reason(fname)
+
+def is_cached(fname):
+    if not cache_exists(fname):
+        return False
+    reason = stale_reason(fname)
+    if reason is not None:
+        print 'Outdated', path.relpath(fname, PROJECT_ROOT), ':', reason
+        return False
+    return True
+
+def load_cached(fname):
+    d, props = load(fname)
+    record_input('file', path.relpath(fname, PROJECT_ROOT), cache_mtime(fname))
+    return d, props
+
+def evaluate_and_save(fname, evaluator, **kwargs):
+    with recording_inputs() as inputs:
+        d, props = evaluator(**kwargs)
+    save(fname, d, props)
+    save_inputs(fname, inputs)
+    record_input('file', path.relpath(fname, PROJECT_ROOT), cache_mtime(fname))
+    return d, props
+
 def load_or_evaluate(what, evaluator, **kwargs):
     fname = filename(what, **kwargs)
-    if path.exists(fname):
-        d,props = load(fname)
+    if is_cached(fname):
+        d,props = load_cached(fname)
         if VERBOSE_LOADING:
             print 'Loaded', fname
-        return load(fname)
+        return d, props
     elif ENABLE_EXTRAPOLATION_CACHE or not 'bond_dim' in kwargs or not isinstance(kwargs['bond_dim'], Extrapolation):
-        return save(fname, *evaluator(**kwargs))
+        return evaluate_and_save(fname, evaluator, **kwargs)
     return evaluator(**kwargs)
 
-def find_resfile(L, filling, bond_dim, t_perp=1.0):
-    from glob import glob
+## In-memory LRU cache of loaded results, keyed by the cache file name which encodes all parameters.
+## Entries are dropped when the backing file changes, arrays are returned read-only.
+## Hits are recorded as inputs of the current evaluation like loads of the file.
+def cache_mtime(fname):
+    for f in (binary_filename(fname), fname):
+        if path.exists(f):
+            return path.getmtime(f)
+    return None
+
+def freeze(d, props):
+    nbytes = 0
+    if isinstance(d, np.ndarray):
+        d.setflags(write=False)
+        nbytes += d.nbytes
+    if props is not None:
+        for v in props.values():
+            if isinstance(v, np.ndarray):
+                v.setflags(write=False)
+                nbytes += v.nbytes
+        nbytes += 100 * len(props)
+    return nbytes
+
+class MemoryCache(object):
+    def __init__(self, max_bytes=None):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+    
+    def lookup(self, fname, evaluator):
+        ## return the cached (d, props) of `fname`, otherwise call `evaluator()` and store its result
+        mtime = cache_mtime(fname)
+        if fname in self.entries:
+            entry_mtime, nbytes, d, props = self.entries.pop(fname)
+            if entry_mtime == mtime:
+                self.hits += 1
+                if mtime is not None:
+                    record_input('file', path.relpath(fname, PROJECT_ROOT), mtime)
+                self.entries[fname] = (entry_mtime, nbytes, d, props)
+                return d, (dict(props) if props is not None else None)
+            self.nbytes -= nbytes
+        self.misses += 1
+        
+        max_bytes = MEMORY_CACHE_BYTES if self.max_bytes is None else self.max_bytes
+        res = evaluator()
+        if res is None or max_bytes <= 0:
+            return res
+        d, props = res
+        nbytes = freeze(d, props)
+        if nbytes > max_bytes:
+            return d, props
+        self.entries[fname] = (cache_mtime(fname), nbytes, d, props)
+        self.nbytes += nbytes
+        while self.nbytes > max_bytes:
+            _, (_, nb, _, _) = self.entries.popitem(last=False)
+            self.nbytes -= nb
+            self.evictions += 1
+        return d, (dict(props) if props is not None else None)
     
+    def clear(self):
+        self.entries.clear()
+        self.nbytes = 0
+    
+    def stats(self):
+        return {'entries': len(self.entries), 'bytes': self.nbytes, 'hits': self.hits,
+                'misses': self.misses, 'evictions': self.evictions}
+
+memory_cache = MemoryCache()
+
+## Index of the raw result files
+## data_raw/L{L}Nu{N}Nd{N}/t{tp}U{U}/*M{M}.out.res.h5 keyed by (L, N, tp, U, M), each file with its
+## mtime and the number of its last sweep read from the archive (-1 if it cannot be read).
+## It is stored on disk and checked against the mtimes of the directories on first use in a process
+## and with raw_index(refresh=True). The last sweep is only read for new or modified files.
+RAW_INDEX_FILE = path.join(PROJECT_ROOT, 'data_extracted', 'raw_files.txt')
+RAW_INDEX_VERSION = '# raw file index v2'
+re_raw_system = re.compile(r'^L(\d+)Nu(\d+)Nd(\d+)$')
+re_raw_model  = re.compile(r'^t(\d+)U(\d+)$')
+re_raw_file   = re.compile(r'M(\d+)\.out\.res\.h5$')
+
+def raw_dirs():
+    root = path.join(PROJECT_ROOT, 'data_raw')
+    if not path.isdir(root):
+        return []
+    dirs = [root]
+    for sysdir in sorted(os.listdir(root)):
+        if re_raw_system.match(sysdir) and path.isdir(path.join(root, sysdir)):
+            dirs.append(path.join(root, sysdir))
+            for modeldir in sorted(os.listdir(path.join(root, sysdir))):
+                if re_raw_model.match(modeldir) and path.isdir(path.join(root, sysdir, modeldir)):
+                    dirs.append(path.join(root, sysdir, modeldir))
+    return dirs
+
+def raw_dir_mtimes():
+    root = path.join(PROJECT_ROOT, 'data_raw')
+    return dict( (path.relpath(d, root), path.getmtime(d)) for d in raw_dirs() )
+
+def read_last_sweep(fname):
+    ## number of the last sweep of a raw file, -1 if the archive cannot be read
+    import load_raw_data
+    try:
+        return load_raw_data.read_last_sweep(fname)
+    except Exception as e:
+        print 'Warning:', 'could not read the last sweep of', fname
+        print e
+        return -1
+
+def scan_raw_files(previous={}):
+    ## entries of unchanged files are taken from `previous`
+    root = path.join(PROJECT_ROOT, 'data_raw')
+    known = {}
+    for flist in previous.values():
+        for last_sweep, mtime, fname in flist:
+            known[fname] = (last_sweep, mtime)
+    index = {}
+    for dname in raw_dirs():
+        rel = path.relpath(dname, root).split(os.sep)
+        if len(rel) != 2:
+            continue
+        L, Nu, Nd = [int(v) for v in re_raw_system.match(rel[0]).groups()]
+        tp, U = re_raw_model.match(rel[1]).groups()
+        for fname in os.listdir(dname):
+            match = re_raw_file.search(fname)
+            if not match or Nu != Nd:
+                continue
+            relname = path.join(rel[0], rel[1], fname)
+            mtime = path.getmtime(path.join(dname, fname))
+            if relname in known and known[relname][1] == mtime:
+                last_sweep = known[relname][0]
+            else:
+                last_sweep = read_last_sweep(path.join(dname, fname))
+            key = (L, Nu, tp, int(U), int(match.group(1)))
+            index.setdefault(key, []).append( (last_sweep, mtime, relname) )
+    return index
+
+def save_raw_index(index, mtimes):
+    with atomic_write(RAW_INDEX_FILE) as ff:
+        ff.write(RAW_INDEX_VERSION + '\n')
+        for d, mtime in sorted(mtimes.items()):
+            ff.write('# dir {} {!r}\n'.format(d, mtime))
+        for key, flist in sorted(index.items()):
+            for last_sweep, mtime, fname in flist:
+                ff.write('{} {!r} {} {} {} {} {} {}\n'.format(fname, mtime, last_sweep, *key))
+
+def load_raw_index_file():
+    ## index and directory mtimes, None for missing or older index files
+    if not path.exists(RAW_INDEX_FILE):
+        return None, None
+    with open(RAW_INDEX_FILE) as ff:
+        lines = ff.readlines()
+    if len(lines) == 0 or lines[0].strip() != RAW_INDEX_VERSION:
+        return None, None
+    index, mtimes = {}, {}
+    for line in lines[1:]:
+        if line.startswith('# dir '):
+            _, _, d, mtime = line.split()
+            mtimes[d] = float(mtime)
+        elif not line.startswith('#'):
+            fname, mtime, last_sweep, L, N, tp, U, M = line.split()
+            index.setdefault((int(L), int(N), tp, int(U), int(M)), []).append( (int(last_sweep), float(mtime), fname) )
+    return index, mtimes
+
+_raw_index = None
+_raw_index_mtimes = None
+def raw_index(refresh=False):
+    ## the directory mtimes are checked on the first call, and again with refresh=True.
+    ## Lookups never refresh the index, such that they do not list the raw directories every time.
+    global _raw_index, _raw_index_mtimes
+    if _raw_index is not None and not refresh:
+        return _raw_index
+    current = raw_dir_mtimes()
+    if _raw_index is not None and current == _raw_index_mtimes:
+        return _raw_index
+    index, mtimes = load_raw_index_file()
+    if index is None or current != mtimes:
+        index = scan_raw_files(index or {})
+        mtimes = current
+        try:
+            save_raw_index(index, mtimes)
+        except (OSError, IOError) as e:
+            print 'Warning: could not write the raw file index {}: {}'.format(RAW_INDEX_FILE, e)
+    _raw_index, _raw_index_mtimes = index, mtimes
+    return _raw_index
+
+def list_raw_parameters(**kwargs):
+    ## available (L, N, t_perp, U, M) points, optionally filtered, e.g. list_raw_parameters(L=32)
+    names = ['L', 'N', 't_perp', 'U', 'M']
+    if 't_perp' in kwargs:
+        kwargs['t_perp'] = str(kwargs['t_perp']).replace('.','')
+    ret = []
+    for key in sorted(raw_index().keys()):
+        point = dict(zip(names, key))
+        if all(point[k] == v for k,v in kwargs.items()):
+            ret.append(point)
+    return ret
+
+def find_resfile(L, filling, bond_dim, t_perp=1.0, U=8, last_sweep=None):
+    fname = lookup_resfile(L, filling, bond_dim, t_perp, U, last_sweep)
+    record_input('raw', [L, filling, bond_dim, t_perp, U, last_sweep], raw_stamp(fname))
+    return fname
+
+_warned_unreadable = set()
+def lookup_resfile(L, filling, bond_dim, t_perp=1.0, U=8, last_sweep=None):
     if L % 2 == 0:
         N = int(filling * L)
         if N / filling != L: return None ## L is not a nice multiples
@@ -114,29 +636,48 @@ def find_resfile(L, filling, bond_dim, t_perp=1.0):
     
     tp = str(t_perp).replace('.','')
     
-    flist = glob(PROJECT_ROOT + '/data_raw/L{L}Nu{N}Nd{N}/t{tp}U8/*M{M}.out.res.h5'.format(L=L, N=N, M=bond_dim, tp=tp))
+    flist = raw_index().get((L, N, tp, U, bond_dim), [])
+    if last_sweep is not None:
+        flist = [f for f in flist if f[0] == last_sweep]
     if len(flist) == 0: return None
-    return sorted(flist)[-1] # TODO: temporary fix to get sim with more nsweeps
-    # if len(flist) != 1: return None
-    # return flist[0]
+    ## by default take the simulation with the latest last sweep, then the most recent file.
+    ## Files whose last sweep could not be read are only taken if there is no other file.
+    best = max(flist)
+    for f in flist:
+        if f[0] < 0 and f[2] not in _warned_unreadable:
+            _warned_unreadable.add(f[2])
+            if f is best:
+                print 'Warning: using {}, its last sweep could not be read'.format(f[2])
+            else:
+                print 'Warning: skipping {}, its last sweep could not be read'.format(f[2])
+    return path.join(PROJECT_ROOT, 'data_raw', best[2])
 
 
 ## Extrapolation types
 class Extrapolation(object):
-    def __init__(self, extrap_type, deg, num_points):
+    def __init__(self, extrap_type, deg, num_points, error_mode=None):
         self.type = str(extrap_type)
         self.deg = int(deg)
         self.num_points = num_points
+        self.error_mode = error_mode ## None, 'jackknife' or 'bootstrap'
     
     def __str__(self):
         nump = self.num_points or 'All'
-        return 'extrap_{}_deg{}_num{}'.format(self.type, self.deg, nump)
+        ret = 'extrap_{}_deg{}_num{}'.format(self.type, self.deg, nump)
+        if self.error_mode is not None:
+            ret += '_err{}'.format(self.error_mode)
+        return ret
 
 
 ## Correlation types
 class Averaged(object):
+    def __init__(self, shifts=range(-5, 6)):
+        self.shifts = list(shifts) ## shifts of the pairs around the middle of the system
+    
     def __str__(self):
-        return 'avg'
+        if self.shifts == range(-5, 6):
+            return 'avg'
+        return 'avg{}'.format('_'.join(str(s) for s in self.shifts))
 
 class FixedStart(object):
     def __init__(self, start):
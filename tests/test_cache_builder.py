@@ -0,0 +1,88 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, time, shutil, tempfile, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import utils, cache_builder
+from cache_builder import Task
+
+DURATIONS = {'slow': 0.6, 'energy': 0.6}
+
+class LoggingLoad(object):
+    ## replaces the load module in the workers, every call is appended to `log` with its start and end time
+    def __init__(self, log):
+        self.log = log
+
+    def result(self, what, **kwargs):
+        t0 = time.time()
+        time.sleep(DURATIONS.get(what, 0.))
+        with open(self.log, 'a') as ff:
+            ff.write('{} {!r} {!r}\n'.format(utils.filename(what, **kwargs), t0, time.time()))
+        if what == 'broken':
+            raise Exception('evaluation failed')
+
+    def extrapolation(self, what, **kwargs):
+        return self.result('extrap_'+what, **kwargs)
+
+class CacheBuilderTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log = path.join(self.tmpdir, 'calls.log')
+        self.load = cache_builder.load
+        self.lookup_resfile = utils.lookup_resfile
+        self.raw_index = utils.raw_index
+        cache_builder.load = LoggingLoad(self.log)
+        utils.lookup_resfile = lambda *args: None
+        utils.raw_index = lambda refresh=False: {}
+
+    def tearDown(self):
+        cache_builder.load = self.load
+        utils.lookup_resfile = self.lookup_resfile
+        utils.raw_index = self.raw_index
+        shutil.rmtree(self.tmpdir)
+
+    def calls(self):
+        ret = {}
+        if path.exists(self.log):
+            for line in open(self.log):
+                fname, t0, t1 = line.split()
+                ret[path.splitext(path.basename(fname))[0]] = (float(t0), float(t1))
+        return ret
+
+    def test_dependencies_run_first(self):
+        first  = Task('result', 'slow', L=32)
+        second = Task('result', 'fast', L=32)
+        last   = Task('extrapolation', 'fast', deps=[first.name, second.name], L=32)
+        timings, failed, skipped = cache_builder.run([last, second, first], processes=2, summary=0)
+        calls = self.calls()
+        self.assertEqual(sorted(calls), sorted([first.name, second.name, last.name]))
+        self.assertTrue(calls[last.name][0] >= max(calls[first.name][1], calls[second.name][1]))
+        self.assertEqual((failed, skipped), ([], []))
+
+    def test_failure_skips_dependents(self):
+        broken    = Task('result', 'broken', L=32)
+        dependent = Task('result', 'fast', deps=[broken.name], L=32)
+        indirect  = Task('result', 'fast', deps=[dependent.name], L=48)
+        other     = Task('result', 'fast', L=64)
+        timings, failed, skipped = cache_builder.run([broken, dependent, indirect, other], processes=2, summary=0)
+        self.assertEqual(failed, [broken.name])
+        self.assertEqual(sorted(skipped), sorted([dependent.name, indirect.name]))
+        self.assertEqual(sorted(self.calls()), sorted([broken.name, other.name]))
+
+    def test_batches_of_the_same_raw_file(self):
+        ## the second batch of the raw file becomes ready while the first one is still running
+        first   = Task('result', 'energy', L=32, filling=0.875, bond_dim=800)
+        trigger = Task('result', 'fast', L=32)
+        second  = Task('result', 'density', deps=[trigger.name], L=32, filling=0.875, bond_dim=800)
+        last    = Task('extrapolation', 'fast', deps=[first.name, second.name], L=32)
+        self.assertEqual(first.raw_file, second.raw_file)
+        timings, failed, skipped = cache_builder.run([first, trigger, second, last], processes=2, summary=0)
+        self.assertEqual(sorted(timings), sorted([first.name, trigger.name, second.name, last.name]))
+
+if __name__ == '__main__':
+    unittest.main()
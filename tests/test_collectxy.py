@@ -0,0 +1,114 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import pyalps_dset
+from pyalps_dset import DataSet, DataSetTable, collectXY, flatten, dict_intersect
+
+def collect_by_loop(sets, x, y, foreach=[], ignoreProperties=False):
+    ## previous collectXY, the x/y arrays of each group are extended one dataset at a time
+    foreach_sets = {}
+    for iset in flatten(sets):
+        if iset.props['observable'] != y and not y in iset.props:
+            continue
+        foreach_sets.setdefault(tuple((iset.props[m] for m in foreach)), []).append(iset)
+    for k,v in foreach_sets.items():
+        res = DataSet()
+        res.props = dict_intersect([q.props for q in v])
+        for im in range(0,len(foreach)):
+            res.props[foreach[im]] = k[im]
+        res.props['xlabel'] = x
+        res.props['ylabel'] = y
+        for data in v:
+            if data.props['observable'] == y:
+                if len(data.y)>1:
+                    res.props['line'] = '.'
+                xvalue = np.array([data.props[x] for i in range(len(data.y))])
+                yvalue = data.y
+            elif not ignoreProperties:
+                res.props['line'] = '.'
+                xvalue = np.array([ data.props[x] ])
+                yvalue = np.array([ data.props[y] ])
+            else:
+                continue
+            if len(res.x) > 0 and len(res.y) > 0:
+                res.x = np.concatenate((res.x, xvalue))
+                res.y = np.concatenate((res.y, yvalue))
+            else:
+                res.x = xvalue
+                res.y = yvalue
+        order = np.argsort(res.x, kind = 'mergesort')
+        res.x = res.x[order]
+        res.y = res.y[order]
+        res.props['label'] = ''
+        for im in range(0,len(foreach)):
+            res.props['label'] += '%s = %s ' % (foreach[im], k[im])
+        foreach_sets[k] = res
+    return foreach_sets.values()
+
+def synthetic_sets(n, ngroups, ylen, seed=0, empty_every=0):
+    ## energies of n runs, every 7th dataset stores the energy as a prop of another observable
+    rng = np.random.RandomState(seed)
+    sets = []
+    for i in range(n):
+        g = rng.randint(ngroups)
+        d = DataSet()
+        d.props = {'observable': 'Energy' if i % 7 else 'Other', 'L': float(32+16*(g%4)), 'tp': g//4,
+                   'max_bond_dimension': rng.randint(1,5)*400, 'Energy': rng.rand(), 'filename': 'run%d.h5' % i}
+        d.y = rng.rand(ylen) if not (empty_every and i % empty_every == 0) else np.array([])
+        d.x = np.arange(len(d.y))
+        sets.append(d)
+    return [sets[i:i+10] for i in range(0, n, 10)]
+
+class CollectXYTest(unittest.TestCase):
+    def assertSameCollection(self, res, ref):
+        self.assertEqual([r.props['label'] for r in res], [r.props['label'] for r in ref])
+        for r, q in zip(res, ref):
+            ## same values in the same order, including ties of the x values
+            self.assertEqual(r.x.dtype, q.x.dtype)
+            self.assertEqual(r.y.dtype, q.y.dtype)
+            np.testing.assert_array_equal(r.x, q.x)
+            np.testing.assert_array_equal(r.y, q.y)
+            self.assertEqual(sorted(r.props), sorted(q.props))
+            for k in q.props:
+                np.testing.assert_array_equal(r.props[k], q.props[k])
+
+    def check(self, sets, foreach, ignoreProperties=False):
+        ref = collect_by_loop(sets, 'max_bond_dimension', 'Energy', foreach, ignoreProperties)
+        res = collectXY(sets, 'max_bond_dimension', 'Energy', foreach=foreach, ignoreProperties=ignoreProperties)
+        self.assertSameCollection(res, ref)
+        return res, ref
+
+    def test_matches_loop(self):
+        for ylen in [1, 3]:
+            sets = synthetic_sets(200, 12, ylen)
+            for foreach in [[], ['L'], ['L', 'tp']]:
+                self.check(sets, foreach)
+                self.check(sets, foreach, ignoreProperties=True)
+
+    def test_empty_measurements(self):
+        sets = synthetic_sets(100, 4, 2, seed=1, empty_every=5)
+        self.check(sets, ['tp'])
+        self.check(sets, ['tp'], ignoreProperties=True)
+
+    def test_table_matches_loop(self):
+        sets = synthetic_sets(200, 12, 1, seed=2)
+        table = DataSetTable.from_datasets(flatten(sets))
+        for foreach in [[], ['L', 'tp']]:
+            ref = dict([(r.props['label'], r) for r in collect_by_loop(sets, 'max_bond_dimension', 'Energy', foreach)])
+            for r in collectXY(table, 'max_bond_dimension', 'Energy', foreach=foreach):
+                q = ref[r.props['label']]
+                self.assertEqual(r.x.dtype, q.x.dtype)
+                self.assertEqual(r.y.dtype, q.y.dtype)
+                np.testing.assert_array_equal(r.x, q.x)
+                np.testing.assert_array_equal(r.y, q.y)
+
+if __name__ == '__main__':
+    unittest.main()
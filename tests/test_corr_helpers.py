@@ -0,0 +1,177 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+## Run with `python -m unittest discover tests` from the project root
+
+import sys, itertools, shutil, tempfile, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import pyalps_dset
+from corr_helpers import *
+import utils
+
+PAIRFIELD_CHANNELS = [('pair field 1', +1.), ('pair field 2', -1.), ('pair field 3', -1.), ('pair field 4', +1.)]
+
+def synthetic_ladder(L, W=2, seed=0, frac=0.3):
+    ## random sparse four-point measurements of all pair-field channels on a L x W ladder
+    rng = np.random.RandomState(seed)
+    sites = [(i,w) for i in range(L) for w in range(W)]
+    sets = []
+    for obs, sign in PAIRFIELD_CHANNELS:
+        xs = [np.array([sites[k] for k in a], dtype=float).reshape(8)
+              for a in itertools.product(range(len(sites)), repeat=4) if rng.rand() < frac]
+        d = pyalps_dset.DataSet()
+        d.x = np.array(xs)
+        d.y = [rng.rand(len(xs))]
+        d.props = {'observable': obs, 'L': float(L), 'W': float(W)}
+        sets.append(d)
+    return [sets]
+
+def dense_by_loop(sets, obs, idx):
+    ## reference four-point tensor, filled one measurement at a time
+    d = select_obs(sets, obs)
+    a = np.zeros([idx.size]*4)
+    for x, y in zip(d.x, d.y[0]):
+        a[tuple([idx[int(x[2*k]), int(x[2*k+1])] for k in range(4)])] = y
+    return a
+
+class SelectTest(unittest.TestCase):
+    def test_local_density(self):
+        ## one value per (i, leg) site, coordinates as returned by the measurements
+        L, W = 4, 2
+        idx = index_map(L, W)
+        d = pyalps_dset.DataSet()
+        d.x = np.array([(i,w) for i in range(L) for w in range(W)], dtype=float)
+        d.y = [np.arange(1., L*W+1)]
+        d.props = {'observable': 'Local density up'}
+        np.testing.assert_array_equal(select_to_1d([d], 'Local density up', idx), np.arange(1., L*W+1))
+
+class RungPairTest(unittest.TestCase):
+    def setUp(self):
+        self.L = 5
+        self.sets = synthetic_ladder(self.L, seed=3)
+        self.idx = index_map(self.L, 2)
+        lo, up = self.idx[:,0], self.idx[:,1]
+        self.rung_pairs = (lo[:,np.newaxis], up[:,np.newaxis], lo[np.newaxis,:], up[np.newaxis,:])
+    
+    def test_dense_tensor(self):
+        for obs, sign in PAIRFIELD_CHANNELS:
+            np.testing.assert_array_equal(select_to_nd(self.sets, obs, self.idx, 4), dense_by_loop(self.sets, obs, self.idx))
+    
+    def test_accumulate_rung_pairs(self):
+        ref = np.zeros((self.L, self.L))
+        for obs, sign in PAIRFIELD_CHANNELS:
+            ref += sign * select_to_nd(self.sets, obs, self.idx, 4)[self.rung_pairs]
+        corr = accumulate_rung_pairs(self.sets, PAIRFIELD_CHANNELS, self.idx)
+        np.testing.assert_allclose(corr, ref, rtol=1e-14, atol=1e-14)
+    
+    def test_rung_pairs_slice(self):
+        for obs, sign in PAIRFIELD_CHANNELS:
+            np.testing.assert_allclose(select_to_nd(self.sets, obs, self.idx, 4, rung_pairs=True),
+                                       dense_by_loop(self.sets, obs, self.idx)[self.rung_pairs], rtol=1e-14, atol=1e-14)
+
+def average_by_loop(corr, L, shifts):
+    ## reference average over the pairs around the middle, one distance and shift at a time
+    l = range(1, int(L-1-2*max(shifts)-2), 1)
+    res = np.zeros_like(l, dtype=float)
+    for ii,li in enumerate(l):
+        tmp = []
+        for ss in shifts:
+            i1 = int(L/2. - li/2. + ss)
+            i2 = int(i1 + li)
+            tmp.append( corr[i1,i2] )
+        res[ii] = np.mean(tmp)
+    return l, res
+
+class AverageTest(unittest.TestCase):
+    SHIFT_SETS = [range(-5, 6), [0], [-2, 0, 2], range(-8, 9)]
+    
+    def test_matches_loop(self):
+        rng = np.random.RandomState(0)
+        for L in [32, 33, 48]:
+            corr = rng.rand(L, L)
+            for shifts in self.SHIFT_SETS:
+                l, res = average_around_middle(corr, L, shifts)
+                l_ref, res_ref = average_by_loop(corr, L, shifts)
+                np.testing.assert_array_equal(l, l_ref)
+                np.testing.assert_allclose(res, res_ref, rtol=1e-14)
+    
+    def test_batch(self):
+        ## all windows of a stack of matrices, the distances a window does not reach are nan
+        rng = np.random.RandomState(1)
+        L = 48
+        corrs = rng.rand(3, L, L)
+        l, res = average_around_middle_batch(corrs, L, self.SHIFT_SETS)
+        self.assertEqual(res.shape, (len(self.SHIFT_SETS), 3, len(l)))
+        for k, shifts in enumerate(self.SHIFT_SETS):
+            for m in range(3):
+                lk, ref = average_by_loop(corrs[m], L, shifts)
+                np.testing.assert_array_equal(l[:len(lk)], lk)
+                np.testing.assert_allclose(res[k,m,:len(lk)], ref, rtol=1e-14)
+                self.assertTrue(np.all(np.isnan(res[k,m,len(lk):])))
+
+class StoredCorrelationTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.matrix_dir = utils.MATRIX_DIR
+        self.versions = dict(utils.EVALUATOR_VERSIONS)
+        utils.MATRIX_DIR = path.join(self.tmpdir, 'matrices')
+        self.resfile = path.join(self.tmpdir, 'raw.h5')
+        open(self.resfile, 'w').close()
+        self.calls = 0
+    
+    def tearDown(self):
+        utils.MATRIX_DIR = self.matrix_dir
+        utils.EVALUATOR_VERSIONS.clear()
+        utils.EVALUATOR_VERSIONS.update(self.versions)
+        shutil.rmtree(self.tmpdir)
+    
+    def compute(self, resfile):
+        self.calls += 1
+        d = pyalps_dset.DataSet()
+        d.props = {'observable': 'densdens', 'L': 8., 'bond_dims': np.array([400, 800])}
+        d.y = np.arange(64.).reshape(8,8)
+        d.idx = index_map(8, 2)
+        return d
+    
+    def stored(self):
+        return stored_correlation('densdens', self.compute, self.resfile, 8, 0.5, 800)
+    
+    def test_hit_and_miss_agree(self):
+        miss = self.stored()
+        hit = self.stored()
+        self.assertEqual(self.calls, 1)
+        self.assertEqual(sorted(miss.props), sorted(hit.props))
+        for k in miss.props:
+            self.assertEqual(type(miss.props[k]), type(hit.props[k]))
+            np.testing.assert_array_equal(miss.props[k], hit.props[k])
+        np.testing.assert_array_equal(miss.y, hit.y)
+        self.assertFalse(any(k.startswith('matrix_') for k in hit.props))
+        self.assertFalse(hasattr(miss, 'idx') or hasattr(hit, 'idx'))
+    
+    def test_window_averages(self):
+        find_resfile = utils.find_resfile
+        utils.find_resfile = lambda L, filling, bond_dim: self.resfile if bond_dim in [1200, 2000] else None
+        try:
+            bond_dims, l, res = stored_window_averages('densdens', self.compute, 8, 0.5, [[0], [-1, 0, 1]])
+        finally:
+            utils.find_resfile = find_resfile
+        np.testing.assert_array_equal(bond_dims, [1200, 2000])
+        self.assertEqual(res.shape, (2, 2, len(l)))
+        for k, shifts in enumerate([[0], [-1, 0, 1]]):
+            lk, ref = average_by_loop(self.compute(self.resfile).y, 8, shifts)
+            np.testing.assert_allclose(res[k,:,:len(lk)], [ref, ref])
+    
+    def test_version_bump_recomputes(self):
+        self.stored()
+        utils.EVALUATOR_VERSIONS['densdens'] += 1
+        self.stored()
+        self.assertEqual(self.calls, 2)
+
+if __name__ == '__main__':
+    unittest.main()
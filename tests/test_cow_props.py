@@ -0,0 +1,96 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, copy, pickle, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+from pyalps_dset import CowProps
+
+def writes():
+    ## all ways to modify a props mapping, each applied to a fresh copy
+    return [
+        lambda p: p.__setitem__('L', 64.),
+        lambda p: p.__setitem__('new', 1.),
+        lambda p: p.__delitem__('W'),
+        lambda p: p.update({'L': 64., 'new': 1.}),
+        lambda p: p.update(L=64.),
+        lambda p: p.pop('W'),
+        lambda p: p.setdefault('new', 1.),
+        lambda p: p.clear(),
+    ]
+
+class CowPropsTest(unittest.TestCase):
+    def setUp(self):
+        self.bond_dims = np.array([400., 800.])
+        self.values = {'L': 32., 'W': 2., 'observable': 'Energy', 'bond_dims': self.bond_dims}
+
+    def assertProps(self, props, ref):
+        self.assertEqual(sorted(props.keys()), sorted(ref.keys()))
+        for k in ref:
+            self.assertTrue(props[k] is ref[k])
+
+    def test_child_write_is_isolated(self):
+        for write in writes():
+            parent = CowProps(dict(self.values))
+            child = parent.copy()
+            grandchild = CowProps(child)
+            write(child)
+            self.assertProps(parent, self.values)
+            self.assertProps(grandchild, self.values)
+            ref = dict(self.values)
+            write(ref)
+            self.assertProps(child, ref)
+
+    def test_parent_write_is_isolated(self):
+        for write in writes():
+            parent = CowProps(dict(self.values))
+            children = [parent.copy() for i in range(3)]
+            write(parent)
+            for child in children:
+                self.assertProps(child, self.values)
+            ref = dict(self.values)
+            write(ref)
+            self.assertProps(parent, ref)
+
+    def test_plain_dict_parent(self):
+        ## e.g. the common props of a group, shared by the props of all results of the group
+        common = dict(self.values)
+        results = [CowProps(common) for i in range(3)]
+        for i, props in enumerate(results):
+            props['index'] = float(i)
+            props['L'] += i
+        self.assertProps(common, self.values)
+        for i, props in enumerate(results):
+            self.assertEqual(props['index'], i)
+            self.assertEqual(props['L'], 32. + i)
+            self.assertTrue(props['bond_dims'] is self.bond_dims)
+
+    def test_repeated_writes(self):
+        ## only the first write copies, later writes of the owner go to its own storage
+        parent = CowProps(dict(self.values))
+        child = parent.copy()
+        child['L'] = 64.
+        storage = child._data
+        child['W'] = 3.
+        del child['observable']
+        self.assertTrue(child._data is storage)
+        self.assertProps(parent, self.values)
+        self.assertEqual(dict(child), {'L': 64., 'W': 3., 'bond_dims': self.bond_dims})
+
+    def test_copies(self):
+        props = CowProps(dict(self.values))
+        for other in [pickle.loads(pickle.dumps(props)), copy.deepcopy(props), copy.copy(props)]:
+            self.assertEqual(sorted(other.keys()), sorted(self.values.keys()))
+            np.testing.assert_array_equal(other['bond_dims'], self.bond_dims)
+            other['L'] = 64.
+            self.assertEqual(props['L'], 32.)
+        self.assertTrue(props == self.values)
+        self.assertFalse(props != CowProps(self.values))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+from pyalps_dset import DataSet, DataSetTable, dict_intersect
+
+def make_sets():
+    ## props with loosely equal but different values: arrays differing in some elements, 1 / 1.0 / True
+    rows = [
+        {'L': 96., 'bond_dims': np.array([1200, 2000, 2800]), 'tp': 1,    'phase': 'a', 'W': 2, 'fit': np.nan},
+        {'L': 96., 'bond_dims': np.array([800, 1600, 4000]),  'tp': 1.0,  'phase': 'a', 'W': 2, 'fit': np.nan},
+        {'L': 96., 'bond_dims': np.array([1200, 1600, 2000]), 'tp': True, 'phase': 'b', 'W': 2},
+        {'L': 96., 'bond_dims': np.array([1200., 1600., 2000.]), 'tp': 1, 'phase': 'a', 'W': np.int64(2)},
+    ]
+    sets = []
+    for i, props in enumerate(rows):
+        d = DataSet()
+        d.props = props
+        d.x = np.arange(i+1.)
+        d.y = np.arange(i+1.) * 2
+        sets.append(d)
+    return sets
+
+class DataSetTableTest(unittest.TestCase):
+    def assertSameValue(self, a, b):
+        self.assertTrue(type(a) is type(b))
+        if isinstance(a, np.ndarray):
+            self.assertEqual(a.dtype, b.dtype)
+            np.testing.assert_array_equal(a, b)
+        elif a == a:
+            self.assertEqual(a, b)
+        else:
+            self.assertTrue(b != b)
+
+    def test_round_trip(self):
+        sets = make_sets()
+        table = DataSetTable.from_datasets(sets)
+        res = table.to_datasets()
+        self.assertEqual(len(res), len(sets))
+        for r, d in zip(res, sets):
+            self.assertEqual(sorted(r.props), sorted(d.props))
+            for k in d.props:
+                self.assertSameValue(r.props[k], d.props[k])
+            np.testing.assert_array_equal(r.x, d.x)
+            np.testing.assert_array_equal(r.y, d.y)
+
+    def test_shared_props(self):
+        table = DataSetTable.from_datasets(make_sets())
+        self.assertEqual(sorted(table.shared), ['L'])
+        self.assertEqual(sorted(table.columns), ['W', 'bond_dims', 'fit', 'phase', 'tp'])
+
+    def test_common_props(self):
+        ## common_props keeps the comparison of dict_intersect
+        sets = make_sets()
+        table = DataSetTable.from_datasets(sets)
+        for rows in [[0, 1], [0, 2], [0, 3], [0, 1, 2, 3]]:
+            ref = dict_intersect([sets[i].props for i in rows])
+            res = table.common_props(rows)
+            self.assertEqual(sorted(res), sorted(ref))
+            for k in ref:
+                self.assertSameValue(res[k], ref[k])
+
+if __name__ == '__main__':
+    unittest.main()
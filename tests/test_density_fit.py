@@ -0,0 +1,148 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, os, shutil, tempfile, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+from scipy import optimize
+import pyalps_dset
+import utils, density
+
+def density_sets(sizes=[48, 64, 96, 128, 192], seed=0):
+    ## Friedel oscillations of the fit model with random amplitudes and exponents
+    rng = np.random.RandomState(seed)
+    sets = []
+    for L in sizes:
+        nholes = L/8
+        ff = density.fit_func(L, nholes)
+        d = pyalps_dset.DataSet()
+        d.props = {'L': float(L), 'max_bond_dimension': 2000., 'filling': 0.875, 'nholes': nholes}
+        d.x = np.arange(0.5, L, 1.)
+        d.y = density.fit_model(d.x, [ff.nholes/ff.L, 0.02 + 0.02*rng.rand(), 0.3 + 0.4*rng.rand()], ff.constants())
+        d.y += 1e-6 * rng.randn(L)
+        sets.append(d)
+    return sets
+
+def leastsq_fit(d, delta_sel):
+    ## one MINPACK fit of the density in the window
+    ff = density.fit_func(d.props['L'], d.props['nholes'])
+    sel = density.fit_window(d, delta_sel)
+    x, y, consts = d.x[sel], d.y[sel], ff.constants()
+    return optimize.leastsq(lambda p: y - density.fit_model(x, p, consts), ff.values(),
+                            Dfun=lambda p: -density.fit_jacobian(x, p, consts), col_deriv=True)[0]
+
+class DensityFitTest(unittest.TestCase):
+    def test_batch_matches_leastsq(self):
+        sets = density_sets()
+        ffs = [density.fit_func(d.props['L'], d.props['nholes']) for d in sets]
+        sels = [density.fit_window(d, d.props['L']/4.) for d in sets]
+        p, nfev = density.fit_density_batch(ffs, [d.x[s] for d, s in zip(sets, sels)], [d.y[s] for d, s in zip(sets, sels)], [ff.values() for ff in ffs])
+        for d, pi in zip(sets, p):
+            np.testing.assert_allclose(pi, leastsq_fit(d, d.props['L']/4.), rtol=1e-6)
+        self.assertTrue(np.all(nfev > 1))
+
+    def test_jacobian(self):
+        ff = density.fit_func(64, 8)
+        x = np.arange(20.5, 44, 1.)
+        p = np.array([0.12, 0.03, 0.45])
+        eps = 1e-7
+        numeric = [(density.fit_model(x, p + eps*e, ff.constants()) - density.fit_model(x, p - eps*e, ff.constants())) / (2*eps) for e in np.eye(3)]
+        np.testing.assert_allclose(density.fit_jacobian(x, p, ff.constants()), numeric, rtol=1e-5, atol=1e-10)
+
+    def test_results_and_retries(self):
+        ## a flat density has no amplitude, its window is reduced until it is too small and
+        ## the default guess is reported, the other fits of the batch are not affected
+        sets = density_sets(sizes=[64, 96])
+        flat = pyalps_dset.DataSet()
+        flat.props = dict(sets[0].props)
+        flat.x = sets[0].x
+        flat.y = np.ones(len(flat.x)) * 0.875
+        sets.append(flat)
+        ffs = [density.fit_func(d.props['L'], d.props['nholes']) for d in sets]
+        res = density.dens_fit_batch(sets, ffs)
+        self.assertEqual([r.props['density_fit_retries'] for r in res], [0, 0, 2])
+        for d, r in zip(sets[:2], res[:2]):
+            p = leastsq_fit(d, d.props['L']/4.)
+            np.testing.assert_allclose(r.props['density_fitted_Krho'], 2*p[2], rtol=1e-6)
+            np.testing.assert_allclose(r.props['density_fitted_n0'], p[0], rtol=1e-9)
+            np.testing.assert_allclose(r.props['density_fit_sel'], [d.props['L']/4., 3*d.props['L']/4.])
+        self.assertEqual(res[2].props['density_fitted_A'], 1.)
+        np.testing.assert_allclose(res[2].props['density_fit_sel'], [32. - 16./1.5**3, 32. + 16./1.5**3])
+
+class WarmStartTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(path.join(self.root, 'data_extracted'))
+        self.saved = (utils.PROJECT_ROOT, utils.lookup_resfile, density.evaluate)
+        utils.PROJECT_ROOT = self.root
+        utils.lookup_resfile = lambda *args, **kwargs: None
+        self.sets = dict((d.props['L'], d) for d in density_sets(sizes=[48, 64, 96]))
+        density.evaluate = self.density
+        utils.memory_cache.clear()
+
+    def tearDown(self):
+        utils.PROJECT_ROOT, utils.lookup_resfile, density.evaluate = self.saved
+        utils.memory_cache.clear()
+        shutil.rmtree(self.root)
+
+    def density(self, L, filling, bond_dim):
+        if L not in self.sets:
+            return None, None
+        d = self.sets[L]
+        props = dict(d.props)
+        props['filling'] = filling
+        props['max_bond_dimension'] = float(bond_dim)
+        return np.column_stack([d.x, d.y]), props
+
+    def fit_name(self, L):
+        return utils.filename('density_fit', L=L, filling=0.875, bond_dim=2000)
+
+    def test_start_is_recorded(self):
+        res = density.fit_sizes([96, 48, 64], 0.875, 2000)
+        starts = [props['density_fit_start'] for _, props in res]
+        self.assertEqual(starts, ['default', path.relpath(self.fit_name(48), self.root), path.relpath(self.fit_name(64), self.root)])
+        inputs = [key for kind, key, stamp in utils.load_inputs(self.fit_name(96))]
+        self.assertTrue(path.relpath(self.fit_name(64), self.root) in inputs)
+        
+        ## the warm-started fits agree with a cold start
+        for L, (_, props) in zip([48, 64, 96], res):
+            cold = leastsq_fit(self.sets[L], L/4.)
+            np.testing.assert_allclose(props['density_fitted_Krho'], 2*cold[2], rtol=1e-6)
+        
+        ## a new fit of the start invalidates the warm-started fit
+        self.assertIsNone(utils.stale_reason(self.fit_name(96)))
+        mtime = utils.cache_mtime(self.fit_name(64)) + 10
+        os.utime(utils.binary_filename(self.fit_name(64)), (mtime, mtime))
+        self.assertEqual(utils.stale_reason(self.fit_name(96)), '{} changed'.format(path.relpath(self.fit_name(64), self.root)))
+        self.assertFalse(utils.is_cached(self.fit_name(96)))
+
+    def test_fits_are_inputs(self):
+        ## the fits are recorded as inputs of the calling evaluation, also when they come from memory
+        names = sorted(path.relpath(self.fit_name(L), self.root) for L in [48, 64, 96])
+        for repeat in range(2):
+            with utils.recording_inputs() as inputs:
+                density.fit_sizes([48, 64, 96], 0.875, 2000)
+            self.assertEqual(sorted(key for kind, key, stamp in inputs), names)
+        self.assertTrue(utils.memory_cache.stats()['hits'] >= 3)
+
+    def test_scan_matches_single_fits(self):
+        single = density.fit_sizes([48, 64, 96], 0.875, 2000)
+        for fname in os.listdir(path.join(self.root, 'data_extracted')):
+            if fname.startswith('density_fit'):
+                os.remove(path.join(self.root, 'data_extracted', fname))
+        utils.memory_cache.clear()
+        scan = density.fit_scan([0.875], [2000], [48, 64, 96])[0]
+        for (_, p1), (_, p2) in zip(single, scan):
+            self.assertEqual(p1['density_fit_start'], p2['density_fit_start'])
+            self.assertEqual(p1['density_fitted_Krho'], p2['density_fitted_Krho'])
+        inputs = [key for kind, key, stamp in utils.load_inputs(self.fit_name(96))]
+        self.assertEqual(sorted(inputs), sorted([path.relpath(self.fit_name(64), self.root),
+                                                 path.relpath(utils.filename('density', L=96, filling=0.875, bond_dim=2000), self.root)]))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,84 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, os, shutil, tempfile, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import utils
+
+def touch(fname, offset=10):
+    mtime = path.getmtime(fname) + offset
+    os.utime(fname, (mtime, mtime))
+
+class DependencyTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        os.makedirs(path.join(self.root, 'data_extracted'))
+        self.rawfile = path.join(self.root, 'data_raw', 'ladder.L32.M800.out.res.h5')
+        os.makedirs(path.dirname(self.rawfile))
+        open(self.rawfile, 'w').close()
+        self.saved = (utils.PROJECT_ROOT, utils.lookup_resfile)
+        utils.PROJECT_ROOT = self.root
+        utils.lookup_resfile = lambda *args: self.rawfile
+        self.calls = []
+
+    def tearDown(self):
+        utils.PROJECT_ROOT, utils.lookup_resfile = self.saved
+        shutil.rmtree(self.root)
+
+    def measurement(self, L):
+        ## single result read from the raw file
+        self.calls.append('measurement')
+        utils.find_resfile(L, 0.875, 800)
+        return np.ones((4,2)), {'L': float(L)}
+
+    def analysis(self, L):
+        ## result computed from the cached measurement
+        self.calls.append('analysis')
+        d, props = utils.load_or_evaluate('measurement', self.measurement, L=L)
+        return 2*d, props
+
+    def evaluate(self):
+        return utils.load_or_evaluate('analysis', self.analysis, L=32)
+
+    def test_unchanged_inputs(self):
+        self.evaluate()
+        self.evaluate()
+        self.assertEqual(self.calls, ['analysis', 'measurement'])
+        inputs = utils.load_inputs(utils.filename('analysis', L=32))
+        self.assertEqual([(kind, key) for kind, key, stamp in inputs], [('file', 'data_extracted/measurement_L32.txt')])
+
+    def test_touched_raw_file(self):
+        self.evaluate()
+        touch(self.rawfile)
+        self.assertEqual(utils.stale_reason(utils.filename('measurement', L=32)), 'raw data for L=32, n=0.875, M=800 changed')
+        self.assertEqual(utils.stale_reason(utils.filename('analysis', L=32)), 'raw data for L=32, n=0.875, M=800 changed')
+        self.evaluate()
+        self.assertEqual(self.calls, ['analysis', 'measurement', 'analysis', 'measurement'])
+        self.assertIsNone(utils.stale_reason(utils.filename('analysis', L=32)))
+
+    def test_touched_cache_file(self):
+        ## only the results computed from the touched file are redone
+        self.evaluate()
+        touch(utils.binary_filename(utils.filename('measurement', L=32)))
+        self.assertIsNone(utils.stale_reason(utils.filename('measurement', L=32)))
+        self.assertEqual(utils.stale_reason(utils.filename('analysis', L=32)), 'data_extracted/measurement_L32.txt changed')
+        self.evaluate()
+        self.assertEqual(self.calls, ['analysis', 'measurement', 'analysis'])
+
+    def test_results_without_inputs(self):
+        ## e.g. the published data, they are never outdated
+        fname = utils.filename('analysis', L=32)
+        utils.save(fname, np.ones((4,2)), {'L': 32.})
+        touch(self.rawfile)
+        self.assertTrue(utils.is_cached(fname))
+        self.evaluate()
+        self.assertEqual(self.calls, [])
+
+if __name__ == '__main__':
+    unittest.main()
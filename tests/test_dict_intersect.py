@@ -0,0 +1,115 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+from pyalps_dset import dict_intersect, CowProps
+
+def intersect_by_loop(dicts):
+    ## previous dict_intersect, all values of the common keys are compared one by one
+    keys = set(dicts[0].keys())
+    for q in dicts:
+        keys &= set(q.keys())
+    ret = {}
+    for key in keys:
+        take = True
+        val0 = dicts[0][key]
+        for q in dicts:
+            try:
+                if val0 != q[key]:
+                    take = False
+            except:
+                if np.all(val0 != q[key]):
+                    take = False
+        if take:
+            ret[key] = val0
+    return ret
+
+def random_props(rng, n):
+    values = [1, 1.0, True, 2.5, 'a', None, np.nan, np.float64(2.5), np.arange(3.), np.array([0., 1., 5.]), np.arange(3)]
+    dicts = []
+    for i in range(n):
+        d = {}
+        for k in range(8):
+            if rng.rand() < 0.9:
+                d['p%d' % k] = values[rng.randint(len(values))] if k % 2 else values[k]
+        dicts.append(d)
+    return dicts
+
+class DictIntersectTest(unittest.TestCase):
+    def assertSameIntersection(self, dicts):
+        res = dict_intersect(dicts)
+        ref = intersect_by_loop(dicts)
+        self.assertEqual(sorted(res), sorted(ref))
+        for k in ref:
+            self.assertTrue(res[k] is ref[k])
+
+    def test_matches_loop(self):
+        rng = np.random.RandomState(0)
+        for n in [1, 2, 5, 20]:
+            for _ in range(50):
+                self.assertSameIntersection(random_props(rng, n))
+
+    def test_array_changed_in_place(self):
+        a = {'L': 32., 'bond_dims': np.array([400., 800., 1200.])}
+        b = {'L': 32., 'bond_dims': np.array([400., 800., 1200.])}
+        self.assertTrue('bond_dims' in dict_intersect([a, b]))
+        b['bond_dims'][:] = [500., 900., 1300.]
+        self.assertFalse('bond_dims' in dict_intersect([a, b]))
+        self.assertSameIntersection([a, b])
+        b['bond_dims'][:] = a['bond_dims']
+        self.assertTrue('bond_dims' in dict_intersect([a, b]))
+
+class CowPropsFingerprintTest(unittest.TestCase):
+    def assertSameIntersection(self, dicts):
+        res = dict_intersect(dicts)
+        ref = intersect_by_loop([dict(q) for q in dicts])
+        self.assertEqual(sorted(res), sorted(ref))
+        for k in ref:
+            self.assertTrue(res[k] is ref[k])
+    
+    def test_matches_loop_when_repeated(self):
+        rng = np.random.RandomState(1)
+        for n in [2, 5, 20]:
+            for _ in range(20):
+                dicts = [CowProps(q) if rng.rand() < 0.5 else q for q in random_props(rng, n)]
+                for repeat in range(2):
+                    self.assertSameIntersection(dicts)
+    
+    def test_fingerprint_kept_until_write(self):
+        bond_dims = np.array([400., 800.])
+        bond_dims.flags.writeable = False
+        a = CowProps({'L': 32., 'W': 2, 'bond_dims': bond_dims})
+        b = a.copy()
+        self.assertEqual(sorted(dict_intersect([a, b])), ['L', 'W', 'bond_dims'])
+        fp = a.cached_fingerprint()
+        self.assertTrue(b.cached_fingerprint() is fp)
+        dict_intersect([a, b])
+        self.assertTrue(a.cached_fingerprint() is fp)
+        
+        b['L'] = 64.
+        self.assertFalse(b.cached_fingerprint() is fp)
+        self.assertTrue(a.cached_fingerprint() is fp)
+        self.assertEqual(sorted(dict_intersect([a, b])), ['W', 'bond_dims'])
+        del a['W']
+        self.assertEqual(sorted(dict_intersect([a, b])), ['bond_dims'])
+        a.update(L=64.)
+        self.assertEqual(sorted(dict_intersect([a, b])), ['L', 'bond_dims'])
+    
+    def test_writeable_array_changed_in_place(self):
+        a = CowProps({'L': 32., 'bond_dims': np.array([400., 800., 1200.])})
+        b = CowProps({'L': 32., 'bond_dims': np.array([400., 800., 1200.])})
+        self.assertTrue('bond_dims' in dict_intersect([a, b]))
+        b['bond_dims'][:] = [500., 900., 1300.]
+        self.assertFalse('bond_dims' in dict_intersect([a, b]))
+        b['bond_dims'][:] = a['bond_dims']
+        self.assertTrue('bond_dims' in dict_intersect([a, b]))
+
+if __name__ == '__main__':
+    unittest.main()
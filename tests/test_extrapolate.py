@@ -0,0 +1,72 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import pyalps_dset
+import extrapolate
+
+def energy_sets(seed=0):
+    ## energies of several systems, with a different number of bond dimensions per system
+    rng = np.random.RandomState(seed)
+    bond_dims = {32: [800, 1200, 1600, 2000, 2800, 3600], 48: [1200, 1600, 2000, 2800], 64: [1600, 2000, 2800, 3200, 3600]}
+    sets = []
+    for L, dims in bond_dims.items():
+        for M in dims:
+            d = pyalps_dset.DataSet()
+            variance = 1e-2 * (800./M)**2 * (1. + 0.1*rng.rand())
+            d.props = {'observable': 'Energy', 'L': float(L), 'filling': 0.875, 'max_bond_dimension': float(M),
+                       'EnergyVariance': variance, 'TruncatedWeight': 1e-3 * variance * (1. + 0.1*rng.rand())}
+            d.x = np.array([0.])
+            d.y = np.array([-0.6*L + 40.*variance + 1e3*variance**2 + 1e-4*rng.rand()])
+            sets.append(d)
+    return sets
+
+def reference_fit(x, y, deg, num_points):
+    ## the per-group fit of the energy paths before batched_polyfit
+    sel = np.ones(len(x), dtype=bool)
+    if num_points is not None and num_points < len(x): sel[num_points:] = False
+    coeff = np.polyfit(x[sel], y[sel], deg=deg)
+    return coeff, extrapolate.rsquared(x[sel], y[sel], coeff)
+
+class BatchedPolyfitTest(unittest.TestCase):
+    def test_extrapolations_match_per_group_fits(self):
+        for extrap_type, xname in [('variance', 'EnergyVariance'), ('truncation', 'TruncatedWeight'), ('bonddim', 'max_bond_dimension')]:
+            for deg, num_points in [(1, None), (2, None), (1, 3), (2, 4)]:
+                extrap, groups, fits = extrapolate.extrapolate(energy_sets(), foreach=['L'], extrap_type=extrap_type, deg=deg, num_points=num_points)
+                self.assertEqual(len(groups), 3)
+                for e, d, f in zip(extrap, groups, fits):
+                    sets = [s for s in energy_sets() if s.props['L'] == d.props['L']]
+                    x = np.array([s.props[xname] for s in sets])
+                    y = np.array([s.y[0] for s in sets])
+                    if extrap_type == 'bonddim': x = 1. / x
+                    order = np.argsort(x)
+                    coeff, r2 = reference_fit(x[order], y[order], deg, num_points)
+                    np.testing.assert_allclose(d.x, x[order])
+                    np.testing.assert_allclose(d.props['fitted_coeff'], coeff, rtol=1e-6)
+                    np.testing.assert_allclose(d.props['fitted_r2'], r2, rtol=1e-9)
+                    np.testing.assert_allclose(e.y, [coeff[-1]], rtol=1e-12)
+                    np.testing.assert_allclose(f.y, np.polyval(coeff, f.x), rtol=1e-9)
+                    self.assertEqual(e.props['max_bond_dimension'], 'inf')
+
+    def test_leave_one_out_error(self):
+        groups, _, _ = extrapolate.collect_groups(energy_sets(), ['L'], 'variance')
+        for deg, num_points in [(1, None), (2, 5)]:
+            _, _, cv_errors = extrapolate.batched_polyfit(groups, deg, num_points)
+            for d, cv in zip(groups, cv_errors):
+                n = len(d.x) if num_points is None else min(num_points, len(d.x))
+                residuals = []
+                for i in range(n):
+                    keep = np.arange(n) != i
+                    coeff = np.polyfit(d.x[:n][keep], d.y[:n][keep], deg)
+                    residuals.append(d.y[i] - np.polyval(coeff, d.x[i]))
+                np.testing.assert_allclose(cv, np.sqrt(np.mean(np.square(residuals))), rtol=1e-6)
+
+if __name__ == '__main__':
+    unittest.main()
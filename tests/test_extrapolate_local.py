@@ -0,0 +1,68 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import pyalps_dset
+import extrapolate_local
+
+BOND_DIMS = [1200, 1600, 2000, 2800, 3200, 3600]
+
+def correlation_sets(L=32, seed=0):
+    ## correlations for several bond dimensions, converging as 1/M
+    rng = np.random.RandomState(seed)
+    x = np.arange(1., L)
+    limit = np.exp(-x/8.)
+    sets = []
+    for M in BOND_DIMS:
+        d = pyalps_dset.DataSet()
+        d.props = {'observable': 'Density Correlation', 'L': float(L), 'max_bond_dimension': float(M), 'filling': 0.875}
+        d.x = x
+        d.y = limit + 50./M * rng.rand(len(x)) + 1e3/M**2
+        sets.append(d)
+    return sets
+
+class BatchedExtrapolationTest(unittest.TestCase):
+    def test_batch_matches_per_point(self):
+        sets = correlation_sets()
+        x = 1. / np.array(BOND_DIMS[::-1], dtype=float)
+        y = np.array([d.y for d in sets[::-1]])
+        for deg in [1, 2]:
+            for num_points in [None, 4]:
+                vals, errs, r2s, coeffs = extrapolate_local.extrapolate_batch(x, y, deg, num_points)
+                for i in range(y.shape[1]):
+                    val, err, r2, coeff, _, _ = extrapolate_local.extrapolate_with_error(x, y[:,i], deg, num_points)
+                    np.testing.assert_allclose(vals[i], val, rtol=1e-9)
+                    np.testing.assert_allclose(errs[i], err, rtol=1e-6)
+                    np.testing.assert_allclose(r2s[i], r2, rtol=1e-9)
+                    np.testing.assert_allclose(coeffs[i], coeff, rtol=1e-6, atol=1e-12)
+
+    def test_extrapolated_correlation(self):
+        sets = correlation_sets()
+        at_x = 5.
+        extrap, obs_vs_extrap, fits = extrapolate_local.extrapolate(sets, 'Density Correlation', foreach=['L'], extrap_type='bonddim', deg=2, full_output_at=[at_x])
+        self.assertEqual((len(extrap), len(obs_vs_extrap), len(fits)), (1, 1, 1))
+        x = 1. / np.array(BOND_DIMS[::-1], dtype=float)
+        y = np.array([d.y for d in sets[::-1]])
+        ref = [extrapolate_local.extrapolate_with_error(x, y[:,i], 2, None)[0] for i in range(y.shape[1])]
+        np.testing.assert_allclose(extrap[0].y, ref, rtol=1e-9)
+        self.assertEqual(extrap[0].props['max_bond_dimension'], 'inf')
+
+        ## fit curve and observables only at the requested point
+        i = list(sets[0].x).index(at_x)
+        np.testing.assert_array_equal(obs_vs_extrap[0].x, x)
+        np.testing.assert_array_equal(obs_vs_extrap[0].y, y[:,i])
+        np.testing.assert_array_equal(obs_vs_extrap[0].props['bond_dims'], BOND_DIMS[::-1])
+        _, _, r2, coeff, xfit, yfit = extrapolate_local.extrapolate_with_error(x, y[:,i], 2, None)
+        np.testing.assert_allclose(fits[0].props['fitted_coeff'], coeff, rtol=1e-6)
+        np.testing.assert_allclose(fits[0].y, yfit, rtol=1e-9)
+        self.assertEqual(fits[0].props['fitted_x'], at_x)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, copy, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+from pyalps_dset.hlist import HList, flatten, hmap, happly, depth
+
+def depth_by_recursion(hl):
+    if len(hl) == 0:
+        return 0
+    elif type(hl[0]) == list:
+        return 1+depth_by_recursion(hl[0])
+    else:
+        return 1
+
+def indices_by_recursion(hl, fdepth):
+    ## index tuples of the previous HList, built by walking the nested lists recursively
+    def index(hl, indices, idx, level, max_level):
+        for ie in range(len(hl)):
+            idx[level] = ie
+            if level < max_level-1:
+                index(hl[ie], indices, idx, level+1, max_level)
+            else:
+                indices.append(tuple(idx))
+    if fdepth is None:
+        fdepth = depth_by_recursion(hl)
+    if fdepth < 0:
+        fdepth = depth_by_recursion(hl) + fdepth
+    indices = []
+    index(hl, indices, [0]*depth_by_recursion(hl), 0, fdepth)
+    return [idx[0:fdepth] for idx in indices]
+
+def get_by_recursion(hl, idx):
+    for i in idx:
+        hl = hl[i]
+    return hl
+
+def nested(rng, shape):
+    ## ragged hierarchy of lists of integers with at most `shape` elements per level, some inner lists are empty
+    if len(shape) == 1:
+        return [rng.randint(1000) for i in range(rng.randint(shape[0]+1))]
+    ret = [nested(rng, shape[1:]) for i in range(rng.randint(1, shape[0]+1))]
+    if len(ret[0]) == 0:
+        ret[0] = nested(rng, shape[1:]) + [-1]
+    return ret
+
+class HListTest(unittest.TestCase):
+    DEPTHS = [None, 1, 2, 3, -1, -2]
+
+    def structures(self):
+        rng = np.random.RandomState(0)
+        return [nested(rng, shape) for shape in [(5,), (4, 6), (3, 4, 5), (3, 4, 5), (2, 3, 2, 4)]]
+
+    def test_indices_and_leaves(self):
+        for hl in self.structures():
+            self.assertEqual(depth(hl), depth_by_recursion(hl))
+            for fdepth in self.DEPTHS:
+                if fdepth is not None and abs(fdepth) > depth_by_recursion(hl) or fdepth == -depth_by_recursion(hl):
+                    continue
+                view = HList(hl, fdepth)
+                ref = indices_by_recursion(hl, fdepth)
+                self.assertEqual(view.indices(), ref)
+                self.assertEqual(len(view), len(ref))
+                leaves = [get_by_recursion(hl, idx) for idx in ref]
+                for i, idx in enumerate(ref):
+                    self.assertTrue(view[i] is leaves[i])
+                    self.assertTrue(view[idx] is leaves[i])
+                self.assertEqual([id(e) for e in view], [id(e) for e in leaves])
+                self.assertEqual(view[range(len(ref))], leaves)
+
+    def test_assignment_writes_back(self):
+        for hl in self.structures():
+            ref = copy.deepcopy(hl)
+            view = flatten(hl)
+            indices = indices_by_recursion(ref, None)
+            for i in range(0, len(view), 3):
+                view[i] = -10-i
+                lst = get_by_recursion(ref, indices[i][:-1])
+                lst[indices[i][-1]] = -10-i
+            for i in range(1, len(view), 3):
+                view[indices[i]] = -20000-i
+                lst = get_by_recursion(ref, indices[i][:-1])
+                lst[indices[i][-1]] = -20000-i
+            self.assertEqual(hl, ref)
+            self.assertEqual(list(view), [get_by_recursion(ref, idx) for idx in indices])
+            self.assertEqual(list(flatten(hl)), list(view))
+
+    def test_apply_and_map(self):
+        for hl in self.structures():
+            mapped = hmap(lambda e, s: e + s, hl, params=1000)
+            ref = copy.deepcopy(hl)
+            for idx in indices_by_recursion(ref, None):
+                lst = get_by_recursion(ref, idx[:-1])
+                lst[idx[-1]] += 1000
+            self.assertEqual(mapped, ref)
+            happly(lambda e: e + 1000, hl)
+            self.assertEqual(hl, ref)
+            if depth_by_recursion(hl) > 1:
+                sizes = hmap(len, hl, -1)
+                self.assertEqual(list(flatten(sizes)), [len(get_by_recursion(hl, idx)) for idx in indices_by_recursion(hl, -1)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,76 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, os, time, shutil, tempfile, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import load_raw_data
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+def write_raw_file(fname, truncated_weights, variance, sweeps=3):
+    ## archive with the truncated weights of the last sweep and the energy variance
+    with h5py.File(fname, 'w') as ff:
+        for s in range(sweeps):
+            ff.create_group('/simulation/iteration/%d' % s)
+        ff['/simulation/iteration/%d/results/TruncatedWeight/mean/value' % (sweeps-1)] = np.asarray(truncated_weights)
+        ff['/spectrum/results/EnergyVariance/mean/value'] = np.array([variance])
+
+@unittest.skipIf(h5py is None, 'h5py is required to write raw files')
+class MetadataIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.saved = (load_raw_data.RAW_ROOT, load_raw_data.METADATA_INDEX, load_raw_data.read_metadata)
+        load_raw_data.RAW_ROOT = path.join(self.root, 'data_raw')
+        load_raw_data.METADATA_INDEX = path.join(self.root, 'raw_metadata.txt')
+        load_raw_data._metadata_index = None
+        self.rawdir = path.join(self.root, 'data_raw', 'L32Nu28Nd28', 't10U8')
+        os.makedirs(self.rawdir)
+        self.first  = path.join(self.rawdir, 'a.M800.out.res.h5')
+        self.second = path.join(self.rawdir, 'a.M1200.out.res.h5')
+        write_raw_file(self.first, [1e-6, 3e-6, 2e-6], 1e-3)
+        write_raw_file(self.second, [4e-7, 1e-7], 2e-4)
+        self.reads = []
+        def counting(fname):
+            self.reads.append(path.basename(fname))
+            return self.saved[2](fname)
+        load_raw_data.read_metadata = counting
+
+    def tearDown(self):
+        load_raw_data.RAW_ROOT, load_raw_data.METADATA_INDEX, load_raw_data.read_metadata = self.saved
+        load_raw_data._metadata_index = None
+        shutil.rmtree(self.root)
+
+    def test_values(self):
+        load_raw_data.build_metadata_index()
+        self.assertEqual(load_raw_data.lookup_metadata(self.first), (3e-6, 1e-3))
+        self.assertEqual(load_raw_data.lookup_metadata(self.second), (4e-7, 2e-4))
+
+    def test_index_file_is_reused(self):
+        load_raw_data.build_metadata_index()
+        load_raw_data._metadata_index = None
+        self.assertEqual(load_raw_data.lookup_metadata(self.second), (4e-7, 2e-4))
+        load_raw_data.build_metadata_index()
+        self.assertEqual(sorted(self.reads), ['a.M1200.out.res.h5', 'a.M800.out.res.h5'])
+
+    def test_modified_file(self):
+        load_raw_data.build_metadata_index()
+        time.sleep(0.01)
+        write_raw_file(self.first, [5e-6], 3e-3)
+        os.utime(self.first, (time.time()+1, time.time()+1))
+        self.assertIsNone(load_raw_data.lookup_metadata(self.first))
+        load_raw_data.build_metadata_index()
+        self.assertEqual(load_raw_data.lookup_metadata(self.first), (5e-6, 3e-3))
+        self.assertEqual(self.reads.count('a.M800.out.res.h5'), 2)
+        self.assertEqual(self.reads.count('a.M1200.out.res.h5'), 1)
+
+if __name__ == '__main__':
+    unittest.main()
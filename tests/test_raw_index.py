@@ -0,0 +1,106 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, os, shutil, tempfile, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import utils
+
+try:
+    import h5py
+except ImportError:
+    h5py = None
+
+def write_raw_file(fname, sweeps):
+    ## minimal archive with the iteration list of `sweeps` sweeps, the last sweep is sweeps-1
+    with h5py.File(fname, 'w') as ff:
+        for s in range(sweeps):
+            ff.create_group('/simulation/iteration/%d' % s)
+
+@unittest.skipIf(h5py is None, 'h5py is required to write raw files')
+class RawIndexTest(unittest.TestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.saved = (utils.PROJECT_ROOT, utils.RAW_INDEX_FILE, utils.read_last_sweep)
+        utils.PROJECT_ROOT = self.root
+        utils.RAW_INDEX_FILE = path.join(self.root, 'data_extracted', 'raw_files.txt')
+        utils._raw_index = None
+        os.makedirs(path.join(self.root, 'data_extracted'))
+        self.rawdir = path.join(self.root, 'data_raw', 'L32Nu28Nd28', 't10U8')
+        os.makedirs(self.rawdir)
+        ## the file name order is the opposite of the sweep order
+        write_raw_file(path.join(self.rawdir, 'b.M1200.out.res.h5'), 20)
+        write_raw_file(path.join(self.rawdir, 'z.M1200.out.res.h5'), 8)
+        write_raw_file(path.join(self.rawdir, 'a.M800.out.res.h5'), 4)
+    
+    def tearDown(self):
+        utils.PROJECT_ROOT, utils.RAW_INDEX_FILE, utils.read_last_sweep = self.saved
+        utils._raw_index = None
+        shutil.rmtree(self.root)
+    
+    def test_latest_sweep(self):
+        self.assertEqual(path.basename(utils.find_resfile(32, 0.875, 1200)), 'b.M1200.out.res.h5')
+        self.assertEqual(path.basename(utils.find_resfile(32, 0.875, 1200, last_sweep=7)), 'z.M1200.out.res.h5')
+        self.assertIsNone(utils.find_resfile(32, 0.875, 1600))
+        self.assertEqual([p['M'] for p in utils.list_raw_parameters(L=32)], [800, 1200])
+    
+    def test_last_sweep_read_once(self):
+        utils.raw_index()
+        reads = []
+        read_last_sweep = utils.read_last_sweep
+        def counting(fname):
+            reads.append(path.basename(fname))
+            return read_last_sweep(fname)
+        utils.read_last_sweep = counting
+        utils._raw_index = None
+        write_raw_file(path.join(self.rawdir, 'c.M1600.out.res.h5'), 2)
+        utils.raw_index()
+        self.assertEqual(reads, ['c.M1600.out.res.h5'])
+    
+    def test_new_raw_file_makes_result_stale(self):
+        result = path.join(self.root, 'data_extracted', 'energy_L32_n0.875_M1200.txt')
+        utils.save_text(result, [[0., 1.]], {'L': 32.})
+        key = [32, 0.875, 1200, 1.0, 8, None]
+        utils.save_inputs(result, [['raw', key, utils.raw_stamp(utils.lookup_resfile(*key[:3]))]])
+        self.assertIsNone(utils.stale_reason(result))
+        
+        write_raw_file(path.join(self.rawdir, 'c.M1200.out.res.h5'), 40)
+        self.assertIsNone(utils.stale_reason(result))
+        utils.raw_index(refresh=True)
+        self.assertIsNotNone(utils.stale_reason(result))
+        self.assertEqual(path.basename(utils.find_resfile(32, 0.875, 1200)), 'c.M1200.out.res.h5')
+    
+    def test_lookups_do_not_list_directories(self):
+        result = path.join(self.root, 'data_extracted', 'energy_L32_n0.875_M1200.txt')
+        utils.save_text(result, [[0., 1.]], {'L': 32.})
+        key = [32, 0.875, 1200, 1.0, 8, None]
+        utils.save_inputs(result, [['raw', key, utils.raw_stamp(utils.lookup_resfile(*key[:3]))]])
+        listed = []
+        raw_dir_mtimes = utils.raw_dir_mtimes
+        def counting():
+            listed.append(True)
+            return raw_dir_mtimes()
+        utils.raw_dir_mtimes = counting
+        try:
+            for _ in range(5):
+                self.assertTrue(utils.is_cached(result))
+                utils.find_resfile(32, 0.875, 1200)
+        finally:
+            utils.raw_dir_mtimes = raw_dir_mtimes
+        self.assertEqual(listed, [])
+    
+    def test_unreadable_file_is_skipped(self):
+        bad = path.join(self.rawdir, 'y.M1200.out.res.h5')
+        with open(bad, 'w') as ff:
+            ff.write('not an archive')
+        utils.raw_index(refresh=True)
+        self.assertEqual([f[0] for f in sorted(utils.raw_index()[(32, 28, '10', 8, 1200)])], [-1, 7, 19])
+        self.assertEqual(path.basename(utils.find_resfile(32, 0.875, 1200)), 'b.M1200.out.res.h5')
+        self.assertEqual(path.basename(utils.find_resfile(32, 0.875, 1200, last_sweep=-1)), 'y.M1200.out.res.h5')
+
+if __name__ == '__main__':
+    unittest.main()
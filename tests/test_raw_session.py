@@ -0,0 +1,86 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import pyalps_dset
+import utils, load_raw_data, cache_builder
+from cache_builder import Task
+
+RESFILE = path.join(utils.PROJECT_ROOT, 'data_raw', 'L32Nu28Nd28', 't1U8', 'ladder.L32.M800.out.res.h5')
+
+class CountingReader(object):
+    ## used in place of pyalps by RawSession, records the observables of every read of a raw file
+    DataSet = pyalps_dset.DataSet
+    flatten = staticmethod(pyalps_dset.flatten)
+
+    def __init__(self):
+        self.reads = []
+
+    def loadEigenstateMeasurements(self, files, what):
+        self.reads.append(sorted(what))
+        sets = []
+        for obs in what:
+            d = pyalps_dset.DataSet()
+            d.props = {'observable': obs, 'filename': files[0], 'L': 32.}
+            d.x = np.arange(4.)
+            d.y = [np.ones(4)]
+            sets.append(d)
+        return [sets]
+
+class EvaluatorLoad(object):
+    ## replaces the load module, every result reads the observables of its evaluator
+    def result(self, what, **kwargs):
+        return load_raw_data.loadEigenstateMeasurements([RESFILE], load_raw_data.EVALUATOR_OBSERVABLES[what])
+
+class RawSessionTest(unittest.TestCase):
+    def setUp(self):
+        self.reader = CountingReader()
+        self.saved = (load_raw_data.import_pyalps, load_raw_data.lookup_metadata, utils.lookup_resfile, cache_builder.load)
+        load_raw_data.import_pyalps = lambda: self.reader
+        load_raw_data.lookup_metadata = lambda fname: (1e-6, 1e-4)
+        utils.lookup_resfile = lambda *args: RESFILE
+        cache_builder.load = EvaluatorLoad()
+
+    def tearDown(self):
+        load_raw_data.import_pyalps, load_raw_data.lookup_metadata, utils.lookup_resfile, cache_builder.load = self.saved
+
+    def test_one_read_per_session(self):
+        what = load_raw_data.EVALUATOR_OBSERVABLES
+        with load_raw_data.raw_session(RESFILE, set(what['density'] + what['energy'])):
+            density = load_raw_data.loadEigenstateMeasurements([RESFILE], what['density'])
+            energy  = load_raw_data.loadEigenstateMeasurements([RESFILE], what['energy'])
+        self.assertEqual(self.reader.reads, [sorted(what['density'] + what['energy'])])
+        self.assertEqual(sorted(d.props['observable'] for d in density[0]), sorted(what['density']))
+        self.assertEqual(energy[0][0].props['EnergyVariance'], 1e-4)
+        self.assertEqual(energy[0][0].props['TruncatedWeight'], 1e-6)
+
+    def test_copies_are_independent(self):
+        with load_raw_data.raw_session(RESFILE, ['Energy']):
+            first  = load_raw_data.loadEigenstateMeasurements([RESFILE], ['Energy'])[0][0]
+            first.props['observable'] = 'modified'
+            second = load_raw_data.loadEigenstateMeasurements([RESFILE], ['Energy'])[0][0]
+        self.assertEqual(second.props['observable'], 'Energy')
+
+    def test_outside_the_session(self):
+        ## other observables and calls after the session read the file again
+        with load_raw_data.raw_session(RESFILE, ['Energy']):
+            load_raw_data.loadEigenstateMeasurements([RESFILE], ['Local density up'])
+        load_raw_data.loadEigenstateMeasurements([RESFILE], ['Energy'])
+        self.assertEqual(self.reader.reads, [['Local density up'], ['Energy']])
+
+    def test_batch_shares_one_read(self):
+        tasks = [Task('result', what, L=32, filling=0.875, bond_dim=800) for what in ['density', 'densdens', 'energy']]
+        results = cache_builder.run_tasks(tasks)
+        self.assertEqual([error for _, _, error in results], [None]*len(tasks))
+        self.assertEqual(len(self.reader.reads), 1)
+        self.assertEqual(set(self.reader.reads[0]), cache_builder.batch_observables(tasks))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import resampling
+
+def noisy_line(n=8, columns=3, seed=0):
+    rng = np.random.RandomState(seed)
+    x = np.linspace(1e-4, 1e-3, n)
+    y = np.array([2. - 30.*x + 1e-3*k for k in range(columns)]).T + 1e-3 * rng.randn(n, columns)
+    return x, y
+
+class ResamplingTest(unittest.TestCase):
+    def test_jackknife_of_exact_line(self):
+        x = np.linspace(0., 1., 6)
+        err = resampling.jackknife_polyfit(x, 3. + 2.*x, 1)
+        self.assertEqual(err.shape, (2, 1))
+        np.testing.assert_allclose(err, 0., atol=1e-12)
+
+    def test_jackknife_matches_explicit_loop(self):
+        x, y = noisy_line()
+        sel = np.ones(len(x), dtype=bool)
+        sel[-2:] = False
+        for deg in [1, 2]:
+            err = resampling.jackknife_polyfit(x, y, deg, sel)
+            xs, ys = x[sel], y[sel]
+            n = len(xs)
+            coeffs = np.array([ np.polyfit(np.delete(xs, k), np.delete(ys, k, axis=0), deg) for k in range(n) ])
+            ref = np.sqrt( (n-1.)/n * np.sum((coeffs - coeffs.mean(axis=0))**2, axis=0) )
+            np.testing.assert_allclose(err, ref, rtol=1e-6)
+
+    def test_jackknife_of_linear_fit(self):
+        ## for a straight line the jackknife variance of the slope is close to the least-squares variance
+        rng = np.random.RandomState(1)
+        x = np.linspace(0., 1., 200)
+        y = 1. + 0.5*x + 0.1 * rng.randn(len(x))
+        err = resampling.jackknife_polyfit(x, y, 1)
+        residuals = y - np.polyval(np.polyfit(x, y, 1), x)
+        sigma2 = np.sum(residuals**2) / (len(x) - 2)
+        slope_err = np.sqrt(sigma2 / np.sum((x - x.mean())**2))
+        np.testing.assert_allclose(err[0,0], slope_err, rtol=0.2)
+
+    def test_too_few_points(self):
+        x, y = noisy_line(n=2)
+        self.assertTrue(np.all(np.isnan(resampling.jackknife_polyfit(x, y, 1))))
+
+    def test_bootstrap_matches_explicit_loop(self):
+        x, y = noisy_line()
+        err = resampling.bootstrap_polyfit(x, y, 1, num_resamples=50, seed=3)
+        idx = np.random.RandomState(3).randint(0, len(x), size=(50, len(x)))
+        coeffs = np.array([ np.polyfit(x[i], y[i], 1) for i in idx if len(set(i)) >= 2 ])
+        np.testing.assert_allclose(err, np.std(coeffs, axis=0, ddof=1), rtol=1e-6)
+        np.testing.assert_array_equal(err, resampling.bootstrap_polyfit(x, y, 1, num_resamples=50, seed=3, processes=2))
+
+    def test_error_mode(self):
+        x, y = noisy_line()
+        np.testing.assert_array_equal(resampling.polyfit_error(x, y, 1, mode='jackknife'), resampling.jackknife_polyfit(x, y, 1))
+        self.assertRaises(Exception, resampling.polyfit_error, x, y, 1, mode='unknown')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,227 @@
+# Copyright (C) 2015 Institute for Theoretical Physics, ETH Zurich
+#               2015 by Michele Dolfi <dolfim@phys.ethz.ch>
+#  Distributed under the Boost Software License, Version 1.0.
+#      (See accompanying file LICENSE_1_0.txt or copy at
+#          http://www.boost.org/LICENSE_1_0.txt)
+
+import sys, os, json, shutil, tempfile, unittest
+from os import path
+sys.path.insert(0, path.join(path.dirname(path.abspath(__file__)), '..', 'scripts'))
+
+import numpy as np
+import utils, resampling
+
+class CacheLoadTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.fname = path.join(self.tmpdir, 'energy_L16_n0.5_M400.txt')
+        self.data = np.arange(6.).reshape(3,2)
+        self.props = {'L': 16., 'observable': 'Energy', 'bond_dims': np.arange(3.)}
+        utils.save_text(self.fname, self.data, self.props)
+        self.save_binary = utils.save_binary
+    
+    def tearDown(self):
+        utils.save_binary = self.save_binary
+        shutil.rmtree(self.tmpdir)
+    
+    def test_migrates_text_to_binary(self):
+        d, props = utils.load(self.fname)
+        self.assertTrue(path.exists(utils.binary_filename(self.fname)))
+        d2, props2 = utils.load(self.fname)
+        np.testing.assert_array_equal(d, d2)
+        self.assertEqual(sorted(props), sorted(props2))
+    
+    def test_read_only_cache(self):
+        def fail(fname, d, props):
+            raise OSError(13, 'Permission denied', fname)
+        utils.save_binary = fail
+        d, props = utils.load(self.fname)
+        np.testing.assert_array_equal(d, self.data)
+        self.assertEqual(props['L'], 16.)
+        self.assertFalse(path.exists(utils.binary_filename(self.fname)))
+
+class BinaryFormatTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.data = np.arange(6.).reshape(3,2)
+        self.props = {
+            'L': 96, 'filling': 0.875, 'Energy': -1./3, 'EnergyVariance': np.float64(2.5e-7), 'Nup_total': np.int64(84),
+            'observable': 'Density Correlation', 'extrap_type': 'extrap_variance_deg2_numAll', 'enabled': True,
+            'fit_numpoints': None, 'fit_range': [32, 192], 'shifts': (-1, 0, 1), 'bond_dims': np.array([1200., 2000., 2800.]),
+            'fitted_coeff': np.array([1, -2, 3]), 'empty': np.array([]), 'missing': np.nan,
+            'correlation_type': utils.Averaged(), 'start': utils.FixedStart(18),
+        }
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+    
+    def assertSameProps(self, props, ref):
+        self.assertEqual(sorted(props), sorted(ref))
+        for k in ref:
+            self.assertTrue(type(props[k]) is type(ref[k]), k)
+            if isinstance(ref[k], str):
+                self.assertEqual(props[k], ref[k])
+            else:
+                np.testing.assert_allclose(props[k], ref[k], rtol=1e-11)
+    
+    def test_text_and_binary_props(self):
+        fname = path.join(self.tmpdir, 'result.txt')
+        utils.save_text(fname, self.data, self.props)
+        utils.save_binary(utils.binary_filename(fname), self.data, self.props)
+        d_txt, p_txt = utils.load_text(fname)
+        d_bin, p_bin = utils.load_binary(utils.binary_filename(fname))
+        np.testing.assert_array_equal(d_bin, d_txt)
+        self.assertSameProps(p_bin, p_txt)
+        ## the binary format keeps the full precision
+        self.assertEqual(p_bin['Energy'], -1./3)
+        self.assertEqual(p_bin['EnergyVariance'], 2.5e-7)
+    
+    def test_format_version(self):
+        fname = path.join(self.tmpdir, 'result.npz')
+        utils.save_binary(fname, self.data, self.props)
+        with np.load(fname) as ff:
+            self.assertEqual(int(ff['format']), utils.BINARY_FORMAT_VERSION)
+    
+    def test_first_format(self):
+        ## files without format member stored the json types of the props
+        fname = path.join(self.tmpdir, 'result.npz')
+        scalars = {'L': 96, 'observable': 'Energy', 'enabled': True, 'correlation_type': 'avg'}
+        with open(fname, 'wb') as ff:
+            np.savez(ff, data=self.data, props=np.array(json.dumps(scalars)), **{'prop:bond_dims': np.array([1200, 2000])})
+        d, props = utils.load_binary(fname)
+        self.assertSameProps(props, {'L': 96., 'observable': 'Energy', 'correlation_type': 'avg', 'bond_dims': np.array([1200., 2000.])})
+
+class CacheKeyTest(unittest.TestCase):
+    def setUp(self):
+        self.versions = dict(utils.EVALUATOR_VERSIONS)
+        self.settings = (utils.SYMM_MIDDLE_THRESHOLD, resampling.NUM_RESAMPLES, resampling.SEED)
+        extrap = utils.Extrapolation('bonddim', 2, None)
+        bootstrap = utils.Extrapolation('bonddim', 2, None, error_mode='bootstrap')
+        self.results = {
+            'energy'        : ('extrap_energy', dict(L=32, filling=0.875, bond_dim=extrap)),
+            'energy_boot'   : ('extrap_energy', dict(L=32, filling=0.875, bond_dim=bootstrap)),
+            'density'       : ('extrap_density', dict(L=32, filling=0.875, bond_dim=extrap, at_x=16)),
+            'densdens'      : ('extrap_densdens', dict(L=32, filling=0.875, bond_dim=extrap, at_x=16, correlation_type=utils.FixedStart(8))),
+            'fit'           : ('density_fit', dict(L=32, filling=0.875, bond_dim=2000)),
+            'fit_extrap'    : ('density_fit', dict(L=32, filling=0.875, bond_dim=extrap)),
+            'amplitudes'    : ('density_amplitudes', dict(filling=0.875, bond_dim=extrap, amplitude_points=None)),
+            'amplitudes_M'  : ('density_amplitudes', dict(filling=0.875, bond_dim=2000, amplitude_points=None, error_mode='bootstrap')),
+        }
+    
+    def tearDown(self):
+        utils.EVALUATOR_VERSIONS.clear()
+        utils.EVALUATOR_VERSIONS.update(self.versions)
+        utils.SYMM_MIDDLE_THRESHOLD, resampling.NUM_RESAMPLES, resampling.SEED = self.settings
+    
+    def keys(self):
+        return dict((k, utils.cache_key(what, **kwargs)) for k, (what, kwargs) in self.results.items())
+    
+    def changed(self, before):
+        after = self.keys()
+        return sorted(k for k in before if before[k] != after[k])
+    
+    def test_settings_change_only_their_users(self):
+        before = self.keys()
+        utils.SYMM_MIDDLE_THRESHOLD = 1e-4
+        self.assertEqual(self.changed(before), ['amplitudes', 'density', 'fit_extrap'])
+        utils.SYMM_MIDDLE_THRESHOLD = self.settings[0]
+        resampling.NUM_RESAMPLES = 100
+        self.assertEqual(self.changed(before), ['amplitudes_M', 'energy_boot'])
+    
+    def test_upstream_versions(self):
+        before = self.keys()
+        utils.EVALUATOR_VERSIONS['density'] += 1
+        self.assertEqual(self.changed(before), ['amplitudes', 'amplitudes_M', 'density', 'fit', 'fit_extrap'])
+        utils.EVALUATOR_VERSIONS['density'] -= 1
+        utils.EVALUATOR_VERSIONS['density_fit'] += 1
+        self.assertEqual(self.changed(before), ['amplitudes', 'amplitudes_M', 'fit', 'fit_extrap'])
+    
+    def test_readable_names(self):
+        ## single results keep their readable name as long as the settings they use are the defaults
+        fname = utils.filename('density_fit', L=32, filling=0.875, bond_dim=2000)
+        self.assertEqual(path.basename(fname), 'density_fit_L32_n0.875_M2000.txt')
+        utils.SYMM_MIDDLE_THRESHOLD = 1e-4
+        resampling.NUM_RESAMPLES = 100
+        self.assertEqual(utils.filename('density_fit', L=32, filling=0.875, bond_dim=2000), fname)
+        utils.EVALUATOR_VERSIONS['density'] += 1
+        self.assertNotEqual(utils.filename('density_fit', L=32, filling=0.875, bond_dim=2000), fname)
+
+    def test_published_names(self):
+        ## published results, without recorded inputs, keep their readable name after a version change,
+        ## results computed here are recomputed under the hashed name
+        root = tempfile.mkdtemp()
+        saved_root = utils.PROJECT_ROOT
+        try:
+            utils.PROJECT_ROOT = root
+            os.makedirs(path.join(root, 'data_extracted'))
+            kwargs = dict(L=32, filling=0.875, bond_dim=800, correlation_type=utils.FixedStart(8))
+            utils.EVALUATOR_VERSIONS['densdens'] = 1
+            readable = utils.filename('densdens', **kwargs)
+            utils.save(readable, np.ones((4,2)), {'L': 32.})
+            utils.EVALUATOR_VERSIONS['densdens'] = 2
+            self.assertEqual(utils.filename('densdens', **kwargs), readable)
+            utils.SYMM_MIDDLE_THRESHOLD = 1e-4
+            self.assertEqual(utils.filename('densdens', **kwargs), readable)
+            utils.save_inputs(readable, [])
+            self.assertNotEqual(utils.filename('densdens', **kwargs), readable)
+        finally:
+            utils.PROJECT_ROOT = saved_root
+            shutil.rmtree(root)
+
+class MemoryCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.calls = []
+    
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+    
+    def evaluator(self, name, size=100):
+        ## result of 800 bytes of data and one prop, accounted as 900 bytes
+        def evaluate():
+            self.calls.append(name)
+            return np.ones(size), {'name': name}
+        return evaluate
+    
+    def test_least_recently_used_is_evicted(self):
+        cache = utils.MemoryCache(max_bytes=2000)
+        for name in ['a', 'b', 'a', 'c', 'a', 'b']:
+            d, props = cache.lookup(name, self.evaluator(name))
+            self.assertEqual(props['name'], name)
+        ## `b` was evicted by `c` because `a` was used more recently, then `b` evicts `c`
+        self.assertEqual(self.calls, ['a', 'b', 'c', 'b'])
+        self.assertEqual(list(cache.entries), ['a', 'b'])
+        self.assertEqual(cache.stats(), {'entries': 2, 'bytes': 1800, 'hits': 2, 'misses': 4, 'evictions': 2})
+    
+    def test_results_are_read_only(self):
+        cache = utils.MemoryCache(max_bytes=2000)
+        cache.lookup('a', self.evaluator('a'))
+        d, props = cache.lookup('a', self.evaluator('a'))
+        self.assertRaises(ValueError, d.__setitem__, 0, 2.)
+        props['name'] = 'changed'
+        self.assertEqual(cache.lookup('a', self.evaluator('a'))[1]['name'], 'a')
+        self.assertEqual(self.calls, ['a'])
+    
+    def test_large_and_disabled(self):
+        cache = utils.MemoryCache(max_bytes=2000)
+        cache.lookup('large', self.evaluator('large', size=1000))
+        cache.lookup('large', self.evaluator('large', size=1000))
+        disabled = utils.MemoryCache(max_bytes=0)
+        disabled.lookup('a', self.evaluator('a'))
+        disabled.lookup('a', self.evaluator('a'))
+        self.assertEqual(self.calls, ['large', 'large', 'a', 'a'])
+        self.assertEqual(cache.stats()['entries'] + disabled.stats()['entries'], 0)
+    
+    def test_modified_file_is_reloaded(self):
+        fname = path.join(self.tmpdir, 'result.txt')
+        utils.save_text(fname, np.ones((2,2)), {'L': 16.})
+        cache = utils.MemoryCache(max_bytes=2000)
+        cache.lookup(fname, self.evaluator('first'))
+        self.assertEqual(cache.lookup(fname, self.evaluator('second'))[1]['name'], 'first')
+        mtime = path.getmtime(fname) + 10
+        os.utime(fname, (mtime, mtime))
+        self.assertEqual(cache.lookup(fname, self.evaluator('second'))[1]['name'], 'second')
+        self.assertEqual(cache.stats()['bytes'], 900)
+
+if __name__ == '__main__':
+    unittest.main()